@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the damage formulas and the sampling paths.
+
+    python ffxiv_bench.py [--quick] [--output results.json]
+                          [--baseline baseline.json] [--tolerance 0.2]
+
+Three groups of benchmarks:
+- latency: time per call of calc_action_damage, calc_dot_tick_damage and
+  calc_aa_damage for each example player (best of a few repeats, so
+  noise from the rest of the machine mostly drops out)
+- throughput: hits per second of generate_sample_hits,
+  generate_sample_hits_batch and multi_hit_damage_sample at several n
+- startup: time to import ffxiv_math and to load the game data in a
+  fresh interpreter, with and without the pickled data cache
+
+The results are written as JSON. Given a baseline (the JSON of an
+earlier run), every benchmark is compared against it, and the exit
+status is 1 if any of them got slower by more than the tolerance.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+import ffxiv_math as fm
+
+# Example players: (name, job, playerstats, weaponinfo)
+def example_players():
+    return [
+        ("sch90", "SCH", fm.get_example_playerstats_level90_sch(), fm.get_example_weaponstats_level90()),
+        ("blm90", "BLM", fm.get_example_playerstats_level90_blm(), fm.get_example_weaponstats_level90()),
+        ("gnb90", "GNB", fm.get_example_playerstats_level90_gnb(), fm.get_example_weaponstats_level90()),
+        ("sch80", "SCH", fm.get_example_playerstats_level80_sch(), fm.get_example_weaponstats_level80()),
+        ("blm80", "BLM", fm.get_example_playerstats_level80_blm(), fm.get_example_weaponstats_level80()),
+        ("drg80", "DRG", fm.get_example_playerstats_level80_drg(), fm.get_example_weaponstats_level80()),
+    ]
+
+EXAMPLE_BUFFS = [fm.PartyBuffs.Divination, fm.PartyBuffs.ChainStrategem,
+                 fm.PartyBuffs.BattleVoice]
+EXAMPLE_POTENCIES = [310, 400, 500, 600]
+
+# Seconds per call of func, the best of repeat timings of enough calls
+# to take at least min_time seconds
+def time_per_call(func, repeat=5, min_time=0.05):
+    timer = timeit.Timer(func)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed > min_time / 10 else 10
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+def _best_time(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def _result(value, unit, higher_is_better=False):
+    return {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+
+def bench_latency(repeat=5, min_time=0.05):
+    """ Microseconds per call of each damage function, per example player,
+        unbuffed and with EXAMPLE_BUFFS. """
+    results = {}
+    fm.load_game_data()
+    for name, job, stats, weapon in example_players():
+        for label, buffs in (("", []), ("_buffed", EXAMPLE_BUFFS)):
+            calls = {
+                "action": lambda: fm.calc_action_damage(
+                    400, job, weapon, stats, buffs, fm.CritType.Crit,
+                    fm.DHType.DirectHit, 10000),
+                "dot": lambda: fm.calc_dot_tick_damage(
+                    50, job, weapon, stats, buffs, fm.CritType.Crit,
+                    fm.DHType.DirectHit, 10000),
+                "aa": lambda: fm.calc_aa_damage(
+                    job, weapon, stats, buffs, fm.CritType.Crit,
+                    fm.DHType.DirectHit, 10000),
+            }
+            for kind, call in calls.items():
+                key = "latency.{}.{}{}".format(kind, name, label)
+                results[key] = _result(1e6 * time_per_call(call, repeat, min_time), "us/call")
+    return results
+
+def bench_throughput(ns=(1000, 10000, 100000), repeat=3):
+    """ Hits per second of the sampling functions for each n. """
+    import numpy as np
+    results = {}
+    name, job, stats, weapon = example_players()[0]
+    rng = np.random.default_rng(0)
+    for n in ns:
+        samplers = {
+            "generate_sample_hits": lambda: fm.generate_sample_hits(
+                n, 400, job, weapon, stats, EXAMPLE_BUFFS),
+            "generate_sample_hits_batch": lambda: fm.generate_sample_hits_batch(
+                n, 400, job, weapon, stats, EXAMPLE_BUFFS, rng=rng),
+            # n hits: n // 4 samples of 4 hits each
+            "multi_hit_damage_sample": lambda: fm.multi_hit_damage_sample(
+                n // len(EXAMPLE_POTENCIES), EXAMPLE_POTENCIES, job, weapon,
+                stats, EXAMPLE_BUFFS),
+        }
+        for sampler, call in samplers.items():
+            elapsed = _best_time(call, repeat)
+            key = "throughput.{}.n{}".format(sampler, n)
+            results[key] = _result(n / elapsed, "hits/s", higher_is_better=True)
+    return results
+
+_STARTUP_SCRIPTS = {
+    "import": "import ffxiv_math",
+    "load": "import ffxiv_math; ffxiv_math.load_game_data()",
+    "load_nocache": "import ffxiv_math; ffxiv_math.load_game_data(use_cache=False)",
+}
+
+def bench_startup(repeat=5):
+    """ Milliseconds to run each of _STARTUP_SCRIPTS in a fresh interpreter,
+        minus the time of an empty one. The data cache goes to a temporary
+        directory, so the "load" runs after the first one hit a warm cache. """
+    results = {}
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as cache_dir:
+        env = dict(os.environ, FFXIV_MATH_CACHE_DIR=cache_dir,
+                   PYTHONPATH=package_dir + os.pathsep + os.environ.get("PYTHONPATH", ""))
+        def run(script):
+            return _best_time(lambda: subprocess.run(
+                [sys.executable, "-c", script], env=env, check=True), repeat)
+        empty = run("pass")
+        for name, script in _STARTUP_SCRIPTS.items():
+            results["startup." + name] = _result(1000 * max(0.0, run(script) - empty), "ms")
+    return results
+
+def run_benchmarks(quick=False):
+    """ Run all benchmarks, returns the JSON-ready results. """
+    if quick:
+        ns, repeat, min_time = (1000, 10000), 3, 0.01
+    else:
+        ns, repeat, min_time = (1000, 10000, 100000), 5, 0.05
+    benchmarks = {}
+    benchmarks.update(bench_latency(repeat, min_time))
+    benchmarks.update(bench_throughput(ns, repeat=min(repeat, 3)))
+    benchmarks.update(bench_startup(repeat))
+    return {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "platform": platform.platform(),
+            "data_version": fm.get_data_version(),
+            "quick": quick,
+        },
+        "benchmarks": benchmarks,
+    }
+
+# Relative change of every benchmark present in both runs, positive
+# means worse. Returns [(name, baseline, current, change)].
+def compare(results, baseline):
+    changes = []
+    current = results["benchmarks"]
+    for name, base in sorted(baseline["benchmarks"].items()):
+        if name not in current or not base["value"]:
+            continue
+        value = current[name]["value"]
+        if base.get("higher_is_better"):
+            change = base["value"] / value - 1 if value else float("inf")
+        else:
+            change = value / base["value"] - 1
+        changes.append((name, base["value"], value, change))
+    return changes
+
+def regressions(changes, tolerance=0.2):
+    return [c for c in changes if c[3] > tolerance]
+
+def format_comparison(changes, tolerance=0.2):
+    lines = []
+    width = max([len(c[0]) for c in changes] + [9])
+    lines.append("{:<{w}} {:>12} {:>12} {:>8}".format("benchmark", "baseline", "current", "change", w=width))
+    for name, base, value, change in changes:
+        flag = "  REGRESSION" if change > tolerance else ""
+        lines.append("{:<{w}} {:>12.4g} {:>12.4g} {:>+7.1%}{}".format(
+            name, base, value, change, flag, w=width))
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the ffxiv_math damage formulas")
+    parser.add_argument("--output", "-o", help="Write the JSON results here (default: stdout)")
+    parser.add_argument("--baseline", "-b", help="JSON of an earlier run to compare against")
+    parser.add_argument("--tolerance", "-t", type=float, default=0.2,
+                        help="Allowed slowdown before a benchmark counts as a regression")
+    parser.add_argument("--quick", action="store_true", help="Fewer and shorter runs")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.quick)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["meta"].get("data_version") != results["meta"]["data_version"]:
+            print("Note: the baseline was run on other game data", file=sys.stderr)
+        changes = compare(results, baseline)
+        print(format_comparison(changes, args.tolerance), file=sys.stderr)
+        if regressions(changes, args.tolerance):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
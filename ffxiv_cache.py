@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent, content-addressed cache of expensive results.
+
+    cache = ResultCache()
+
+    @cache.cached
+    def distribution(potency, job, weaponinfo, playerstats, buffs):
+        return calc_damage_distribution(...)
+
+    key = cache.key("sweep", potencies=(100, 400))
+    result = cache.get_or_compute(key, lambda: sweep_damage((100, 400)))
+
+Keys are SHA-256 hashes of a canonical form of the inputs (PlayerStats,
+WeaponInfo, Buffs, enums, dataclasses, NumPy arrays, and containers and
+plain values of those), together with FORMULA_VERSION and the
+get_data_version() of the loaded CSV tables. A change to the game data
+therefore never returns a stale result. Bump FORMULA_VERSION when a
+formula changes.
+
+Each entry is a directory named after its key. The value is pickled,
+except that NumPy arrays of at least MMAP_MIN_BYTES are stored next to
+it as .npy files and come back as read-only memory maps, so a large
+cached array costs no memory until it is read.
+
+Several processes can share one cache directory without locks:
+- Entries are written to a temporary directory and renamed into place,
+  so readers see a whole entry or nothing. If two processes compute the
+  same entry, the first rename wins and the other copy is dropped.
+- A hit updates the entry's mtime, which is the LRU order.
+- Eviction (oldest mtime first, until the total is under max_bytes)
+  renames an entry away before deleting it. Only one process can win
+  that rename, and a reader that loses the race just sees a miss. On
+  POSIX, memory maps of an evicted entry stay valid.
+- Listing the whole cache is slow once it's large, so a ResultCache
+  scans it once and then adds up what it writes itself; it only evicts
+  (and scans again) when that estimate is over max_bytes, and then down
+  to EVICT_FRACTION of max_bytes. Entries that
+  other processes wrote since the last scan can therefore push the
+  cache over max_bytes until one of the processes evicts.
+"""
+
+from dataclasses import dataclass, fields, is_dataclass
+from enum import Enum
+import hashlib
+import os
+import pickle
+import shutil
+import time
+import uuid
+
+import numpy as np
+
+import ffxiv_math as fm
+
+# Part of every key; bump it when a formula changes
+FORMULA_VERSION = 2
+# Arrays at least this large get their own memory-mapped .npy file
+MMAP_MIN_BYTES = 1 << 16
+DEFAULT_MAX_BYTES = 1 << 30
+# Once over max_bytes, evict down to this fraction of it, so the next
+# few puts don't each scan the cache again
+EVICT_FRACTION = 0.9
+
+_VALUE_FILE = "value.pickle"
+
+def default_cache_dir():
+    """ $FFXIV_MATH_RESULT_CACHE_DIR, or "ffxiv_math/results" in the user's
+        cache directory: $XDG_CACHE_HOME, %LOCALAPPDATA% on Windows, and
+        ~/.cache otherwise. """
+    directory = os.environ.get("FFXIV_MATH_RESULT_CACHE_DIR")
+    if directory:
+        return directory
+    user_cache_dir = os.environ.get("XDG_CACHE_HOME")
+    if not user_cache_dir and os.name == "nt":
+        user_cache_dir = os.environ.get("LOCALAPPDATA")
+    if not user_cache_dir:
+        user_cache_dir = os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(user_cache_dir, "ffxiv_math", "results")
+
+def canonical(obj):
+    """ A nested tuple of plain values that only depends on the contents
+        of obj, for hashing. Raises TypeError for anything it can't
+        describe that way (e.g. a lambda as a stat buff). """
+    if obj is None or isinstance(obj, (bool, int, float, str, bytes)):
+        return (type(obj).__name__, obj)
+    if isinstance(obj, Enum):
+        return ("enum", _qualified_name(type(obj)), obj.name)
+    if isinstance(obj, np.generic):
+        return ("np", obj.dtype.str, obj.item())
+    if isinstance(obj, np.ndarray):
+        data = np.ascontiguousarray(obj)
+        return ("ndarray", data.dtype.str, data.shape,
+                hashlib.sha256(data.tobytes()).hexdigest())
+    if isinstance(obj, fm.PlayerStats):
+        return ("PlayerStats", obj.level, obj.to_tuple())
+    if isinstance(obj, fm.Buff):
+        # The type, the buff values and the _fields of a subclass
+        return ("Buff", tuple(canonical(a) for a in obj._key()))
+    if is_dataclass(obj) and not isinstance(obj, type):
+        return ("dataclass", _qualified_name(type(obj)),
+                tuple((f.name, canonical(getattr(obj, f.name))) for f in fields(obj)))
+    if isinstance(obj, (list, tuple)):
+        return (type(obj).__name__, tuple(canonical(x) for x in obj))
+    if isinstance(obj, (set, frozenset)):
+        return ("set", tuple(sorted(repr(canonical(x)) for x in obj)))
+    if isinstance(obj, dict):
+        return ("dict", tuple(sorted((repr(canonical(k)), canonical(v))
+                                     for k, v in obj.items())))
+    # Module-level functions and classes, e.g. a stat buff function
+    qualname = getattr(obj, "__qualname__", None)
+    if callable(obj) and qualname and "<" not in qualname:
+        return ("callable", _qualified_name(obj))
+    raise TypeError("Can't make a cache key from {!r}".format(obj))
+
+def _qualified_name(obj):
+    return "{}.{}".format(obj.__module__, obj.__qualname__)
+
+def input_hash(*args, **kwargs):
+    """ SHA-256 of the canonical inputs, FORMULA_VERSION and the game
+        data version. """
+    key = (FORMULA_VERSION, fm.get_data_version(),
+           canonical(args), canonical(kwargs))
+    return hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    puts: int = 0
+    evictions: int = 0
+
+class _Pickler(pickle.Pickler):
+    """ Pickles large arrays as references to .npy files. """
+    def __init__(self, file, directory):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.directory = directory
+        self.n_arrays = 0
+
+    def persistent_id(self, obj):
+        if (type(obj) is np.ndarray and obj.nbytes >= MMAP_MIN_BYTES
+                and not obj.dtype.hasobject):
+            name = "{}.npy".format(self.n_arrays)
+            self.n_arrays += 1
+            np.save(os.path.join(self.directory, name), obj, allow_pickle=False)
+            return name
+        return None
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, file, directory, mmap):
+        super().__init__(file)
+        self.directory = directory
+        self.mmap_mode = "r" if mmap else None
+
+    def persistent_load(self, name):
+        return np.load(os.path.join(self.directory, name),
+                       mmap_mode=self.mmap_mode, allow_pickle=False)
+
+class ResultCache:
+    """ On-disk cache of pickled results, see the module docstring.
+        With mmap=False, large arrays are read into memory instead. """
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES, mmap=True):
+        self.directory = default_cache_dir() if directory is None else directory
+        self.max_bytes = max_bytes
+        self.mmap = mmap
+        self.stats = CacheStats()
+        # Size of the cache at the last scan plus what was written since,
+        # None until the first put
+        self._size_estimate = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, *args, **kwargs):
+        return input_hash(*args, **kwargs)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def __contains__(self, key):
+        return os.path.isfile(os.path.join(self._path(key), _VALUE_FILE))
+
+    def _load(self, key):
+        path = self._path(key)
+        try:
+            with open(os.path.join(path, _VALUE_FILE), "rb") as f:
+                value = _Unpickler(f, path, self.mmap).load()
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            # Missing, or evicted by another process while reading
+            return _MISSING
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def get(self, key, default=None):
+        value = self._load(key)
+        if value is _MISSING:
+            self.stats.misses += 1
+            return default
+        self.stats.hits += 1
+        return value
+
+    def put(self, key, value):
+        """ Store value under key (unless another process already did). """
+        path = self._path(key)
+        tmp_path = os.path.join(self.directory, ".tmp-{}".format(uuid.uuid4().hex))
+        os.makedirs(tmp_path)
+        written = 0
+        try:
+            with open(os.path.join(tmp_path, _VALUE_FILE), "wb") as f:
+                _Pickler(f, tmp_path).dump(value)
+            size = _entry_size(tmp_path)
+            try:
+                os.rename(tmp_path, path)
+            except OSError:
+                # Already there, from another process
+                pass
+            else:
+                self.stats.puts += 1
+                written = size
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        if self.max_bytes is not None:
+            if self._size_estimate is None:
+                self._size_estimate = self.size()
+            else:
+                self._size_estimate += written
+            if self._size_estimate > self.max_bytes:
+                self.evict(int(EVICT_FRACTION * self.max_bytes))
+
+    def get_or_compute(self, key, compute):
+        """ The cached value of key, or compute() stored under it. The
+            value is read back from the cache after storing it, so it's
+            the same (memory-mapped) kind of object either way. """
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value)
+            stored = self._load(key)
+            # Missing if it was evicted right away (larger than max_bytes)
+            if stored is not _MISSING:
+                value = stored
+        return value
+
+    def cached(self, func):
+        """ Decorator: cache func's results by its name and arguments. """
+        name = _qualified_name(func)
+        def wrapper(*args, **kwargs):
+            return self.get_or_compute(self.key(name, *args, **kwargs),
+                                       lambda: func(*args, **kwargs))
+        wrapper.__name__ = func.__name__
+        wrapper.__qualname__ = func.__qualname__
+        wrapper.__doc__ = func.__doc__
+        wrapper.__wrapped__ = func
+        return wrapper
+
+    def entries(self):
+        """ [(mtime, size in bytes, key)] of every entry, oldest first. """
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return entries
+        for name in names:
+            if name.startswith("."):
+                continue
+            path = self._path(name)
+            try:
+                mtime = os.stat(path).st_mtime
+                size = _entry_size(path)
+            except OSError:
+                continue
+            entries.append((mtime, size, name))
+        entries.sort()
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def _remove(self, key):
+        """ Rename the entry away, then delete it. False if another
+            process got to it first. """
+        trash = os.path.join(self.directory, ".del-{}".format(uuid.uuid4().hex))
+        try:
+            os.rename(self._path(key), trash)
+        except OSError:
+            return False
+        shutil.rmtree(trash, ignore_errors=True)
+        return True
+
+    def evict(self, max_bytes=None):
+        """ Remove the least recently used entries until the cache is
+            at most max_bytes (self.max_bytes by default). Returns the
+            number of bytes freed. """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        freed = 0
+        for mtime, size, key in entries:
+            if total - freed <= max_bytes:
+                break
+            if self._remove(key):
+                freed += size
+                self.stats.evictions += 1
+        self._size_estimate = total - freed
+        return freed
+
+    def clear(self):
+        for _, _, key in self.entries():
+            self._remove(key)
+        self._size_estimate = None
+        self.remove_stale_temp_files()
+
+    def remove_stale_temp_files(self, age=3600):
+        """ Delete temporary directories left by crashed writers. """
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if name.startswith((".tmp-", ".del-")):
+                path = self._path(name)
+                try:
+                    if now - os.stat(path).st_mtime > age:
+                        shutil.rmtree(path, ignore_errors=True)
+                except OSError:
+                    pass
+
+# Total size of the files of an entry directory
+def _entry_size(path):
+    return sum(os.stat(os.path.join(path, f)).st_size for f in os.listdir(path))
+
+_MISSING = object()
@@ -0,0 +1,497 @@
+# -*- coding: utf-8 -*-
+"""
+Gear set and meld optimizer built on top of ffxiv_math.
+
+Picks one piece per gear slot plus the materia in its meld slots so that
+the expected damage per second of a DamageProfile is maximized.
+Expected damage uses the CritType.Average/DHType.Average paths of the
+damage formulas, so there is no sampling involved.
+
+The search works slot by slot:
+- Every piece is expanded into its distinct meld variants, and options
+  of a slot that another option beats in every stat are dropped. That is
+  valid because more of any stat never lowers the expected damage.
+- The stat totals of the slots so far are combined with the next slot.
+  While there are few of them, dominated totals are dropped exactly.
+  Once there are more than beam_width, only the beam_width totals with
+  the best estimated DPS are kept (the estimate adds the average option
+  of every remaining slot). Only in that case can the search miss the
+  optimum, which is reported in GearSearch.exact.
+- At the end every substat is rounded down to the start of its tier,
+  since stats inside one tier give identical damage, and each distinct
+  set of tiers is evaluated once with the exact damage formulas.
+
+calc_stat_weights gives the expected DPS per point of every relevant
+stat. The formulas are floor-stepped, so a stat's weight is measured
+from the start of its current tier to the start of a later one rather
+than over one point (which is usually worth exactly nothing).
+"""
+
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from itertools import combinations_with_replacement
+
+import numpy as np
+
+from ffxiv_math import (CRT_DMG_MOD, CRT_RATE_MOD, DET_MOD, DH_MOD, SPD_MOD,
+                        TNC_MOD, CritType, DHType, HitKernel, PlayerStats,
+                        WeaponInfo, apply_critchance_buffs, apply_dh_buffs,
+                        calc_atkpowermod, calc_gcdmod, calc_jobtraitmod,
+                        get_aa_potency, get_ap_stat, get_gcd_tiers,
+                        get_job_attr, get_level_mods, get_map_stat,
+                        get_max_level, get_stat_tiers, is_caster, is_healer,
+                        is_tank)
+
+# Substats a materia can go into, and the ones that set a piece's meld cap
+SUBSTATS = ("CRT", "DH", "DET", "SKS", "SPS", "TNC", "PIE")
+
+@dataclass
+class GearPiece:
+    slot: str
+    name: str
+    # Stat name -> value, e.g. {"STR": 416, "CRT": 306, "DET": 214}
+    # Weapons also have "WD" for their weapon damage.
+    stats: dict = field(default_factory=dict)
+    meld_slots: int = 0
+
+    def meld_cap(self):
+        """ No substat can be melded past the largest substat of the piece. """
+        return max([self.stats.get(s, 0) for s in SUBSTATS])
+
+@dataclass
+class DamageProfile:
+    """ A simplified rotation: what the optimizer maximizes. """
+    gcd_potency: int = 300          # Average potency of one GCD
+    base_gcd: int = 2500            # GCD at base speed, in ms
+    ogcd_potency_per_minute: int = 0
+    dot_potency: int = 0            # Potency of one DoT tick (every 3s)
+    auto_attacks: bool = True
+    buffs: list = field(default_factory=list)
+
+@dataclass
+class GearSetResult:
+    dps: float
+    stats: PlayerStats
+    weaponinfo: WeaponInfo
+    # [(slot, piece name, (melded stat, ...)), ...]
+    pieces: list
+
+@dataclass
+class GearSearch:
+    results: list           # GearSetResults, best first
+    n_combinations: int     # Gear and meld combinations covered
+    n_evaluated: int        # Distinct stat tier sets evaluated exactly
+    exact: bool             # False if the beam had to cut the search
+
+# The stats the damage of a job depends on, in vector order
+def relevant_stats(job):
+    if is_healer(job) or is_caster(job):
+        mainstat = get_map_stat(job)
+        speedstat = "SPS"
+    else:
+        mainstat = get_ap_stat(job)
+        speedstat = "SKS"
+    stats = [mainstat, "DET", "CRT", "DH", speedstat]
+    if is_tank(job):
+        stats.append("TNC")
+    return tuple(stats) + ("WD",)
+
+def calc_expected_dps(job: str,
+                      weaponinfo: WeaponInfo,
+                      playerstats: PlayerStats,
+                      profile: DamageProfile):
+    """ Expected damage per second of the profile for one stat set. """
+    kernel = HitKernel(job, weaponinfo, playerstats, profile.buffs)
+    avg = (CritType.Average, DHType.Average, 10000)
+    if kernel.is_magic:
+        speed = playerstats.SPS
+    else:
+        speed = playerstats.SKS
+    gcd = calc_gcdmod(speed, profile.base_gcd, playerstats.level)
+    dps = kernel.damage(profile.gcd_potency, *avg) / gcd
+    if profile.ogcd_potency_per_minute:
+        dps += kernel.damage(profile.ogcd_potency_per_minute, *avg) / 60
+    if profile.dot_potency:
+        dps += kernel.dot_damage(profile.dot_potency, *avg) / 3
+    if profile.auto_attacks:
+        dps += kernel.aa_damage(*avg) / (weaponinfo.delay / 100)
+    return dps
+
+def estimate_dps_array(job: str,
+                       level: int,
+                       weaponinfo: WeaponInfo,
+                       statnames: tuple,
+                       stats,
+                       profile: DamageProfile):
+    """ Estimated expected DPS for each row of stats (columns in
+        statnames order, "WD" 0 means weaponinfo.damage).
+        Same modifiers as calc_expected_dps, but without the intermediate
+        floors and without stat buffs, so it is only meant for ranking. """
+    main, sub, div = get_level_mods(level)
+    col = {name: stats[:, i].astype(np.float64) for i, name in enumerate(statnames)}
+    mainstat, speedstat = statnames[0], statnames[4]
+    # calc_atkpowermod is linear above the floor, recover its coefficient
+    atk_coef = calc_atkpowermod(2 * main, job, level) - 100
+    fatk = np.floor(atk_coef * (col[mainstat] - main) / main) + 100
+    fdet = np.floor(DET_MOD * (col["DET"] - main) / div) + 1000
+    if "TNC" in col:
+        ftnc = np.floor(TNC_MOD * (col["TNC"] - sub) / div) + 1000
+    else:
+        ftnc = 1000
+    wd = np.where(col["WD"] > 0, col["WD"], weaponinfo.damage)
+    fwd = np.floor(main * get_job_attr(job, mainstat) / 1000 + wd)
+    traitmod = calc_jobtraitmod(job)
+    critchance = apply_critchance_buffs(
+        np.floor(CRT_RATE_MOD * (col["CRT"] - sub) / div) + 50, profile.buffs)
+    critbonus = 400 + np.floor(CRT_DMG_MOD * (col["CRT"] - sub) / div)
+    fcrit = 1000 + critbonus * np.minimum(critchance, 1000) / 1000
+    dhchance = apply_dh_buffs(np.floor(DH_MOD * (col["DH"] - sub) / div), profile.buffs)
+    fdh = 1000 + 250 * np.minimum(dhchance, 1000) / 1000
+    buffmod = 1.0
+    for buff in profile.buffs:
+        buffmod *= (1000 + buff.damage_multiplier) / 1000
+    speedtier = np.floor(SPD_MOD * (col[speedstat] - sub) / div)
+    fspd = 1000 + speedtier
+    gcd = np.floor(profile.base_gcd * (1000 - speedtier) / 10000) / 100
+    # Damage of 1 potency, before speed
+    per_potency = (fatk / 100 * fdet / 1000 * ftnc / 1000 * fwd / 100
+                   * traitmod / 100 * fcrit / 1000 * fdh / 1000 * buffmod)
+    dps = profile.gcd_potency * per_potency / gcd
+    dps += profile.ogcd_potency_per_minute * per_potency / 60
+    dps += profile.dot_potency * per_potency * fspd / 1000 / 3
+    if profile.auto_attacks:
+        # Autos use f(AUTO) in place of f(WD) and always skill speed
+        faa = np.floor((np.floor(main * get_job_attr(job, get_ap_stat(job)) / 1000) + wd)
+                       * weaponinfo.delay / 300)
+        if speedstat == "SKS":
+            fspd_aa = fspd
+        else:
+            fspd_aa = 1000
+        aa = get_aa_potency(job) * per_potency / fwd * faa * fspd_aa / 1000
+        dps += aa / (weaponinfo.delay / 100)
+    return dps
+
+def _meld_variants(piece, statnames, meldable, materia_value):
+    """ All distinct results of melding the piece, as
+        [(stat vector, melds), ...]. """
+    base = [piece.stats.get(s, 0) for s in statnames]
+    cap = piece.meld_cap()
+    variants = {}
+    for melds in combinations_with_replacement(meldable, piece.meld_slots):
+        vector = list(base)
+        for stat in melds:
+            i = statnames.index(stat)
+            vector[i] = min(vector[i] + materia_value, cap)
+        vector = tuple(vector)
+        if vector not in variants:
+            variants[vector] = melds
+    return list(variants.items())
+
+def pareto_front(points):
+    """ Indices of the rows of points that no other row dominates
+        (is >= in every column). Duplicate rows are kept once. """
+    points = np.asarray(points)
+    _, unique_idx = np.unique(points, axis=0, return_index=True)
+    # A row can only be dominated by one with a larger sum, so going
+    # through them by decreasing sum, only kept rows need to be checked
+    order = unique_idx[np.argsort(-points[unique_idx].sum(axis=1), kind="stable")]
+    front = np.empty((len(order), points.shape[1]), dtype=points.dtype)
+    kept = []
+    for i in order:
+        p = points[i]
+        n = len(kept)
+        if n and np.any(np.all(front[:n] >= p, axis=1)):
+            continue
+        front[n] = p
+        kept.append(i)
+    return np.array(kept, dtype=np.int64)
+
+def optimize_gear(job: str,
+                  base_stats: PlayerStats,
+                  weaponinfo: WeaponInfo,
+                  candidates: dict,
+                  profile: DamageProfile = None,
+                  materia_value: int = 36,
+                  top: int = 10,
+                  beam_width: int = 20000,
+                  pareto_limit: int = 4000):
+    """ Find the best gear sets.
+        candidates maps each slot to a list of GearPieces for it. Every
+        set uses exactly one piece per slot. base_stats are the stats
+        without gear, and weaponinfo gives the weapon delay (the weapon
+        damage comes from the "WD" of the weapon piece, if there is one).
+        Dominated totals are removed exactly while there are at most
+        pareto_limit of them, the beam keeps at most beam_width. """
+    if profile is None:
+        profile = DamageProfile()
+    level = base_stats.level
+    statnames = relevant_stats(job)
+    ndim = len(statnames)
+    meldable = tuple(s for s in statnames if s in SUBSTATS)
+    base_vector = np.array([0 if s == "WD" else base_stats.get_stat_by_name(s)
+                            for s in statnames], dtype=np.int64)
+    # Per slot: option vectors and the (piece, melds) behind each of them
+    slots = []
+    n_combinations = 1
+    for slot, pieces in candidates.items():
+        vectors = []
+        choices = []
+        for piece in pieces:
+            for vector, melds in _meld_variants(piece, statnames, meldable,
+                                                materia_value):
+                vectors.append(vector)
+                choices.append((piece, melds))
+        n_combinations *= len(vectors)
+        vectors = np.array(vectors, dtype=np.int64)
+        keep = pareto_front(vectors)
+        slots.append((slot, vectors[keep], [choices[i] for i in keep]))
+    # Average option of all slots after each step, for the beam estimate
+    lookahead = np.zeros((len(slots) + 1, ndim))
+    for k in range(len(slots) - 1, -1, -1):
+        lookahead[k] = lookahead[k + 1] + slots[k][1].mean(axis=0)
+    # Combine the slots one by one.
+    # parents[k][j] = (total index before slot k, option index in slot k)
+    totals = np.zeros((1, ndim), dtype=np.int64)
+    parents = []
+    exact = True
+    for k, (slot, vectors, choices) in enumerate(slots):
+        combined = (totals[:, None, :] + vectors[None, :, :]).reshape(-1, ndim)
+        _, keep = np.unique(combined, axis=0, return_index=True)
+        if len(keep) <= pareto_limit:
+            keep = keep[pareto_front(combined[keep])]
+        if len(keep) > beam_width:
+            exact = False
+            estimate = estimate_dps_array(job, level, weaponinfo, statnames,
+                                          combined[keep] + base_vector + lookahead[k + 1],
+                                          profile)
+            keep = keep[np.argsort(-estimate, kind="stable")[:beam_width]]
+        parents.append(np.stack(np.divmod(keep, len(vectors)), axis=1))
+        totals = combined[keep]
+    # Final stats, with the substats rounded down to their tier starts
+    final = totals + base_vector
+    rounded = final.copy()
+    for i, stat in enumerate(statnames):
+        if stat in SUBSTATS:
+            tiers = get_stat_tiers(stat, level)
+            rounded[:, i] = tiers.tier_start(tiers.tier(final[:, i]))
+    _, first_idx = np.unique(rounded, axis=0, return_index=True)
+    results = []
+    for idx in first_idx:
+        stats = base_stats.copy()
+        wep = WeaponInfo(damage=weaponinfo.damage,
+                         auto_attack=weaponinfo.auto_attack,
+                         delay=weaponinfo.delay)
+        for stat, value in zip(statnames, final[idx]):
+            if stat == "WD":
+                if value:
+                    wep.damage = int(value)
+            else:
+                setattr(stats, stat, int(value))
+        dps = calc_expected_dps(job, wep, stats, profile)
+        results.append((dps, idx, stats, wep))
+    results.sort(key=lambda r: -r[0])
+    best = []
+    for dps, idx, stats, wep in results[:top]:
+        pieces = []
+        for (slot, vectors, choices), parent in zip(reversed(slots), reversed(parents)):
+            idx, option = parent[idx]
+            piece, melds = choices[option]
+            pieces.append((slot, piece.name, melds))
+        best.append(GearSetResult(dps, stats, wep, list(reversed(pieces))))
+    return GearSearch(best, n_combinations, len(first_idx), exact)
+
+#################################################################
+# STAT WEIGHTS                                                  #
+#################################################################
+
+@dataclass
+class StatWeights:
+    job: str
+    level: int
+    dps: float              # Expected DPS of the stats themselves
+    # Stat name -> expected DPS per point
+    weights: dict
+    # Stat name -> (from, to): the stat values the weight was measured
+    # between (tier starts, except for WD)
+    steps: dict
+
+    def relative(self, reference=None):
+        """ Weights divided by the one of reference (the main stat by
+            default), e.g. {"INT": 1.0, "CRT": 0.62, ...}. """
+        if reference is None:
+            reference = next(iter(self.weights))
+        scale = self.weights[reference]
+        return {stat: w / scale if scale else float("nan")
+                for stat, w in self.weights.items()}
+
+@dataclass
+class StatWeightSweep:
+    job: str
+    statnames: tuple
+    levels: np.ndarray      # (levels,)
+    dps: np.ndarray         # (levels,) expected DPS of the stats of each level
+    weights: np.ndarray     # (levels, stats) expected DPS per point
+
+# Main stat tiers: calc_atkpowermod is floor(coef * (stat - main) / main)
+# plus a constant, the same form as the substat tiers
+def _main_stat_tier_start(stat, k, job, level, main):
+    coef = calc_atkpowermod(2 * main, job, level) - 100
+    tier = coef * (stat - main) // main + k
+    return main - (-tier * main // coef)
+
+def _substat_tier_start(stat, k, tiers):
+    return tiers.tier_start(tiers.tier(stat) + k)
+
+# Candidate tier starts tried per stat and direction before giving up on
+# a stat that doesn't change the DPS, on top of the tiers asked for
+_MAX_EXTRA_TIERS = 16
+
+def _tier_candidates(job, level, name, value, statnames, tiers, profile):
+    """ start(k): the k-th tier start of the stat from the one at or
+        below value (k may be negative), or None past the ends. These
+        are where the formula's modifier can change; the float round
+        trips of the modifiers the damage functions use (e.g.
+        int(calc_detmod(...) * 1000)) skip some of them. None for WD. """
+    if name == "WD":
+        return None
+    if name == statnames[0]:
+        main = get_level_mods(level)[0]
+        return lambda k: _main_stat_tier_start(value, k, job, level, main)
+    # DoT ticks and autos (which always use skill speed) change with every
+    # f(SPD) tier, the GCD only at some of them
+    speed_damage = profile.dot_potency or (profile.auto_attacks and name == "SKS")
+    if name == statnames[4] and profile.gcd_potency and not speed_damage:
+        # Whole GCD tiers, so the weight includes the shorter GCD
+        thresholds = get_gcd_tiers(level, profile.base_gcd).thresholds
+        current = bisect_right(thresholds, value) - 1
+        if len(thresholds) - 1 - current >= tiers:
+            def start(k):
+                i = current + k
+                if k == 0 and i < 0:
+                    return value
+                return thresholds[i] if 0 <= i < len(thresholds) else None
+            return start
+        # Past the end of the GCD table, fall back to the f(SPD) tiers
+    stat_tiers = get_stat_tiers(name, level)
+    return lambda k: _substat_tier_start(value, k, stat_tiers)
+
+def _stat_step(name, value, tiers, start, dps_at):
+    """ (from, to) to measure a stat's weight between: from the lowest
+        stat value with the DPS of value, to the tier start where the
+        DPS changed for the tiers-th time. """
+    if name == "WD":
+        return value, value + tiers
+    current = dps_at(name, value)
+    lo = start(0)
+    for k in range(1, tiers + _MAX_EXTRA_TIERS):
+        below = start(-k)
+        if below is None or below < 0:
+            break
+        # Tiers can be empty at low levels, so starts can repeat
+        if below == lo:
+            continue
+        if dps_at(name, below) != current:
+            break
+        lo = below
+    hi = None
+    changes = 0
+    previous = current
+    for k in range(1, tiers + _MAX_EXTRA_TIERS):
+        above = start(k)
+        if above is None:
+            break
+        if above <= value or (hi is not None and above <= hi):
+            continue
+        hi = above
+        dps = dps_at(name, above)
+        if dps != previous:
+            changes += 1
+            previous = dps
+            if changes == tiers:
+                break
+    if hi is None:
+        hi = value + 1
+    return lo, hi
+
+def _stats_vector(playerstats, weaponinfo, statnames):
+    return [weaponinfo.damage if s == "WD" else playerstats.get_stat_by_name(s)
+            for s in statnames]
+
+def calc_stat_weights(job: str,
+                      weaponinfo: WeaponInfo,
+                      playerstats: PlayerStats,
+                      profile: DamageProfile = None,
+                      tiers: int = 1):
+    """ Expected DPS per point of every stat in relevant_stats(job),
+        with calc_expected_dps (so with every floor and round trip of
+        the damage formulas, and stat buffs). Each stat's weight is
+        measured from the lowest value that gives the DPS of the current
+        stats to the tier start (GCD tiers for the speed stat if the
+        profile has GCDs) where the DPS changed for the tiers-th time,
+        with the other stats unchanged. WD is measured over tiers
+        points. A stat that doesn't change the DPS gets weight 0. """
+    if profile is None:
+        profile = DamageProfile()
+    level = playerstats.level
+    statnames = relevant_stats(job)
+    vector = [int(v) for v in _stats_vector(playerstats, weaponinfo, statnames)]
+    results = {}
+    def dps_at(name, value):
+        key = (name, value)
+        if key not in results:
+            stats = playerstats.copy()
+            wep = WeaponInfo(damage=weaponinfo.damage,
+                             auto_attack=weaponinfo.auto_attack,
+                             delay=weaponinfo.delay)
+            if name == "WD":
+                wep.damage = value
+            elif name is not None:
+                setattr(stats, name, value)
+            results[key] = calc_expected_dps(job, wep, stats, profile)
+        return results[key]
+    weights = {}
+    steps = {}
+    for name, value in zip(statnames, vector):
+        start = _tier_candidates(job, level, name, value, statnames, tiers, profile)
+        lo, hi = _stat_step(name, value, tiers, start, dps_at)
+        weights[name] = (dps_at(name, hi) - dps_at(name, lo)) / (hi - lo)
+        steps[name] = (lo, hi)
+    return StatWeights(job, level, dps_at(None, None), weights, steps)
+
+# Stats of a player with no gear at a level: the main stat and DET at
+# the level's MAIN, the other substats at its SUB
+def level_baseline_stats(job, level):
+    main, sub, div = get_level_mods(level)
+    stats = PlayerStats(level=level)
+    for name in relevant_stats(job):
+        if name == "WD":
+            continue
+        setattr(stats, name, main if name in (relevant_stats(job)[0], "DET") else sub)
+    return stats
+
+def sweep_stat_weights(job: str,
+                       weaponinfo,
+                       profile: DamageProfile = None,
+                       levels=None,
+                       make_stats=None,
+                       tiers: int = 1):
+    """ calc_stat_weights at every level of the level table (or the
+        given levels). make_stats(job, level) gives the stats of each
+        level, level_baseline_stats by default. weaponinfo is a
+        WeaponInfo, or a function of the level returning one. """
+    if levels is None:
+        levels = range(1, get_max_level() + 1)
+    if make_stats is None:
+        make_stats = level_baseline_stats
+    levels = np.array(list(levels), dtype=np.int64)
+    statnames = relevant_stats(job)
+    dps = np.empty(len(levels))
+    weights = np.empty((len(levels), len(statnames)))
+    for i, level in enumerate(levels):
+        level = int(level)
+        wep = weaponinfo(level) if callable(weaponinfo) else weaponinfo
+        result = calc_stat_weights(job, wep, make_stats(job, level), profile,
+                                   tiers)
+        dps[i] = result.dps
+        weights[i] = [result.weights[s] for s in statnames]
+    return StatWeightSweep(job, statnames, levels, dps, weights)
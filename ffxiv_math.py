@@ -12,10 +12,17 @@ https://github.com/Yurihaia/xivc/tree/master
 aka Xavrian Solain (Lamia)
 """
 
-from dataclasses import dataclass
+import hashlib
+import os
+import pickle
+import sys
+from bisect import bisect_right
+from dataclasses import astuple, dataclass
 from enum import Enum
+from functools import lru_cache
 from math import floor, ceil
-from random import random, randint
+from types import MappingProxyType
+from random import Random, random, randint
 
 # Constants for stat scaling
 DET_MOD = 140
@@ -26,49 +33,217 @@ CRT_DMG_MOD = 200
 DH_MOD = 550
 PIE_MOD = 150
 
-# Level modifiers
-LEVEL_MOD_DATA = []
-with open("ffxiv_allaganstudies_leveldata.csv", "r") as f:
-    for line in f:
-        if not line.startswith("#") and not line.isspace():
-            LEVEL_MOD_DATA.append({})
-            s = line[:-1].split(",")
-            LEVEL_MOD_DATA[-1]["LEVEL"] = int(s[0])
-            LEVEL_MOD_DATA[-1]["MAIN"] = int(s[1])
-            LEVEL_MOD_DATA[-1]["SUB"] = int(s[2])
-            LEVEL_MOD_DATA[-1]["DIV"] = int(s[3])
-            LEVEL_MOD_DATA[-1]["HP"] = int(s[4])
-            LEVEL_MOD_DATA[-1]["ELMT"] = int(s[5])
-            LEVEL_MOD_DATA[-1]["THREAT"] = int(s[6])
-LEVEL_MOD_DATA = list(sorted(LEVEL_MOD_DATA, key=lambda elem: elem["LEVEL"]))
-
-# Job modifiers
-JOB_DATA = {}
-with open("ffxiv_allaganstudies_jobdata.csv", "r") as f:
-    for line in f:
-        if not line.startswith("#") and not line.isspace():
-            s = line[:-1].split(",")
-            JOB_DATA[s[0]] = {}
-            JOB_DATA[s[0]]["JOB_ID"] = int(s[1])
-            JOB_DATA[s[0]]["HP"] = int(s[2])
-            JOB_DATA[s[0]]["STR"] = int(s[3])
-            JOB_DATA[s[0]]["VIT"] = int(s[4])
-            JOB_DATA[s[0]]["DEX"] = int(s[5])
-            JOB_DATA[s[0]]["INT"] = int(s[6])
-            JOB_DATA[s[0]]["MND"] = int(s[7])
-
-# Clan stats
-CLAN_STATS = {}
-with open("ffxiv_allaganstudies_clandata.csv", "r") as f:
-    for line in f:
-        if not line.startswith("#") and not line.isspace():
-            s = line[:-1].split(",")
-            CLAN_STATS[s[0]] = {}
-            CLAN_STATS[s[0]]["STR"] = int(s[1])
-            CLAN_STATS[s[0]]["DEX"] = int(s[2])
-            CLAN_STATS[s[0]]["VIT"] = int(s[3])
-            CLAN_STATS[s[0]]["INT"] = int(s[4])
-            CLAN_STATS[s[0]]["MND"] = int(s[5])
+# Game data tables
+# The CSVs are stored as columns: level columns are tuples indexed
+# directly by level (index 0 is unused) and job columns are tuples
+# indexed by job ID. The calc_* functions read LEVEL_MSD[level], which
+# holds the (MAIN, SUB, DIV) triple of each level.
+# LEVEL_MOD_DATA, JOB_DATA and CLAN_STATS are read-only views of the
+# same data in the old list-of-dicts and dict-of-dicts layouts.
+#
+# Nothing is read at import. The tables start out as _LazyTable
+# stand-ins and the first lookup loads the CSVs from DATA_DIR (the
+# directory of this file, or $FFXIV_MATH_DATA_DIR). The parsed rows are
+# pickled to a cache file next to the CSVs, so later processes skip the
+# parsing as long as the CSVs are unchanged.
+LEVEL_COLUMN_NAMES = ("LEVEL", "MAIN", "SUB", "DIV", "HP", "ELMT", "THREAT")
+JOB_COLUMN_NAMES = ("JOB_ID", "HP", "STR", "VIT", "DEX", "INT", "MND")
+CLAN_COLUMN_NAMES = ("STR", "DEX", "VIT", "INT", "MND")
+
+DATA_FILES = ("ffxiv_allaganstudies_leveldata.csv",
+              "ffxiv_allaganstudies_jobdata.csv",
+              "ffxiv_allaganstudies_clandata.csv")
+DATA_DIR = (os.environ.get("FFXIV_MATH_DATA_DIR")
+            or os.path.dirname(os.path.abspath(__file__)))
+# Where the pickled tables go. None means DATA_DIR/__pycache__
+DATA_CACHE_DIR = os.environ.get("FFXIV_MATH_CACHE_DIR")
+_DATA_CACHE_FORMAT = 1
+_DATA_VERSION = None
+
+_TABLE_NAMES = ("LEVEL_COLUMNS", "LEVEL_MSD", "LEVEL_MOD_DATA",
+                "JOB_IDS", "JOB_NAMES", "JOB_COLUMNS", "JOB_DATA",
+                "CLAN_NAMES", "CLAN_COLUMNS", "CLAN_STATS",
+                "JOB_INFO", "JOB_INFO_BY_ID")
+
+class _LazyTable:
+    """ Stand-in for a game data table that hasn't been loaded yet.
+        The first lookup loads the data, which replaces the module global
+        with the real table. References taken before that (e.g. via
+        "from ffxiv_math import JOB_DATA") keep forwarding to it. """
+    __slots__ = ("_name",)
+    def __init__(self, name):
+        self._name = name
+    def _table(self):
+        if _DATA_VERSION is None:
+            load_game_data()
+        return globals()[self._name]
+    def __getitem__(self, key):
+        return self._table()[key]
+    def __iter__(self):
+        return iter(self._table())
+    def __len__(self):
+        return len(self._table())
+    def __contains__(self, key):
+        return key in self._table()
+    def __eq__(self, other):
+        return self._table() == other
+    def __getattr__(self, name):
+        return getattr(self._table(), name)
+    def __repr__(self):
+        return repr(self._table())
+
+def unload_game_data():
+    """ Drop the loaded tables. The next lookup loads them again. """
+    global _DATA_VERSION
+    for name in _TABLE_NAMES:
+        globals()[name] = _LazyTable(name)
+    if _DATA_VERSION is not None:
+        _clear_derived_caches()
+    _DATA_VERSION = None
+
+unload_game_data()
+
+def set_data_dir(data_dir):
+    """ Read the CSVs from data_dir from now on. """
+    global DATA_DIR
+    DATA_DIR = data_dir
+    unload_game_data()
+
+def _parse_csv_rows(text):
+    rows = []
+    for line in text.splitlines():
+        if line and not line.startswith("#") and not line.isspace():
+            rows.append([int(x) if i > 0 else x
+                         for i, x in enumerate(line.split(","))])
+    return rows
+
+def _data_cache_path(data_dir):
+    cache_dir = DATA_CACHE_DIR or os.path.join(data_dir, "__pycache__")
+    return os.path.join(cache_dir, "ffxiv_math_data.pickle")
+
+def _read_data_cache(cache_path, key):
+    try:
+        with open(cache_path, "rb") as f:
+            cached = pickle.load(f)
+        if cached["key"] == key:
+            return cached["rows"], cached["version"]
+    except Exception:
+        # Missing, stale or unreadable cache, just parse the CSVs
+        pass
+    return None, None
+
+def _write_data_cache(cache_path, key, rows, version):
+    # Write to a temporary file first so concurrent readers never see
+    # a half-written cache
+    tmp_path = "{}.{}.tmp".format(cache_path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"key": key, "rows": rows, "version": version}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # Read-only data dir etc. The cache is only an optimization.
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+def load_game_data(data_dir=None, use_cache=True):
+    """ Load (or reload) the game data tables from the CSVs in data_dir.
+        The pickled cache is used if its key (path, mtime and size of
+        every CSV) still matches. """
+    global _DATA_VERSION
+    if data_dir is None:
+        data_dir = DATA_DIR
+    paths = [os.path.join(data_dir, name) for name in DATA_FILES]
+    stats = [os.stat(path) for path in paths]
+    key = (_DATA_CACHE_FORMAT, os.path.abspath(data_dir),
+           tuple((s.st_mtime_ns, s.st_size) for s in stats))
+    cache_path = _data_cache_path(data_dir)
+    rows, version = (None, None)
+    if use_cache:
+        rows, version = _read_data_cache(cache_path, key)
+    if rows is None:
+        digest = hashlib.sha1()
+        rows = []
+        for path in paths:
+            with open(path, "rb") as f:
+                data = f.read()
+            digest.update(data)
+            rows.append(_parse_csv_rows(data.decode("utf-8")))
+        version = digest.hexdigest()
+        if use_cache:
+            _write_data_cache(cache_path, key, rows, version)
+    _set_game_data(*rows)
+    _DATA_VERSION = version
+
+def get_data_version():
+    """ SHA-1 of the CSV contents the tables were loaded from. """
+    if _DATA_VERSION is None:
+        load_game_data()
+    return _DATA_VERSION
+
+def _set_game_data(level_rows, job_rows, clan_rows):
+    """ Build the columns and views from the parsed CSV rows. """
+    global LEVEL_COLUMNS, LEVEL_MSD, LEVEL_MOD_DATA
+    global JOB_IDS, JOB_NAMES, JOB_COLUMNS, JOB_DATA
+    global CLAN_NAMES, CLAN_COLUMNS, CLAN_STATS
+    # Level table
+    level_rows = sorted(([int(row[0])] + row[1:] for row in level_rows),
+                        key=lambda row: row[0])
+    max_level = level_rows[-1][0]
+    columns = {name: [None] * (max_level + 1) for name in LEVEL_COLUMN_NAMES}
+    for row in level_rows:
+        for name, value in zip(LEVEL_COLUMN_NAMES, row):
+            columns[name][row[0]] = value
+    LEVEL_COLUMNS = MappingProxyType({name: tuple(col) for name, col in columns.items()})
+    LEVEL_MSD = tuple(None if main is None else (main, sub, div)
+                      for main, sub, div in zip(LEVEL_COLUMNS["MAIN"],
+                                                LEVEL_COLUMNS["SUB"],
+                                                LEVEL_COLUMNS["DIV"]))
+    LEVEL_MOD_DATA = tuple(MappingProxyType(dict(zip(LEVEL_COLUMN_NAMES, row)))
+                           for row in level_rows)
+    # Job table
+    max_id = max(row[1] for row in job_rows)
+    JOB_IDS = MappingProxyType({row[0]: row[1] for row in job_rows})
+    names = [None] * (max_id + 1)
+    columns = {name: [0] * (max_id + 1) for name in JOB_COLUMN_NAMES}
+    for row in job_rows:
+        names[row[1]] = row[0]
+        for name, value in zip(JOB_COLUMN_NAMES, row[1:]):
+            columns[name][row[1]] = value
+    JOB_NAMES = tuple(names)
+    JOB_COLUMNS = MappingProxyType({name: tuple(col) for name, col in columns.items()})
+    JOB_DATA = MappingProxyType({row[0]: MappingProxyType(dict(zip(JOB_COLUMN_NAMES, row[1:])))
+                                 for row in job_rows})
+    # Clan stats
+    CLAN_NAMES = tuple(row[0] for row in clan_rows)
+    CLAN_COLUMNS = MappingProxyType({name: tuple(row[i + 1] for row in clan_rows)
+                                     for i, name in enumerate(CLAN_COLUMN_NAMES)})
+    CLAN_STATS = MappingProxyType({row[0]: MappingProxyType(dict(zip(CLAN_COLUMN_NAMES, row[1:])))
+                                   for row in clan_rows})
+    _set_job_info(JOB_DATA)
+    _clear_derived_caches()
+
+# Everything cached from the game data tables
+def _clear_derived_caches():
+    clear_buff_cache()
+    clear_modifier_cache()
+    _STAT_TIERS.clear()
+    _GCD_TIERS.clear()
+
+# (MAIN, SUB, DIV) of a level
+def get_level_mods(level):
+    return LEVEL_MSD[level]
+
+# A single job attribute modifier, e.g. get_job_attr("WHM", "MND")
+def get_job_attr(job, attr):
+    return JOB_COLUMNS[attr][JOB_IDS[job]]
+
+# Highest level in the level table
+def get_max_level():
+    return len(LEVEL_MSD) - 1
 
 class CritType(Enum):
     Normal = 1
@@ -123,21 +298,54 @@ class WeaponInfo:
     auto_attack: int = 100
     delay: int = 300
 
-@dataclass
+# The stats of PlayerStats, in the order of its vector form
+STAT_NAMES = ("STR", "VIT", "DEX", "INT", "MND", "DET", "PIE",
+              "CRT", "DH", "SKS", "SPS", "TNC")
+
+@dataclass(slots=True)
 class PlayerStats:
     level: int = 90
-    STR: int = LEVEL_MOD_DATA[level - 1]["MAIN"]
-    VIT: int = LEVEL_MOD_DATA[level - 1]["MAIN"]
-    DEX: int = LEVEL_MOD_DATA[level - 1]["MAIN"]
-    INT: int = LEVEL_MOD_DATA[level - 1]["MAIN"]
-    MND: int = LEVEL_MOD_DATA[level - 1]["MAIN"]
-    DET: int = LEVEL_MOD_DATA[level - 1]["MAIN"]
-    PIE: int = LEVEL_MOD_DATA[level - 1]["MAIN"]
-    CRT: int = LEVEL_MOD_DATA[level - 1]["SUB"]
-    DH: int = LEVEL_MOD_DATA[level - 1]["SUB"]
-    SKS: int = LEVEL_MOD_DATA[level - 1]["SUB"]
-    SPS: int = LEVEL_MOD_DATA[level - 1]["SUB"]
-    TNC: int = LEVEL_MOD_DATA[level - 1]["SUB"]
+    STR: int = None
+    VIT: int = None
+    DEX: int = None
+    INT: int = None
+    MND: int = None
+    DET: int = None
+    PIE: int = None
+    CRT: int = None
+    DH: int = None
+    SKS: int = None
+    SPS: int = None
+    TNC: int = None
+    def __post_init__(self):
+        # Stats that weren't given default to the base stats of the level.
+        # (Done here rather than in the field defaults so that importing
+        # the module doesn't have to load the level table)
+        main, sub, div = LEVEL_MSD[self.level]
+        if self.STR is None:
+            self.STR = main
+        if self.VIT is None:
+            self.VIT = main
+        if self.DEX is None:
+            self.DEX = main
+        if self.INT is None:
+            self.INT = main
+        if self.MND is None:
+            self.MND = main
+        if self.DET is None:
+            self.DET = main
+        if self.PIE is None:
+            self.PIE = main
+        if self.CRT is None:
+            self.CRT = sub
+        if self.DH is None:
+            self.DH = sub
+        if self.SKS is None:
+            self.SKS = sub
+        if self.SPS is None:
+            self.SPS = sub
+        if self.TNC is None:
+            self.TNC = sub
     def speed(self, skilltype):
         if (skilltype is ActionCategory.WEAPONSKILL
             or skilltype is ActionCategory.AUTO_ATTACK):
@@ -147,22 +355,25 @@ class PlayerStats:
         else:
             return 0
     def set_stats_to_base(self, level):
-        self.STR = LEVEL_MOD_DATA[level - 1]["MAIN"]
-        self.VIT = LEVEL_MOD_DATA[level - 1]["MAIN"]
-        self.DEX = LEVEL_MOD_DATA[level - 1]["MAIN"]
-        self.INT = LEVEL_MOD_DATA[level - 1]["MAIN"]
-        self.MND = LEVEL_MOD_DATA[level - 1]["MAIN"]
-        self.DET = LEVEL_MOD_DATA[level - 1]["MAIN"]
-        self.PIE = LEVEL_MOD_DATA[level - 1]["MAIN"]
-        self.CRT = LEVEL_MOD_DATA[level - 1]["SUB"]
-        self.DH = LEVEL_MOD_DATA[level - 1]["SUB"]
-        self.SKS = LEVEL_MOD_DATA[level - 1]["SUB"]
-        self.SPS = LEVEL_MOD_DATA[level - 1]["SUB"]
-        self.TNC = LEVEL_MOD_DATA[level - 1]["SUB"]
+        main, sub, div = LEVEL_MSD[level]
+        self.STR = main
+        self.VIT = main
+        self.DEX = main
+        self.INT = main
+        self.MND = main
+        self.DET = main
+        self.PIE = main
+        self.CRT = sub
+        self.DH = sub
+        self.SKS = sub
+        self.SPS = sub
+        self.TNC = sub
     def get_stat_by_name(self, name):
-        return self.__getattribute__(name)
+        return getattr(self, name)
     def copy(self):
-        newstats = PlayerStats()
+        # Skips __init__, so the level table isn't looked up again
+        newstats = object.__new__(PlayerStats)
+        newstats.level = self.level
         newstats.STR = self.STR
         newstats.VIT = self.VIT
         newstats.DEX = self.DEX
@@ -176,90 +387,375 @@ class PlayerStats:
         newstats.SPS = self.SPS
         newstats.TNC = self.TNC
         return newstats
+    def to_tuple(self):
+        """ The stats in STAT_NAMES order (without the level). """
+        return (self.STR, self.VIT, self.DEX, self.INT, self.MND, self.DET,
+                self.PIE, self.CRT, self.DH, self.SKS, self.SPS, self.TNC)
+    def to_vector(self):
+        """ The stats in STAT_NAMES order as an int64 array. """
+        import numpy as np
+        return np.array(self.to_tuple(), dtype=np.int64)
+    @classmethod
+    def from_vector(cls, values, level=90):
+        return cls(level, *(int(v) for v in values))
+
+class PlayerStatsArray:
+    """ Many stat sets of one level, stored as one int64 array per stat
+        (struct of arrays). Stats that aren't given are the level's base
+        stats, like in PlayerStats. """
+    def __init__(self, size=0, level=90, **columns):
+        import numpy as np
+        main, sub, div = LEVEL_MSD[level]
+        self.level = level
+        self.columns = {}
+        for name in STAT_NAMES:
+            values = columns.pop(name, None)
+            if values is None:
+                base = sub if name in ("CRT", "DH", "SKS", "SPS", "TNC") else main
+                values = np.full(size, base, dtype=np.int64)
+            else:
+                values = np.asarray(values, dtype=np.int64)
+                size = len(values)
+            self.columns[name] = values
+        if columns:
+            raise ValueError("Unknown stats: {}".format(", ".join(columns)))
+        if any(len(col) != size for col in self.columns.values()):
+            raise ValueError("All stat columns must have the same length")
+
+    @classmethod
+    def from_stats(cls, stats_list):
+        """ From a list of PlayerStats of the same level. """
+        import numpy as np
+        stats_list = list(stats_list)
+        level = stats_list[0].level if stats_list else 90
+        if any(stats.level != level for stats in stats_list):
+            raise ValueError("All stats must have the same level")
+        matrix = np.array([stats.to_tuple() for stats in stats_list],
+                          dtype=np.int64).reshape(-1, len(STAT_NAMES))
+        return cls.from_matrix(matrix, level)
+
+    @classmethod
+    def from_matrix(cls, matrix, level=90):
+        """ From an (n, 12) array with the columns in STAT_NAMES order. """
+        return cls(len(matrix), level,
+                   **{name: matrix[:, i] for i, name in enumerate(STAT_NAMES)})
+
+    def __len__(self):
+        return len(self.columns["STR"])
+
+    def __getattr__(self, name):
+        columns = self.__dict__.get("columns")
+        if columns is not None and name in columns:
+            return columns[name]
+        raise AttributeError(name)
+
+    def __getitem__(self, index):
+        """ A PlayerStats for an int, a PlayerStatsArray otherwise. """
+        import numpy as np
+        if isinstance(index, (int, np.integer)):
+            return PlayerStats(self.level, *(int(self.columns[name][index])
+                                             for name in STAT_NAMES))
+        return PlayerStatsArray(0, self.level,
+                                **{name: col[index] for name, col in self.columns.items()})
+
+    def matrix(self):
+        """ (n, 12) int64 array with the columns in STAT_NAMES order. """
+        import numpy as np
+        return np.stack([self.columns[name] for name in STAT_NAMES], axis=1)
 
 class Buff:
+    """ An immutable buff. Buffs with the same effects compare and hash
+        equal, so buff combinations can be used as dict keys.
+        A subclass can override apply_to_stats. If it takes parameters of
+        its own, it lists their attribute names in _fields and sets them
+        before calling Buff.__init__, which freezes the buff:
+
+            class FlatStatBuff(Buff):
+                _fields = ("stat", "amount")
+                def __init__(self, stat, amount):
+                    self.stat = stat
+                    self.amount = amount
+                    super().__init__()
+
+        The fields are part of the buff's equality, hash, pickle and cache
+        key, so they have to be hashable values. Setting any other
+        attribute raises AttributeError. """
+    __slots__ = ("crit_chance_increase", "dh_chance_increase",
+                 "damage_multiplier", "statbuff", "_hash", "is_noop")
+    _fields = ()
+
     def __init__(self, critbuff=0, dhbuff=0, damagebuff=0, statbuff=None):
-        self.crit_chance_increase = critbuff
-        self.dh_chance_increase = dhbuff
-        self.damage_multiplier = damagebuff
-        if statbuff is not None:
-            self.apply_to_stats = statbuff
+        object.__setattr__(self, "crit_chance_increase", critbuff)
+        object.__setattr__(self, "dh_chance_increase", dhbuff)
+        object.__setattr__(self, "damage_multiplier", damagebuff)
+        object.__setattr__(self, "statbuff", statbuff)
+        missing = [name for name in self._fields if not hasattr(self, name)]
+        if missing:
+            raise TypeError("{} must set {} before calling Buff.__init__".format(
+                type(self).__name__, ", ".join(missing)))
+        object.__setattr__(self, "_hash", hash(self._key()))
+        # A buff that never changes a result
+        object.__setattr__(self, "is_noop", not (critbuff or dhbuff or damagebuff
+                                                 or self.touches_stats()))
+
+    def __setattr__(self, name, value):
+        # Only the _fields of a subclass, and only until Buff.__init__ ran
+        if name in self._fields and not hasattr(self, "_hash"):
+            object.__setattr__(self, name, value)
+            return
+        if name in self._fields or hasattr(self, "_hash"):
+            raise AttributeError("Buff is immutable")
+        raise AttributeError("Buff is immutable, list {!r} in {}._fields to "
+                             "set it in __init__".format(name, type(self).__name__))
+
+    def __delattr__(self, name):
+        raise AttributeError("Buff is immutable")
+
+    def _args(self):
+        return (self.crit_chance_increase, self.dh_chance_increase,
+                self.damage_multiplier, self.statbuff)
+
+    def _field_values(self):
+        return tuple(getattr(self, name) for name in self._fields)
+
+    def _key(self):
+        return (type(self),) + self._args() + self._field_values()
+
+    def __eq__(self, other):
+        if not isinstance(other, Buff):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self):
+        return self._hash
+
+    def __repr__(self):
+        fields = "".join(", {}={!r}".format(name, value)
+                         for name, value in zip(self._fields, self._field_values()))
+        return "{}(critbuff={}, dhbuff={}, damagebuff={}, statbuff={}{})".format(
+            type(self).__name__, self.crit_chance_increase, self.dh_chance_increase,
+            self.damage_multiplier, self.statbuff, fields)
+
+    def __reduce__(self):
+        if type(self) is Buff:
+            return (Buff, self._args())
+        return (_restore_buff, (type(self), self._args(), self._field_values()))
+
+    def touches_stats(self):
+        return self.statbuff is not None or type(self).apply_to_stats is not Buff.apply_to_stats
+
+    def applies_to(self, damage_type):
+        # Whether the buff affects hits of damage_type (a DamageType)
+        return True
 
     def apply_to_stats(self, playerstats: PlayerStats):
-        # The default is to do nothing.
+        # The default is to call statbuff, if given.
         # Overwrite the method to have it do something for specific buffs
-        pass
+        if self.statbuff is not None:
+            self.statbuff(playerstats)
+
+# Unpickles a Buff subclass without calling its own __init__
+def _restore_buff(cls, args, field_values):
+    buff = object.__new__(cls)
+    for name, value in zip(cls._fields, field_values):
+        object.__setattr__(buff, name, value)
+    Buff.__init__(buff, *args)
+    return buff
+
+class DamageTypeBuff(Buff):
+    """ A buff that only affects hits of some damage types, e.g. Embolden
+        on the RDM's magic damage. The calc_*_damage functions and hit
+        kernels don't know the type of a hit and apply it like any other
+        buff: ffxiv_sim leaves it out of the hits of other types. """
+    _fields = ("damage_types",)
+
+    def __init__(self, damage_types, critbuff=0, dhbuff=0, damagebuff=0, statbuff=None):
+        self.damage_types = tuple(sorted(set(damage_types)))
+        super().__init__(critbuff, dhbuff, damagebuff, statbuff)
+
+    def applies_to(self, damage_type):
+        return damage_type in self.damage_types
+
+#################################################################
+# JOB REGISTRY                                                  #
+#################################################################
+# Everything the formulas need to know about a job, worked out once per
+# job instead of with string comparisons on every call. The job IDs and
+# attributes come from the job data CSV, the roles from JOB_ROLES (the
+# CSV doesn't have them). JOB_INFO maps job names to JobInfo records
+# and JOB_INFO_BY_ID maps job IDs to them. Like the other tables they
+# are built when the game data is loaded.
+
+class Role(int, Enum):
+    TANK = 1
+    HEALER = 2
+    CASTER = 3
+    PRANGED = 4
+    MELEE = 5
+
+JOB_ROLES = MappingProxyType({
+    "GLA": Role.TANK, "MRD": Role.TANK, "PLD": Role.TANK,
+    "WAR": Role.TANK, "DRK": Role.TANK, "GNB": Role.TANK,
+    "CNJ": Role.HEALER, "WHM": Role.HEALER, "SCH": Role.HEALER,
+    "AST": Role.HEALER, "SGE": Role.HEALER,
+    "THM": Role.CASTER, "BLM": Role.CASTER, "ACN": Role.CASTER,
+    "SMN": Role.CASTER, "RDM": Role.CASTER, "BLU": Role.CASTER,
+    "ARC": Role.PRANGED, "BRD": Role.PRANGED, "MCH": Role.PRANGED,
+    "DNC": Role.PRANGED,
+    "PGL": Role.MELEE, "LNC": Role.MELEE, "ROG": Role.MELEE,
+    "MNK": Role.MELEE, "DRG": Role.MELEE, "NIN": Role.MELEE,
+    "SAM": Role.MELEE, "RPR": Role.MELEE,
+})
+
+@dataclass(frozen=True)
+class JobInfo:
+    name: str
+    job_id: int
+    role: Role              # None for jobs without a known role
+    is_magic: bool          # Healers and casters use f(MAP) for damage
+    ap_stat: str            # Physical attack stat
+    map_stat: str           # Magical attack stat
+    attack_stat: str        # The one of them its damage uses
+    healing_stat: str
+    aa_potency: int
+    trait_mod: int
+    dot_speed_stat: str     # SKS or SPS, for DoTs
+    attributes: MappingProxyType = None     # Job attribute modifiers
+
+def _make_job_info(name, job_id=None, attributes=None):
+    role = JOB_ROLES.get(name)
+    is_magic = role is Role.HEALER or role is Role.CASTER
+    # DEX for NIN and the phys ranged, STR otherwise
+    if name == "ROG" or name == "NIN" or role is Role.PRANGED:
+        ap_stat = "DEX"
+    else:
+        ap_stat = "STR"
+    # MND for healers, INT for casters
+    if role is Role.HEALER:
+        map_stat = "MND"
+    else:
+        map_stat = "INT"
+    # MND for healers and SMN (lol) and INT for others
+    if role is Role.HEALER or name == "SMN":
+        healing_stat = "MND"
+    else:
+        healing_stat = "INT"
+    # 80 for the non-DNC phys ranged, 90 otherwise
+    if name == "ARC" or name == "BRD" or name == "MCH":
+        aa_potency = 80
+    else:
+        aa_potency = 90
+    if is_magic:
+        trait_mod = 130
+    elif role is Role.PRANGED:
+        trait_mod = 120
+    else:
+        trait_mod = 100
+    return JobInfo(name, job_id, role, is_magic, ap_stat, map_stat,
+                   map_stat if is_magic else ap_stat, healing_stat,
+                   aa_potency, trait_mod, "SPS" if is_magic else "SKS",
+                   attributes)
+
+def _set_job_info(job_data):
+    global JOB_INFO, JOB_INFO_BY_ID, _JOB_ARRAYS
+    info = {name: _make_job_info(name, attrs["JOB_ID"], attrs)
+            for name, attrs in job_data.items()}
+    by_id = [None] * (max(i.job_id for i in info.values()) + 1)
+    for i in info.values():
+        by_id[i.job_id] = i
+    JOB_INFO = MappingProxyType(info)
+    JOB_INFO_BY_ID = tuple(by_id)
+    _JOB_ARRAYS = None
+
+_JOB_ARRAYS = None
+
+def get_job_info(job):
+    """ JobInfo of a job name or job ID. """
+    if isinstance(job, str):
+        return JOB_INFO[job]
+    info = JOB_INFO_BY_ID[job] if 0 <= job < len(JOB_INFO_BY_ID) else None
+    if info is None:
+        raise KeyError(job)
+    return info
+
+# Record for the role functions, which also answer for unknown jobs
+def _job_info(job):
+    info = JOB_INFO.get(job)
+    if info is None:
+        info = _make_job_info(job)
+    return info
+
+def get_job_id(job):
+    return JOB_IDS[job]
+
+def job_id_array(jobs):
+    """ Job IDs of a list of job names, as an int64 array. """
+    import numpy as np
+    return np.array([JOB_IDS[job] for job in jobs], dtype=np.int64)
+
+def get_job_arrays():
+    """ The JobInfo fields as int64 arrays indexed by job ID, for batch
+        work: job_arrays["trait_mod"][job_ids]. Unused IDs are 0.
+        The stat fields hold the stat's index in STAT_NAMES. """
+    global _JOB_ARRAYS
+    if _JOB_ARRAYS is None:
+        import numpy as np
+        size = len(JOB_INFO_BY_ID)
+        arrays = {name: np.zeros(size, dtype=np.int64)
+                  for name in ("role", "is_magic", "aa_potency", "trait_mod",
+                               "attack_stat", "healing_stat", "dot_speed_stat")
+                               + JOB_COLUMN_NAMES[1:]}
+        for info in JOB_INFO_BY_ID:
+            if info is None:
+                continue
+            i = info.job_id
+            arrays["role"][i] = info.role or 0
+            arrays["is_magic"][i] = info.is_magic
+            arrays["aa_potency"][i] = info.aa_potency
+            arrays["trait_mod"][i] = info.trait_mod
+            for field in ("attack_stat", "healing_stat", "dot_speed_stat"):
+                arrays[field][i] = STAT_NAMES.index(getattr(info, field))
+            for column in JOB_COLUMN_NAMES[1:]:
+                arrays[column][i] = info.attributes[column]
+        for array in arrays.values():
+            array.flags.writeable = False
+        _JOB_ARRAYS = MappingProxyType(arrays)
+    return _JOB_ARRAYS
 
 def is_tank(job):
-    return (job == "GNB"
-         or job == "PLD"
-         or job == "WAR"
-         or job == "DRK"
-         or job == "GLA"
-         or job == "MRD")
+    return JOB_ROLES.get(job) is Role.TANK
 
 def is_healer(job):
-    return (job == "CNJ"
-         or job == "WHM"
-         or job == "SCH"
-         or job == "AST"
-         or job == "SGE")
+    return JOB_ROLES.get(job) is Role.HEALER
 
 def is_caster(job):
-    return (job == "THM"
-         or job == "BLM"
-         or job == "ACN"
-         or job == "SMN"
-         or job == "RDM"
-         or job == "BLU")
+    return JOB_ROLES.get(job) is Role.CASTER
 
 def is_pranged(job):
-    return (job == "ARC"
-         or job == "BRD"
-         or job == "MCH"
-         or job == "DNC")
+    return JOB_ROLES.get(job) is Role.PRANGED
 
 def is_melee(job):
-    return (job == "LNC"
-         or job == "PGL"
-         or job == "ROG"
-         or job == "DRG"
-         or job == "MNK"
-         or job == "NIN"
-         or job == "SAM"
-         or job == "RPR")
+    return JOB_ROLES.get(job) is Role.MELEE
 
 # Return the relevant physical attack stat
 # DEX for NIN and the phys ranged, STR otherwise
 def get_ap_stat(job):
-    if (job == "ROG" or job == "NIN" or is_pranged(job)):
-        return "DEX"
-    else:
-        return "STR"
+    return _job_info(job).ap_stat
 
 # Return the relevant magical attack stat
 # MND for healers, INT for casters
 def get_map_stat(job):
-    if is_healer(job):
-        return "MND"
-    else:
-        return "INT"
+    return _job_info(job).map_stat
 
 # Return the relevant healing magic stat
 # This is MND for healers and SMN (lol) and INT for others
 def get_healing_stat(job):
-    if is_healer(job) or job == "SMN":
-        return "MND"
-    else:
-        return "INT"
+    return _job_info(job).healing_stat
 
 # The base auto attack potency
 # This is 80 for the non-DNC phys ranged, 90 otherwise
 def get_aa_potency(job):
-    if job == "ARC" or job == "BRD" or job == "MCH":
-        return 80
-    else:
-        return 90
+    return _job_info(job).aa_potency
 
 def fixed_random_variation():
     """ Returns an int between 9500 and 10500 inclusive. """
@@ -267,73 +763,66 @@ def fixed_random_variation():
 
 # AKA p(crit)
 def calc_critrate(crit_stat, level):
-    sub = LEVEL_MOD_DATA[level - 1]["SUB"]
-    div = LEVEL_MOD_DATA[level - 1]["DIV"]
+    main, sub, div = LEVEL_MSD[level]
     pcrit = floor(CRT_RATE_MOD * (crit_stat - sub)/div) + 50
     return pcrit / 1000
 
 # AKA f(crit)
 def calc_critmod(crit_stat, level):
-    sub = LEVEL_MOD_DATA[level - 1]["SUB"]
-    div = LEVEL_MOD_DATA[level - 1]["DIV"]
+    main, sub, div = LEVEL_MSD[level]
     fcrit = 1400 + floor(CRT_DMG_MOD * (crit_stat - sub)/div)
     return fcrit / 1000
 
 # AKA p(DH)
 def calc_dhrate(dh_stat, level):
-    sub = LEVEL_MOD_DATA[level - 1]["SUB"]
-    div = LEVEL_MOD_DATA[level - 1]["DIV"]
+    main, sub, div = LEVEL_MSD[level]
     pdh = floor(DH_MOD * (dh_stat - sub)/div)
     return pdh / 1000
 
 # AKA f(DET)
 def calc_detmod(det_stat, level):
-    main = LEVEL_MOD_DATA[level - 1]["MAIN"]
-    div = LEVEL_MOD_DATA[level - 1]["DIV"]
+    main, sub, div = LEVEL_MSD[level]
     fdet = floor(DET_MOD * (det_stat - main) / div) + 1000
     return fdet / 1000
 
 # AKA f(SPD)
 def calc_spdmod(spd_stat, level):
-    sub = LEVEL_MOD_DATA[level - 1]["SUB"]
-    div = LEVEL_MOD_DATA[level - 1]["DIV"]
+    main, sub, div = LEVEL_MSD[level]
     fspd = 1000 + floor(SPD_MOD * (spd_stat - sub)/div)
     return fspd / 1000
 
 # AKA f(GCD)
 # Note, input GCD in ms, i.e. 2.5s = 2500
-def calc_gcdmod(spd_stat, gcd, level):
-    sub = LEVEL_MOD_DATA[level - 1]["SUB"]
-    div = LEVEL_MOD_DATA[level - 1]["DIV"]
-    fgcd = floor(gcd * (1000 + ceil(130 * (sub - spd_stat)/div))/10000)/100
+# haste is in percent, e.g. 13 for Presence of Mind
+def calc_gcdmod(spd_stat, gcd, level, haste=0):
+    main, sub, div = LEVEL_MSD[level]
+    fgcd = floor(gcd * (1000 + ceil(130 * (sub - spd_stat)/div))/1000)
+    fgcd = floor(fgcd * (100 - haste)/1000)/100
     return fgcd
 
 # AKA f(TNC)
 def calc_tenacitymod_dps(tnc_stat, level):
-    sub = LEVEL_MOD_DATA[level - 1]["SUB"]
-    div = LEVEL_MOD_DATA[level - 1]["DIV"]
+    main, sub, div = LEVEL_MSD[level]
     ftnc = 1000 + floor(TNC_MOD * (tnc_stat - sub)/div)
     return ftnc / 1000
 
 # AKA f(TNC)
 def calc_tenacitymod_mit(tnc_stat, level):
-    sub = LEVEL_MOD_DATA[level - 1]["SUB"]
-    div = LEVEL_MOD_DATA[level - 1]["DIV"]
+    main, sub, div = LEVEL_MSD[level]
     ftnc = 1000 - floor(100 * (tnc_stat - sub)/div)
     return ftnc / 1000
 
 # AKA f(PIE)
 # only affects MP regen now
 def calc_piety_mp_regen(pie_stat, level):
-    main = LEVEL_MOD_DATA[level - 1]["MAIN"]
-    div = LEVEL_MOD_DATA[level - 1]["DIV"]
+    main, sub, div = LEVEL_MSD[level]
     fpie = floor(PIE_MOD * (pie_stat - main)/div)
     return fpie
 
 # AKA f(DEF)
 # returns the damage multiplier
 def calc_defmod(def_stat, level):
-    div = LEVEL_MOD_DATA[level - 1]["DIV"]
+    main, sub, div = LEVEL_MSD[level]
     fdef = 100 - floor(15 * (def_stat/div))
     return fdef / 100
 
@@ -341,8 +830,8 @@ def calc_defmod(def_stat, level):
 # stat_used is the relevant attribute for the action,
 # i.e. MND for Physick, STR for True Thrust, etc.
 def calc_wepdamagemod(wd_stat, job, stat_used, level):
-    main = LEVEL_MOD_DATA[level - 1]["MAIN"]
-    attr = JOB_DATA[job][stat_used]
+    main, sub, div = LEVEL_MSD[level]
+    attr = JOB_COLUMNS[stat_used][JOB_IDS[job]]
     fwd = floor((main * attr / 1000) + wd_stat)
     return fwd
 
@@ -354,7 +843,7 @@ def calc_wepdamagemod(wd_stat, job, stat_used, level):
 # (not an increase!) to the coefficient of attack power.
 # Only levels 80 and 90 have been verified to be correct.
 def calc_atkpowermod(ap_stat, job, level):
-    main = LEVEL_MOD_DATA[level - 1]["MAIN"]
+    main, sub, div = LEVEL_MSD[level]
     if is_tank(job):
         if level > 80:
             # Unconfirmed except level=80 and level=90
@@ -384,19 +873,14 @@ def calc_atkpowermod(ap_stat, job, level):
 # Auto attack modifier
 # Similar to weapon damage f(WD) but includes weapon delay
 def calc_aamod(wd_stat, weapon_delay, job, stat_used, level):
-    main = LEVEL_MOD_DATA[level - 1]["MAIN"]
-    attr = JOB_DATA[job][get_ap_stat(job)]
+    main, sub, div = LEVEL_MSD[level]
+    attr = JOB_COLUMNS[get_ap_stat(job)][JOB_IDS[job]]
     fwd = floor((floor(main * attr / 1000) + wd_stat) * weapon_delay / 300)
     return fwd / 100
 
 # Job trait modifier
 def calc_jobtraitmod(job):
-    if is_healer(job) or is_caster(job):
-        return 130
-    elif is_pranged(job):
-        return 120
-    else:
-        return 100
+    return _job_info(job).trait_mod
 
 # Apply buffs directly to player stats
 # This would be things like the +5% full party buff, or potions
@@ -430,6 +914,321 @@ def apply_damage_buffs(base_damage, buffs):
         new_damage = floor(new_damage * (1000 + buff.damage_multiplier) / 1000)
     return new_damage
 
+# Apply a sequence of damage multipliers (scaled by 1000), in order
+def apply_damage_multipliers(base_damage, multipliers):
+    new_damage = base_damage
+    for multiplier in multipliers:
+        new_damage = floor(new_damage * (1000 + multiplier) / 1000)
+    return new_damage
+
+#################################################################
+# MEMOIZED MODIFIERS                                            #
+#################################################################
+# The modifiers below are pure functions of a stat and a few small keys
+# (the level, and for the last two the job), and sweeps call them with
+# the same arguments over and over. The modifier cache is opt-in: while
+# it's enabled, the module functions are replaced by cached versions, so
+# every caller in this module goes through it, and disabling it puts
+# the plain functions back. (Modules that imported a modifier by name
+# keep the plain one.) It can't be enabled or disabled while something
+# else (e.g. a Profiler) has replaced one of the functions.
+# For the levels in MODIFIER_TABLE_LEVELS, a key (level, or job and
+# level) that missed MODIFIER_TABLE_MISSES times gets a dense table of
+# the modifier for every stat below MODIFIER_TABLE_SIZE, built with one
+# NumPy call of the *_int version of the modifier. Each modifier keeps
+# at most MODIFIER_TABLE_LIMIT tables and drops the oldest one to make
+# room. Everything else goes to an LRU cache per modifier.
+# Loading or unloading the game data clears the cache.
+
+MEMOIZED_MODIFIERS = ("calc_critrate", "calc_critmod", "calc_dhrate",
+                      "calc_detmod", "calc_spdmod", "calc_wepdamagemod",
+                      "calc_atkpowermod")
+# Levels that get dense tables
+MODIFIER_TABLE_LEVELS = range(50, 101)
+# Stats 0 to MODIFIER_TABLE_SIZE - 1 are in the dense tables
+MODIFIER_TABLE_SIZE = 8192
+# Misses of a key before it gets a dense table. Building one takes
+# about as long as this many calls of the plain function.
+MODIFIER_TABLE_MISSES = 1024
+# Dense tables per modifier
+MODIFIER_TABLE_LIMIT = 64
+# Size of each modifier's LRU cache
+MODIFIER_LRU_SIZE = 4096
+
+# The plain functions, whatever the module globals are at the moment
+_MODIFIER_FUNCTIONS = {name: globals()[name] for name in MEMOIZED_MODIFIERS}
+# Integer version and scale of each modifier, for building the tables
+_MODIFIER_INT_FUNCTIONS = {
+    "calc_critrate": ("calc_critrate_int", 1000),
+    "calc_critmod": ("calc_critmod_int", 1000),
+    "calc_dhrate": ("calc_dhrate_int", 1000),
+    "calc_detmod": ("calc_detmod_int", 1000),
+    "calc_spdmod": ("calc_spdmod_int", 1000),
+    "calc_wepdamagemod": ("calc_wepdamagemod_int", 1),
+    "calc_atkpowermod": ("calc_atkpowermod_int", 1),
+}
+_MODIFIER_CACHE = None
+
+@dataclass(frozen=True)
+class ModifierCacheInfo:
+    """ Lookup counts of the modifier cache (of one modifier, or all). """
+    table_hits: int
+    lru_hits: int
+    lru_misses: int
+    tables: int                     # Dense tables held now
+    tables_built: int               # Dense tables built, including dropped ones
+    table_bytes: int                # Memory of the dense tables held now
+    lru_size: int                   # Entries in the LRU caches
+
+    @property
+    def hits(self):
+        return self.table_hits + self.lru_hits
+
+    @property
+    def misses(self):
+        return self.lru_misses
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+class _CachedModifier:
+    """ Dense tables and an LRU cache in front of one modifier function.
+        The stat is the first argument, the table key is the rest.
+        lookup is a closure rather than a method, since on a hit the
+        overhead of the call is most of the time it takes. It takes the
+        parameters of the function it replaces, names included, so
+        keyword calls keep working. """
+    def __init__(self, name, levels, table_size, lru_size,
+                 table_misses, table_limit):
+        self.name = name
+        self.func = _MODIFIER_FUNCTIONS[name]
+        self.levels = frozenset(levels)
+        self.table_size = table_size
+        self.table_misses = table_misses
+        self.table_limit = table_limit
+        self.lru = lru_cache(maxsize=lru_size)(self.func)
+        self.tables = {}                # In the order they were built
+        self.table_bytes = {}
+        self.tables_built = 0
+        self._misses = {}               # Misses per key without a table
+        self._misses_limit = lru_size or MODIFIER_LRU_SIZE
+        self._hits = [0]
+        self.lookup = self._make_lookup()
+
+    def _make_lookup(self):
+        get_table = self.tables.get
+        hits = self._hits
+        miss = self._miss
+        code = self.func.__code__
+        # One closure per number of arguments: *key or **kwargs would
+        # slow down every hit
+        if code.co_argcount == 2:
+            # (stat, level), the table key is just the level
+            def lookup(stat, level):
+                table = get_table(level)
+                if table is not None and stat >= 0:
+                    try:
+                        value = table[stat]
+                    except (IndexError, TypeError):
+                        return miss(stat, level)
+                    hits[0] += 1
+                    return value
+                return miss(stat, level)
+        elif code.co_argcount == 3:
+            # (stat, job, level)
+            def lookup(stat, job, level):
+                table = get_table((job, level))
+                if table is not None and stat >= 0:
+                    try:
+                        value = table[stat]
+                    except (IndexError, TypeError):
+                        return miss(stat, job, level)
+                    hits[0] += 1
+                    return value
+                return miss(stat, job, level)
+        else:
+            # (stat, job, stat_used, level)
+            def lookup(stat, job, stat_used, level):
+                table = get_table((job, stat_used, level))
+                if table is not None and stat >= 0:
+                    try:
+                        value = table[stat]
+                    except (IndexError, TypeError):
+                        return miss(stat, job, stat_used, level)
+                    hits[0] += 1
+                    return value
+                return miss(stat, job, stat_used, level)
+        # Rename the parameters to the function's own
+        names = code.co_varnames[:code.co_argcount]
+        lookup.__code__ = lookup.__code__.replace(
+            co_varnames=names + lookup.__code__.co_varnames[len(names):])
+        return lookup
+
+    def _miss(self, stat, *key):
+        table_key = key[0] if len(key) == 1 else key
+        if table_key not in self.tables and key[-1] in self.levels:
+            misses = self._misses.get(table_key, 0) + 1
+            if misses >= self.table_misses:
+                self._misses.pop(table_key, None)
+                self._add_table(table_key, key)
+                return self.lookup(stat, *key)
+            if len(self._misses) >= self._misses_limit:
+                self._misses.clear()
+            self._misses[table_key] = misses
+        return self.lru(stat, *key)
+
+    def _add_table(self, table_key, key):
+        while self.tables and len(self.tables) >= self.table_limit:
+            oldest = next(iter(self.tables))
+            del self.tables[oldest]
+            del self.table_bytes[oldest]
+        table, size = self._build_table(key)
+        self.tables[table_key] = table
+        self.table_bytes[table_key] = size
+        self.tables_built += 1
+
+    def _build_table(self, key):
+        """ (table, its approximate size in bytes). The substat modifiers
+            only change every few stat points, so runs of equal values
+            share one object and such a table mostly costs one pointer
+            per stat. """
+        import numpy as np
+        int_name, scale = _MODIFIER_INT_FUNCTIONS[self.name]
+        values = globals()[int_name](np.arange(self.table_size, dtype=np.int64), *key)
+        starts = np.empty(len(values), dtype=bool)
+        starts[:1] = True
+        np.not_equal(values[1:], values[:-1], out=starts[1:])
+        if scale != 1:
+            values = values / scale
+        if 2 * np.count_nonzero(starts) > len(values):
+            unique = table = tuple(values.tolist())
+        else:
+            unique = values[starts].tolist()
+            table = tuple(map(unique.__getitem__, (np.cumsum(starts) - 1).tolist()))
+        size = sys.getsizeof(table) + len(unique) * sys.getsizeof(unique[0])
+        return table, size
+
+    def clear(self):
+        self.tables.clear()
+        self.table_bytes.clear()
+        self.tables_built = 0
+        self._misses.clear()
+        self._hits[0] = 0
+        self.lru.cache_clear()
+
+    def info(self):
+        lru = self.lru.cache_info()
+        return ModifierCacheInfo(self._hits[0], lru.hits, lru.misses,
+                                 len(self.tables), self.tables_built,
+                                 sum(self.table_bytes.values()), lru.currsize)
+
+# Raise if a modifier's module global isn't what the cache left there
+def _check_modifier_globals():
+    for name, func in _MODIFIER_FUNCTIONS.items():
+        if _MODIFIER_CACHE is not None:
+            func = _MODIFIER_CACHE[name].lookup
+        if globals()[name] is not func:
+            raise RuntimeError("{} has been replaced (by an enabled Profiler?), "
+                               "can't switch the modifier cache".format(name))
+
+def enable_modifier_cache(levels=None, table_size=None, lru_size=None,
+                          table_misses=None, table_limit=None):
+    """ Route the MEMOIZED_MODIFIERS through the modifier cache. Enabling
+        it again with other settings starts over with an empty cache. """
+    global _MODIFIER_CACHE
+    disable_modifier_cache()
+    levels = MODIFIER_TABLE_LEVELS if levels is None else levels
+    table_size = MODIFIER_TABLE_SIZE if table_size is None else table_size
+    lru_size = MODIFIER_LRU_SIZE if lru_size is None else lru_size
+    table_misses = MODIFIER_TABLE_MISSES if table_misses is None else table_misses
+    table_limit = MODIFIER_TABLE_LIMIT if table_limit is None else table_limit
+    _MODIFIER_CACHE = {name: _CachedModifier(name, levels, table_size, lru_size,
+                                             table_misses, table_limit)
+                       for name in MEMOIZED_MODIFIERS}
+    for name, cached in _MODIFIER_CACHE.items():
+        globals()[name] = cached.lookup
+
+def disable_modifier_cache():
+    """ Put the plain modifier functions back and drop the cache. """
+    global _MODIFIER_CACHE
+    _check_modifier_globals()
+    globals().update(_MODIFIER_FUNCTIONS)
+    _MODIFIER_CACHE = None
+
+def modifier_cache_enabled():
+    return _MODIFIER_CACHE is not None
+
+def clear_modifier_cache():
+    """ Empty the tables and LRU caches, e.g. after the level data changed. """
+    if _MODIFIER_CACHE is not None:
+        for cached in _MODIFIER_CACHE.values():
+            cached.clear()
+
+def modifier_cache_info(name=None):
+    """ ModifierCacheInfo of one of the MEMOIZED_MODIFIERS, or the totals
+        of all of them. All zeros while the cache is disabled. """
+    if name is not None:
+        if name not in _MODIFIER_FUNCTIONS:
+            raise KeyError("{} is not a memoized modifier".format(name))
+        if _MODIFIER_CACHE is None:
+            return ModifierCacheInfo(0, 0, 0, 0, 0, 0, 0)
+        return _MODIFIER_CACHE[name].info()
+    infos = [modifier_cache_info(name) for name in MEMOIZED_MODIFIERS]
+    return ModifierCacheInfo(*[sum(values) for values in zip(
+        *[astuple(info) for info in infos])])
+
+#################################################################
+# BUFF SETS                                                     #
+#################################################################
+# The same buff combinations come up over and over (every hit in a raid
+# buff window has the same ones). A combination is frozen into a tuple
+# and everything the damage formulas need from it is computed once and
+# kept in an LRU cache, together with the buffed stats.
+# The order of the buffs is kept: the damage multipliers floor one after
+# the other, and a different order can change the damage by 1. Buffs
+# that do nothing are dropped, since they never change a result.
+
+# Size of the buff effects LRU cache
+BUFF_CACHE_SIZE = 4096
+
+# Frozen, canonical form of a list of buffs
+def freeze_buffs(buffs):
+    return tuple([buff for buff in buffs if not buff.is_noop])
+
+@dataclass(frozen=True)
+class BuffEffects:
+    """ The combined effects of a buff set on one set of stats.
+        stats is shared by everyone using the cache: don't modify it. """
+    stats: PlayerStats
+    crit_chance: int                # Added crit chance, scaled by 1000
+    dh_chance: int                  # Added DH chance, scaled by 1000
+    damage_multipliers: tuple       # In the order they are applied
+
+def _stats_key(playerstats):
+    return (playerstats.level,) + playerstats.to_tuple()
+
+def _calc_buff_effects(buffs, stats_key):
+    playerstats = PlayerStats(*stats_key)
+    return BuffEffects(apply_stat_buffs(playerstats, buffs),
+                       apply_critchance_buffs(0, buffs),
+                       apply_dh_buffs(0, buffs),
+                       tuple(buff.damage_multiplier for buff in buffs))
+
+_cached_buff_effects = lru_cache(maxsize=BUFF_CACHE_SIZE)(_calc_buff_effects)
+
+def get_buff_effects(playerstats, buffs):
+    """ Cached BuffEffects of buffs on playerstats. """
+    return _cached_buff_effects(freeze_buffs(buffs), _stats_key(playerstats))
+
+def buff_cache_info():
+    """ (hits, misses, maxsize, currsize) of the buff effects cache. """
+    return _cached_buff_effects.cache_info()
+
+def clear_buff_cache():
+    _cached_buff_effects.cache_clear()
+
 # Direct damage calculation for actions/spells/weaponskills
 def calc_action_damage(potency: int,
                        job: str,
@@ -441,7 +1240,8 @@ def calc_action_damage(potency: int,
                        randvar=None):
     """ Calculate damage dealt by a direct attack spell or weaponskill. """
     # Compute the buffed stats
-    buffedstats = apply_stat_buffs(playerstats, buffs)
+    effects = get_buff_effects(playerstats, buffs)
+    buffedstats = effects.stats
     # Get the relevant main stat for the attack
     if is_healer(job) or is_caster(job):
         mainstat = get_map_stat(job)
@@ -452,8 +1252,7 @@ def calc_action_damage(potency: int,
     fatk = calc_atkpowermod(ap_stat, job, playerstats.level)
     fdet = int(calc_detmod(buffedstats.DET, playerstats.level) * 1000)
     if dhtype is DHType.ForcedDirectHit:
-        sub = LEVEL_MOD_DATA[buffedstats.level - 1]["SUB"]
-        div = LEVEL_MOD_DATA[buffedstats.level - 1]["DIV"]
+        main, sub, div = LEVEL_MSD[buffedstats.level]
         fdet += floor(DET_MOD * (buffedstats.DH - sub)/div)
     if is_tank(job):
         ftnc = floor(1000 * calc_tenacitymod_dps(buffedstats.TNC, playerstats.level))
@@ -466,12 +1265,12 @@ def calc_action_damage(potency: int,
         critmod = 1000 * floor(1000 * calc_critmod(buffedstats.CRT, playerstats.level))
     elif crittype is CritType.ForcedCrit:
         critmod = floor(1000 * calc_critmod(buffedstats.CRT, playerstats.level))
-        critchance = apply_critchance_buffs(0, buffs) # only buffs increase the base multiplier
+        critchance = effects.crit_chance # only buffs increase the base multiplier
         critmod *= 1000 + floor((critmod - 1000) * critchance / 1000)
     elif crittype is CritType.Average:
         critmod = floor(1000 * calc_critmod(buffedstats.CRT, playerstats.level))
         critchance = floor(1000 * calc_critrate(buffedstats.CRT, playerstats.level))
-        critchance = apply_critchance_buffs(critchance, buffs)
+        critchance += effects.crit_chance
         critmod = 1000000 + floor((critmod - 1000) * critchance)
     else:
         critmod = 1000000
@@ -479,10 +1278,10 @@ def calc_action_damage(potency: int,
     if dhtype is DHType.DirectHit:
         dhmod = 1250000
     elif dhtype is DHType.ForcedDirectHit:
-        dhmod = 1250 * floor(1000 + 250 * apply_dh_buffs(0, buffs) / 1000)
+        dhmod = 1250 * floor(1000 + 250 * effects.dh_chance / 1000)
     elif dhtype is DHType.Average:
         dhchance = floor(1000 * calc_dhrate(buffedstats.DH, playerstats.level))
-        dhchance = apply_dh_buffs(dhchance, buffs)
+        dhchance += effects.dh_chance
         dhmod = 1000000 + floor(250 * dhchance)
     else:
         dhmod = 1000000
@@ -499,7 +1298,7 @@ def calc_action_damage(potency: int,
     damage = floor(damage * randvar / 10000)
     # Apply buffs (These happen *after* the random variation!)
     # (But note they still increase overall variance, just not as much)
-    damage = apply_damage_buffs(damage, buffs)
+    damage = apply_damage_multipliers(damage, effects.damage_multipliers)
     return damage
 
 def calc_dot_tick_damage(potency: int,
@@ -514,7 +1313,8 @@ def calc_dot_tick_damage(potency: int,
         Note that buffs are snapshot on application, but each tick
         rolls for crit, DH, and damage variance separately. """
     # Compute the buffed stats
-    buffedstats = apply_stat_buffs(playerstats, buffs)
+    effects = get_buff_effects(playerstats, buffs)
+    buffedstats = effects.stats
     # Get the relevant main stat for the attack
     if is_healer(job) or is_caster(job):
         mainstat = get_map_stat(job)
@@ -525,8 +1325,7 @@ def calc_dot_tick_damage(potency: int,
     fatk = calc_atkpowermod(ap_stat, job, playerstats.level)
     fdet = int(calc_detmod(buffedstats.DET, playerstats.level) * 1000)
     if dhtype is DHType.ForcedDirectHit:
-        sub = LEVEL_MOD_DATA[buffedstats.level - 1]["SUB"]
-        div = LEVEL_MOD_DATA[buffedstats.level - 1]["DIV"]
+        main, sub, div = LEVEL_MSD[buffedstats.level]
         fdet += floor(DET_MOD * (buffedstats.DH - sub)/div)
     # Select the skill vs spell speed to use.
     # afaik there's no job with DoTs that have both skill and spell speed?
@@ -548,12 +1347,12 @@ def calc_dot_tick_damage(potency: int,
         critmod = 1000 * floor(1000 * calc_critmod(buffedstats.CRT, playerstats.level))
     elif crittype is CritType.ForcedCrit:
         critmod = floor(1000 * calc_critmod(buffedstats.CRT, playerstats.level))
-        critchance = apply_critchance_buffs(0, buffs) # only buffs increase the base multiplier
+        critchance = effects.crit_chance # only buffs increase the base multiplier
         critmod *= 1000 + floor((critmod - 1000) * critchance / 1000)
     elif crittype is CritType.Average:
         critmod = floor(1000 * calc_critmod(buffedstats.CRT, playerstats.level))
         critchance = floor(1000 * calc_critrate(buffedstats.CRT, playerstats.level))
-        critchance = apply_critchance_buffs(critchance, buffs)
+        critchance += effects.crit_chance
         critmod = 1000000 + floor((critmod - 1000) * critchance)
     else:
         critmod = 1000000
@@ -561,10 +1360,10 @@ def calc_dot_tick_damage(potency: int,
     if dhtype is DHType.DirectHit:
         dhmod = 1250000
     elif dhtype is DHType.ForcedDirectHit:
-        dhmod = 1250 * floor(1000 + 250 * apply_dh_buffs(0, buffs) / 1000)
+        dhmod = 1250 * floor(1000 + 250 * effects.dh_chance / 1000)
     elif dhtype is DHType.Average:
         dhchance = floor(1000 * calc_dhrate(buffedstats.DH, playerstats.level))
-        dhchance = apply_dh_buffs(dhchance, buffs)
+        dhchance += effects.dh_chance
         dhmod = 1000000 + floor(250 * dhchance)
     else:
         dhmod = 1000000
@@ -592,7 +1391,7 @@ def calc_dot_tick_damage(potency: int,
     damage = floor(damage * critmod / 1000000)
     damage = floor(damage * dhmod / 1000000)
     # Apply damage buffs (these happen *after* the random variation)
-    damage = apply_damage_buffs(damage, buffs)
+    damage = apply_damage_multipliers(damage, effects.damage_multipliers)
     return damage
 
 def calc_aa_damage(job: str,
@@ -606,7 +1405,8 @@ def calc_aa_damage(job: str,
     # Get the job-based potency
     potency = get_aa_potency(job)
     # Compute the buffed stats
-    buffedstats = apply_stat_buffs(playerstats, buffs)
+    effects = get_buff_effects(playerstats, buffs)
+    buffedstats = effects.stats
     # Get the relevant main stat for the attack
     if is_healer(job) or is_caster(job):
         mainstat = get_map_stat(job)
@@ -617,27 +1417,26 @@ def calc_aa_damage(job: str,
     fatk = calc_atkpowermod(ap_stat, job, playerstats.level)
     fdet = int(calc_detmod(buffedstats.DET, playerstats.level) * 1000)
     if dhtype is DHType.ForcedDirectHit:
-        sub = LEVEL_MOD_DATA[buffedstats.level - 1]["SUB"]
-        div = LEVEL_MOD_DATA[buffedstats.level - 1]["DIV"]
+        main, sub, div = LEVEL_MSD[buffedstats.level]
         fdet += floor(DET_MOD * (buffedstats.DH - sub)/div)
     if is_tank(job):
         ftnc = floor(1000 * calc_tenacitymod_dps(buffedstats.TNC, playerstats.level))
     else:
         ftnc = 1000
-    fspd = calc_spdmod(buffedstats.SKS, playerstats.level) # autos always use SKS
-    aa_mod = calc_aamod(weaponinfo.damage, weaponinfo.delay, job, mainstat, playerstats.level)
+    fspd = floor(1000 * calc_spdmod(buffedstats.SKS, playerstats.level)) # autos always use SKS
+    aa_mod = round(100 * calc_aamod(weaponinfo.damage, weaponinfo.delay, job, mainstat, playerstats.level))
     traitmod = calc_jobtraitmod(job)
     # Crit modifier based on crit type
     if crittype is CritType.Crit:
         critmod = 1000 * floor(1000 * calc_critmod(buffedstats.CRT, playerstats.level))
     elif crittype is CritType.ForcedCrit:
         critmod = floor(1000 * calc_critmod(buffedstats.CRT, playerstats.level))
-        critchance = apply_critchance_buffs(0, buffs) # only buffs increase the base multiplier
+        critchance = effects.crit_chance # only buffs increase the base multiplier
         critmod *= 1000 + floor((critmod - 1000) * critchance / 1000)
     elif crittype is CritType.Average:
         critmod = floor(1000 * calc_critmod(buffedstats.CRT, playerstats.level))
         critchance = floor(1000 * calc_critrate(buffedstats.CRT, playerstats.level))
-        critchance = apply_critchance_buffs(critchance, buffs)
+        critchance += effects.crit_chance
         critmod = 1000000 + floor((critmod - 1000) * critchance)
     else:
         critmod = 1000000
@@ -645,10 +1444,10 @@ def calc_aa_damage(job: str,
     if dhtype is DHType.DirectHit:
         dhmod = 1250000
     elif dhtype is DHType.ForcedDirectHit:
-        dhmod = 1250 * floor(1000 + 250 * apply_dh_buffs(0, buffs) / 1000)
+        dhmod = 1250 * floor(1000 + 250 * effects.dh_chance / 1000)
     elif dhtype is DHType.Average:
         dhchance = floor(1000 * calc_dhrate(buffedstats.DH, playerstats.level))
-        dhchance = apply_dh_buffs(dhchance, buffs)
+        dhchance += effects.dh_chance
         dhmod = 1000000 + floor(250 * dhchance)
     else:
         dhmod = 1000000
@@ -667,13 +1466,1248 @@ def calc_aa_damage(job: str,
     damage = floor(damage * dhmod / 1000000)
     damage = floor(damage * randvar / 10000)
     # Apply damage buffs (these happen *after* the random variation)
-    damage = apply_damage_buffs(damage, buffs)
+    damage = apply_damage_multipliers(damage, effects.damage_multipliers)
     return damage
 
+#################################################################
+# HIT KERNELS AND BATCH EVALUATION                              #
+#################################################################
+# A HitKernel freezes everything about a hit that only depends on the
+# job, weapon, stats and buffs. The damage methods then only do the
+# potency-dependent floors, which is what the rotation simulators need
+# when they call the same snapshot millions of times.
+# The *_batch methods evaluate the same formulas over NumPy arrays.
+# Every floor happens in the same place and in the same order as in
+# the calc_*_damage functions above, so for the same inputs the results
+# are identical. NumPy is only needed for the batch methods, so it is
+# imported inside them rather than at the top of the module.
+
+# Crit modifier for a given crit type, scaled by 1000000.
+# Same branches as in calc_action_damage. critmod is f(CRIT) and critrate
+# the unbuffed p(CRIT), both scaled by 1000.
+def _calc_critmod_for_type(crittype, critmod, critrate, effects):
+    if crittype is CritType.Crit:
+        return 1000 * critmod
+    elif crittype is CritType.ForcedCrit:
+        critchance = effects.crit_chance
+        return critmod * (1000 + floor((critmod - 1000) * critchance / 1000))
+    elif crittype is CritType.Average:
+        critchance = critrate + effects.crit_chance
+        return 1000000 + floor((critmod - 1000) * critchance)
+    else:
+        return 1000000
+
+# DH modifier for a given DH type, scaled by 1000000.
+# Same branches as in calc_action_damage. dhrate is the unbuffed p(DH),
+# scaled by 1000.
+def _calc_dhmod_for_type(dhtype, dhrate, effects):
+    if dhtype is DHType.DirectHit:
+        return 1250000
+    elif dhtype is DHType.ForcedDirectHit:
+        return 1250 * floor(1000 + 250 * effects.dh_chance / 1000)
+    elif dhtype is DHType.Average:
+        dhchance = dhrate + effects.dh_chance
+        return 1000000 + floor(250 * dhchance)
+    else:
+        return 1000000
+
+# floor(values * num / den) for an array, as int64
+def _np_floor_scale(np, values, num, den):
+    return np.floor(values * num / den).astype(np.int64)
+
+class HitKernel:
+    """ All modifiers of a hit that only depend on the job, weapon,
+        stats and buffs, computed once the same way as in calc_*_damage.
+        Build one per snapshot and reuse it for every hit. """
+    def __init__(self, job, weaponinfo, playerstats, buffs):
+        level = playerstats.level
+        effects = get_buff_effects(playerstats, buffs)
+        buffedstats = effects.stats
+        info = get_job_info(job)
+        self.job = job
+        self.level = level
+        self.is_magic = info.is_magic
+        mainstat = info.attack_stat
+        self.traitmod = info.trait_mod
+        self.aa_potency = info.aa_potency
+        critmod, critrate, dhrate = self._set_stat_modifiers(
+            buffedstats, level, info, weaponinfo, mainstat)
+        self.critmods = {ct: self._critmod_for_type(ct, critmod, critrate, effects)
+                         for ct in CritType}
+        self.dhmods = {dt: self._dhmod_for_type(dt, dhrate, effects)
+                       for dt in DHType}
+        self.damage_multipliers = effects.damage_multipliers
+        # Buffed crit and DH chances, scaled by 1000
+        self.critchance = critrate + effects.crit_chance
+        self.dhchance = dhrate + effects.dh_chance
+        # Pre-random damage per (potency, forced DH), filled on demand
+        self._action_base = {}
+        self._dot_base = {}
+        self._aa_base = {}
+
+    # Crit and DH modifiers of each CritType and DHType
+    _critmod_for_type = staticmethod(_calc_critmod_for_type)
+    _dhmod_for_type = staticmethod(_calc_dhmod_for_type)
+
+    def _set_stat_modifiers(self, buffedstats, level, info, weaponinfo, mainstat):
+        """ Set the stat modifiers the way the calc_*_damage functions
+            compute them. Returns (f(CRIT), p(CRIT), p(DH)) scaled by 1000. """
+        ap_stat = buffedstats.get_stat_by_name(mainstat)
+        self.fatk = calc_atkpowermod(ap_stat, self.job, level)
+        self.fwd = calc_wepdamagemod(weaponinfo.damage, self.job, mainstat, level)
+        self.fdet = int(calc_detmod(buffedstats.DET, level) * 1000)
+        # Forced DH adds the DH stat to f(DET).
+        # (Uses the level of the buffed stats, as the scalar functions do)
+        main, sub, div = LEVEL_MSD[buffedstats.level]
+        self.fdet_forced_dh = self.fdet + floor(DET_MOD * (buffedstats.DH - sub)/div)
+        if info.role is Role.TANK:
+            self.ftnc = floor(1000 * calc_tenacitymod_dps(buffedstats.TNC, level))
+        else:
+            self.ftnc = 1000
+        # DoTs use skill or spell speed depending on the job
+        self.fspd_dot = floor(1000 * calc_spdmod(getattr(buffedstats, info.dot_speed_stat), level))
+        # Autos always use skill speed. f(AUTO) is a multiple of 1/100,
+        # so round rather than floor it back to an integer.
+        self.fspd_aa = floor(1000 * calc_spdmod(buffedstats.SKS, level))
+        self.aa_mod = round(100 * calc_aamod(weaponinfo.damage, weaponinfo.delay,
+                                             self.job, mainstat, level))
+        return (floor(1000 * calc_critmod(buffedstats.CRT, level)),
+                floor(1000 * calc_critrate(buffedstats.CRT, level)),
+                floor(1000 * calc_dhrate(buffedstats.DH, level)))
+
+    # Pre-random part of calc_action_damage
+    def action_base_damage(self, potency, forced_dh=False):
+        key = (potency, forced_dh)
+        damage = self._action_base.get(key)
+        if damage is None:
+            fdet = self.fdet_forced_dh if forced_dh else self.fdet
+            damage = floor(floor(floor(potency * self.fatk / 100) * fdet) / 1000)
+            damage = floor(damage * self.ftnc / 1000)
+            damage = floor(damage * self.fwd / 100)
+            damage = floor(damage * self.traitmod / 100)
+            self._action_base[key] = damage
+        return damage
+
+    # Pre-random part of calc_dot_tick_damage
+    def dot_base_damage(self, potency, forced_dh=False):
+        key = (potency, forced_dh)
+        damage = self._dot_base.get(key)
+        if damage is None:
+            fdet = self.fdet_forced_dh if forced_dh else self.fdet
+            if self.is_magic:
+                damage = floor(potency * self.fwd / 100)
+                damage = floor(damage * self.fatk / 100)
+                damage = floor(damage * self.fspd_dot / 1000)
+                damage = floor(damage * fdet / 1000)
+                damage = floor(damage * self.ftnc / 1000)
+                damage = floor(damage * self.traitmod / 100)
+            else:
+                damage = floor(potency * self.fatk / 100)
+                damage = floor(damage * fdet / 1000)
+                damage = floor(damage * self.ftnc / 1000)
+                damage = floor(damage * self.fspd_dot / 1000)
+                damage = floor(damage * self.fwd / 100)
+                damage = floor(damage * self.traitmod / 100)
+            damage += int(potency < 100)
+            self._dot_base[key] = damage
+        return damage
+
+    # Pre-random part of calc_aa_damage
+    def aa_base_damage(self, forced_dh=False):
+        damage = self._aa_base.get(forced_dh)
+        if damage is None:
+            potency = self.aa_potency
+            fdet = self.fdet_forced_dh if forced_dh else self.fdet
+            damage = floor(potency * self.fatk / 100)
+            damage = floor(damage * fdet / 1000)
+            damage = floor(damage * self.ftnc / 1000)
+            damage = floor(damage * self.fspd_aa / 1000)
+            damage = floor(damage * self.aa_mod / 100)
+            damage = floor(damage * self.traitmod / 100)
+            damage += int(potency < 100)
+            self._aa_base[forced_dh] = damage
+        return damage
+
+    def apply_damage_buffs(self, damage):
+        return apply_damage_multipliers(damage, self.damage_multipliers)
+
+    def damage(self, potency, crit=CritType.Normal, dh=DHType.Normal, randvar=None):
+        """ Same as calc_action_damage for this kernel's snapshot. """
+        damage = self.action_base_damage(potency, dh is DHType.ForcedDirectHit)
+        if randvar is None:
+            randvar = fixed_random_variation()
+        damage = floor(damage * self.critmods[crit] / 1000000)
+        damage = floor(damage * self.dhmods[dh] / 1000000)
+        damage = floor(damage * randvar / 10000)
+        return self.apply_damage_buffs(damage)
+
+    def dot_damage(self, potency, crit=CritType.Normal, dh=DHType.Normal, randvar=None):
+        """ Same as calc_dot_tick_damage for this kernel's snapshot. """
+        damage = self.dot_base_damage(potency, dh is DHType.ForcedDirectHit)
+        if randvar is None:
+            randvar = fixed_random_variation()
+        damage = floor(damage * randvar / 10000)
+        damage = floor(damage * self.critmods[crit] / 1000000)
+        damage = floor(damage * self.dhmods[dh] / 1000000)
+        return self.apply_damage_buffs(damage)
+
+    def aa_damage(self, crit=CritType.Normal, dh=DHType.Normal, randvar=None):
+        """ Same as calc_aa_damage for this kernel's snapshot. """
+        damage = self.aa_base_damage(dh is DHType.ForcedDirectHit)
+        if randvar is None:
+            randvar = fixed_random_variation()
+        damage = floor(damage * self.critmods[crit] / 1000000)
+        damage = floor(damage * self.dhmods[dh] / 1000000)
+        damage = floor(damage * randvar / 10000)
+        return self.apply_damage_buffs(damage)
+
+    def _batch_random_components(self, np, shape, crits, dhs, randvars,
+                                 crittype, dhtype, rng):
+        """ Broadcast the crit/DH flags and random variations to shape and
+            turn them into modifier arrays. """
+        if crits is None:
+            crits = False
+        if dhs is None:
+            dhs = False
+        crits = np.broadcast_to(np.asarray(crits, dtype=bool), shape)
+        dhs = np.broadcast_to(np.asarray(dhs, dtype=bool), shape)
+        if randvars is None:
+            if rng is None:
+                rng = np.random.default_rng()
+            randvars = rng.integers(9500, 10501, size=shape)
+        randvars = np.broadcast_to(np.asarray(randvars, dtype=np.int64), shape)
+        critmod = np.where(crits, self.critmods[crittype], self.critmods[CritType.Normal])
+        dhmod = np.where(dhs, self.dhmods[dhtype], self.dhmods[DHType.Normal])
+        if dhtype is DHType.ForcedDirectHit:
+            fdet = np.where(dhs, self.fdet_forced_dh, self.fdet)
+        else:
+            fdet = self.fdet
+        return critmod, dhmod, fdet, randvars
+
+    # floor(values * num / den) for the batch methods
+    _np_scale = staticmethod(_np_floor_scale)
+
+    def _batch_apply_damage_buffs(self, np, damage):
+        for multiplier in self.damage_multipliers:
+            damage = self._np_scale(np, damage, 1000 + multiplier, 1000)
+        return damage
+
+    def damage_batch(self, potencies, crits=None, dhs=None, randvars=None,
+                     crittype=CritType.Crit, dhtype=DHType.DirectHit, rng=None):
+        """ Vectorized damage(). See calc_action_damage_batch. """
+        import numpy as np
+        potencies = np.asarray(potencies, dtype=np.int64)
+        shape = np.broadcast_shapes(potencies.shape, np.shape(crits),
+                                    np.shape(dhs), np.shape(randvars))
+        critmod, dhmod, fdet, randvars = self._batch_random_components(
+            np, shape, crits, dhs, randvars, crittype, dhtype, rng)
+        # Pre-random components
+        damage = self._np_scale(np, potencies, self.fatk, 100)
+        damage = self._np_scale(np, damage * fdet, 1, 1000)
+        damage = self._np_scale(np, damage, self.ftnc, 1000)
+        damage = self._np_scale(np, damage, self.fwd, 100)
+        damage = self._np_scale(np, damage, self.traitmod, 100)
+        # Random chance components
+        damage = self._np_scale(np, damage, critmod, 1000000)
+        damage = self._np_scale(np, damage, dhmod, 1000000)
+        damage = self._np_scale(np, damage, randvars, 10000)
+        return self._batch_apply_damage_buffs(np, damage)
+
+    def dot_damage_batch(self, potencies, crits=None, dhs=None, randvars=None,
+                         crittype=CritType.Crit, dhtype=DHType.DirectHit, rng=None):
+        """ Vectorized dot_damage(). See calc_action_damage_batch. """
+        import numpy as np
+        potencies = np.asarray(potencies, dtype=np.int64)
+        shape = np.broadcast_shapes(potencies.shape, np.shape(crits),
+                                    np.shape(dhs), np.shape(randvars))
+        critmod, dhmod, fdet, randvars = self._batch_random_components(
+            np, shape, crits, dhs, randvars, crittype, dhtype, rng)
+        # Pre-random components
+        if self.is_magic:
+            damage = self._np_scale(np, potencies, self.fwd, 100)
+            damage = self._np_scale(np, damage, self.fatk, 100)
+            damage = self._np_scale(np, damage, self.fspd_dot, 1000)
+            damage = self._np_scale(np, damage, fdet, 1000)
+            damage = self._np_scale(np, damage, self.ftnc, 1000)
+            damage = self._np_scale(np, damage, self.traitmod, 100)
+        else:
+            damage = self._np_scale(np, potencies, self.fatk, 100)
+            damage = self._np_scale(np, damage, fdet, 1000)
+            damage = self._np_scale(np, damage, self.ftnc, 1000)
+            damage = self._np_scale(np, damage, self.fspd_dot, 1000)
+            damage = self._np_scale(np, damage, self.fwd, 100)
+            damage = self._np_scale(np, damage, self.traitmod, 100)
+        damage = damage + (potencies < 100)
+        # Random chance components
+        damage = self._np_scale(np, damage, randvars, 10000)
+        damage = self._np_scale(np, damage, critmod, 1000000)
+        damage = self._np_scale(np, damage, dhmod, 1000000)
+        return self._batch_apply_damage_buffs(np, damage)
+
+    def aa_damage_batch(self, crits=None, dhs=None, randvars=None,
+                        crittype=CritType.Crit, dhtype=DHType.DirectHit,
+                        size=None, rng=None):
+        """ Vectorized aa_damage(). See calc_aa_damage_batch. """
+        import numpy as np
+        if size is None:
+            size = ()
+        shape = np.broadcast_shapes(np.shape(crits), np.shape(dhs),
+                                    np.shape(randvars), tuple(np.atleast_1d(size)))
+        critmod, dhmod, fdet, randvars = self._batch_random_components(
+            np, shape, crits, dhs, randvars, crittype, dhtype, rng)
+        potency = self.aa_potency
+        # Pre-random components
+        damage = np.full(shape, floor(potency * self.fatk / 100), dtype=np.int64)
+        damage = self._np_scale(np, damage, fdet, 1000)
+        damage = self._np_scale(np, damage, self.ftnc, 1000)
+        damage = self._np_scale(np, damage, self.fspd_aa, 1000)
+        damage = self._np_scale(np, damage, self.aa_mod, 100)
+        damage = self._np_scale(np, damage, self.traitmod, 100)
+        damage = damage + int(potency < 100)
+        # Random chance components
+        damage = self._np_scale(np, damage, critmod, 1000000)
+        damage = self._np_scale(np, damage, dhmod, 1000000)
+        damage = self._np_scale(np, damage, randvars, 10000)
+        return self._batch_apply_damage_buffs(np, damage)
+
+def calc_action_damage_batch(potencies,
+                             job: str,
+                             weaponinfo: WeaponInfo,
+                             playerstats: PlayerStats,
+                             buffs: list,
+                             crits=None,
+                             dhs=None,
+                             randvars=None,
+                             crittype: CritType = CritType.Crit,
+                             dhtype: DHType = DHType.DirectHit,
+                             rng=None):
+    """ Vectorized calc_action_damage.
+        potencies, crits, dhs and randvars are broadcast against each
+        other. crits/dhs are boolean arrays; where they are True, the hit
+        uses crittype/dhtype, otherwise CritType.Normal/DHType.Normal.
+        If randvars is None, the random variation is drawn from rng.
+        Returns an int64 array of damage values. """
+    kernel = HitKernel(job, weaponinfo, playerstats, buffs)
+    return kernel.damage_batch(potencies, crits, dhs, randvars,
+                               crittype, dhtype, rng)
+
+def calc_dot_tick_damage_batch(potencies,
+                               job: str,
+                               weaponinfo: WeaponInfo,
+                               playerstats: PlayerStats,
+                               buffs: list,
+                               crits=None,
+                               dhs=None,
+                               randvars=None,
+                               crittype: CritType = CritType.Crit,
+                               dhtype: DHType = DHType.DirectHit,
+                               rng=None):
+    """ Vectorized calc_dot_tick_damage.
+        Arguments work the same as for calc_action_damage_batch. """
+    kernel = HitKernel(job, weaponinfo, playerstats, buffs)
+    return kernel.dot_damage_batch(potencies, crits, dhs, randvars,
+                                   crittype, dhtype, rng)
+
+def calc_aa_damage_batch(job: str,
+                         weaponinfo: WeaponInfo,
+                         playerstats: PlayerStats,
+                         buffs: list,
+                         crits=None,
+                         dhs=None,
+                         randvars=None,
+                         crittype: CritType = CritType.Crit,
+                         dhtype: DHType = DHType.DirectHit,
+                         size=None,
+                         rng=None):
+    """ Vectorized calc_aa_damage.
+        The number of hits is taken from the shapes of crits, dhs and
+        randvars, or from size if none of them are arrays. """
+    kernel = HitKernel(job, weaponinfo, playerstats, buffs)
+    return kernel.aa_damage_batch(crits, dhs, randvars, crittype, dhtype,
+                                  size, rng)
+
+#################################################################
+# HEALING AND MITIGATION                                        #
+#################################################################
+# Heals use the same modifiers as damage, except that the healing magic
+# potency f(HMP) replaces f(AP) and f(WD) uses the healing stat. They can
+# crit but not direct hit, and damage buffs don't apply to them.
+# HealKernel is a HitKernel with heal methods, so one snapshot can do
+# both damage and heals. Heal multipliers (e.g. healing potency buffs)
+# are scaled by 1000 like damage buffs and applied last, in order.
+#
+# Damage taken goes through f(DEF) (DEF or MDEF), f(TNC) and then every
+# percentage mitigation, one floor after the other. Mitigations are
+# scaled by 1000 too: Rampart (20%) is 200.
+
+# Healing magic potency: f(HMP), scaled by 100
+# Only levels 80 and 90 have been verified, other levels use the closest
+# of the two coefficients.
+def calc_healpowermod(hmp_stat, level):
+    main, sub, div = LEVEL_MSD[level]
+    if level > 80:
+        fhmp = floor(569 * (hmp_stat - main) / 1522) + 100
+    else:
+        fhmp = floor(100 * (hmp_stat - main) / 304) + 100
+    return fhmp
+
+class HealKernel(HitKernel):
+    """ A HitKernel that also computes heals and HoT ticks. """
+    def __init__(self, job, weaponinfo, playerstats, buffs, heal_multipliers=()):
+        super().__init__(job, weaponinfo, playerstats, buffs)
+        effects = get_buff_effects(playerstats, buffs)
+        healing_stat = get_healing_stat(job)
+        hmp_stat = effects.stats.get_stat_by_name(healing_stat)
+        self.fhmp = calc_healpowermod(hmp_stat, self.level)
+        self.fwd_heal = calc_wepdamagemod(weaponinfo.damage, job, healing_stat, self.level)
+        self.heal_multipliers = tuple(heal_multipliers)
+
+    def heal_base(self, potency):
+        """ Pre-random part of a heal. """
+        heal = floor(floor(potency * self.fhmp * self.fdet / 100) / 1000)
+        heal = floor(heal * self.ftnc / 1000)
+        heal = floor(heal * self.fwd_heal / 100)
+        return floor(heal * self.traitmod / 100)
+
+    def hot_base(self, potency):
+        """ Pre-random part of a HoT tick. Same order as a magic DoT tick. """
+        heal = floor(potency * self.fwd_heal / 100)
+        heal = floor(heal * self.fhmp / 100)
+        heal = floor(heal * self.fspd_dot / 1000)
+        heal = floor(heal * self.fdet / 1000)
+        heal = floor(heal * self.ftnc / 1000)
+        heal = floor(heal * self.traitmod / 100)
+        return heal + int(potency < 100)
+
+    def heal(self, potency, crit=CritType.Normal, randvar=None):
+        if randvar is None:
+            randvar = fixed_random_variation()
+        heal = floor(self.heal_base(potency) * self.critmods[crit] / 1000000)
+        heal = floor(heal * randvar / 10000)
+        return apply_damage_multipliers(heal, self.heal_multipliers)
+
+    def hot_tick(self, potency, crit=CritType.Normal, randvar=None):
+        if randvar is None:
+            randvar = fixed_random_variation()
+        heal = floor(self.hot_base(potency) * randvar / 10000)
+        heal = floor(heal * self.critmods[crit] / 1000000)
+        return apply_damage_multipliers(heal, self.heal_multipliers)
+
+    def _batch_apply_heal_multipliers(self, np, heal):
+        for multiplier in self.heal_multipliers:
+            heal = self._np_scale(np, heal, 1000 + multiplier, 1000)
+        return heal
+
+    def heal_batch(self, potencies, crits=None, randvars=None,
+                   crittype=CritType.Crit, rng=None):
+        """ Vectorized heal(). See calc_heal_amount_batch. """
+        import numpy as np
+        potencies = np.asarray(potencies, dtype=np.int64)
+        shape = np.broadcast_shapes(potencies.shape, np.shape(crits), np.shape(randvars))
+        critmod, _, fdet, randvars = self._batch_random_components(
+            np, shape, crits, None, randvars, crittype, DHType.Normal, rng)
+        heal = self._np_scale(np, potencies * self.fhmp * fdet, 1, 100000)
+        heal = self._np_scale(np, heal, self.ftnc, 1000)
+        heal = self._np_scale(np, heal, self.fwd_heal, 100)
+        heal = self._np_scale(np, heal, self.traitmod, 100)
+        heal = self._np_scale(np, heal, critmod, 1000000)
+        heal = self._np_scale(np, heal, randvars, 10000)
+        return self._batch_apply_heal_multipliers(np, heal)
+
+    def hot_tick_batch(self, potencies, crits=None, randvars=None,
+                       crittype=CritType.Crit, rng=None):
+        """ Vectorized hot_tick(). See calc_heal_amount_batch. """
+        import numpy as np
+        potencies = np.asarray(potencies, dtype=np.int64)
+        shape = np.broadcast_shapes(potencies.shape, np.shape(crits), np.shape(randvars))
+        critmod, _, fdet, randvars = self._batch_random_components(
+            np, shape, crits, None, randvars, crittype, DHType.Normal, rng)
+        heal = self._np_scale(np, potencies, self.fwd_heal, 100)
+        heal = self._np_scale(np, heal, self.fhmp, 100)
+        heal = self._np_scale(np, heal, self.fspd_dot, 1000)
+        heal = self._np_scale(np, heal, fdet, 1000)
+        heal = self._np_scale(np, heal, self.ftnc, 1000)
+        heal = self._np_scale(np, heal, self.traitmod, 100)
+        heal = heal + (potencies < 100)
+        heal = self._np_scale(np, heal, randvars, 10000)
+        heal = self._np_scale(np, heal, critmod, 1000000)
+        return self._batch_apply_heal_multipliers(np, heal)
+
+# Heal amount of a direct heal spell or ability
+def calc_heal_amount(potency: int,
+                     job: str,
+                     weaponinfo: WeaponInfo,
+                     playerstats: PlayerStats,
+                     buffs: list,
+                     crittype: CritType = CritType.Normal,
+                     randvar=None,
+                     heal_multipliers=()):
+    """ Calculate the amount healed by a direct heal.
+        Build a HealKernel instead when healing with one snapshot many times. """
+    kernel = HealKernel(job, weaponinfo, playerstats, buffs, heal_multipliers)
+    return kernel.heal(potency, crittype, randvar)
+
+def calc_hot_tick_amount(potency: int,
+                         job: str,
+                         weaponinfo: WeaponInfo,
+                         playerstats: PlayerStats,
+                         buffs: list,
+                         crittype: CritType = CritType.Normal,
+                         randvar=None,
+                         heal_multipliers=()):
+    """ Calculate the amount healed by one HoT tick. """
+    kernel = HealKernel(job, weaponinfo, playerstats, buffs, heal_multipliers)
+    return kernel.hot_tick(potency, crittype, randvar)
+
+def calc_heal_amount_batch(potencies,
+                           job: str,
+                           weaponinfo: WeaponInfo,
+                           playerstats: PlayerStats,
+                           buffs: list,
+                           crits=None,
+                           randvars=None,
+                           crittype: CritType = CritType.Crit,
+                           heal_multipliers=(),
+                           rng=None):
+    """ Vectorized calc_heal_amount. Works like calc_action_damage_batch,
+        without the DH arguments. """
+    kernel = HealKernel(job, weaponinfo, playerstats, buffs, heal_multipliers)
+    return kernel.heal_batch(potencies, crits, randvars, crittype, rng)
+
+def calc_hot_tick_amount_batch(potencies,
+                               job: str,
+                               weaponinfo: WeaponInfo,
+                               playerstats: PlayerStats,
+                               buffs: list,
+                               crits=None,
+                               randvars=None,
+                               crittype: CritType = CritType.Crit,
+                               heal_multipliers=(),
+                               rng=None):
+    """ Vectorized calc_hot_tick_amount. """
+    kernel = HealKernel(job, weaponinfo, playerstats, buffs, heal_multipliers)
+    return kernel.hot_tick_batch(potencies, crits, randvars, crittype, rng)
+
+# Damage taken after DEF, TNC and percentage mitigations
+# def_stat is DEF for physical damage and MDEF for magical damage.
+# Uses the integer modifiers, calc_defmod and calc_tenacitymod_mit
+# scaled back up could be off by one.
+def calc_damage_taken(damage: int,
+                      def_stat: int,
+                      playerstats: PlayerStats,
+                      mitigations=()):
+    """ Calculate the damage taken from an unmitigated hit of damage. """
+    level = playerstats.level
+    taken = damage * calc_defmod_int(def_stat, level) // 100
+    taken = taken * calc_tenacitymod_mit_int(playerstats.TNC, level) // 1000
+    for mitigation in mitigations:
+        taken = taken * (1000 - mitigation) // 1000
+    return taken
+
+def calc_damage_taken_batch(damages,
+                            def_stat: int,
+                            playerstats: PlayerStats,
+                            mitigations=()):
+    """ Vectorized calc_damage_taken. Each mitigation can be a number or
+        an array broadcast against damages (0 where it isn't up), so a
+        whole timeline of hits with different mitigations is one call. """
+    import numpy as np
+    level = playerstats.level
+    taken = np.asarray(damages, dtype=np.int64) * calc_defmod_int(def_stat, level) // 100
+    taken = taken * calc_tenacitymod_mit_int(playerstats.TNC, level) // 1000
+    for mitigation in mitigations:
+        taken = taken * (1000 - np.asarray(mitigation, dtype=np.int64)) // 1000
+    return taken
+
+#################################################################
+# INTEGER MODIFIERS AND DAMAGE                                  #
+#################################################################
+# The *_int functions return the scaled integers the game works with
+# (e.g. f(DET) = 1073 rather than 1.073), computed with integer floor
+# division only. Going through floats, as in int(calc_detmod(...) * 1000),
+# is off by one for a little over 1% of the stat values, because values
+# like 1.073 aren't exact in binary.
+# IntHitKernel is a HitKernel built from these, and from integer versions
+# of the crit and DH type modifiers, so everything from the stats to the
+# damage uses integer arithmetic only. check_integer_pipeline() in the
+# examples below compares the two pipelines.
+
+# p(CRIT), scaled by 1000
+def calc_critrate_int(crit_stat, level):
+    main, sub, div = LEVEL_MSD[level]
+    return CRT_RATE_MOD * (crit_stat - sub) // div + 50
+
+# f(CRIT), scaled by 1000
+def calc_critmod_int(crit_stat, level):
+    main, sub, div = LEVEL_MSD[level]
+    return 1400 + CRT_DMG_MOD * (crit_stat - sub) // div
+
+# p(DH), scaled by 1000
+def calc_dhrate_int(dh_stat, level):
+    main, sub, div = LEVEL_MSD[level]
+    return DH_MOD * (dh_stat - sub) // div
+
+# f(DET), scaled by 1000
+def calc_detmod_int(det_stat, level):
+    main, sub, div = LEVEL_MSD[level]
+    return DET_MOD * (det_stat - main) // div + 1000
+
+# f(SPD), scaled by 1000
+def calc_spdmod_int(spd_stat, level):
+    main, sub, div = LEVEL_MSD[level]
+    return 1000 + SPD_MOD * (spd_stat - sub) // div
+
+# GCD in centiseconds, i.e. calc_gcdmod * 100
+def calc_gcdmod_int(spd_stat, gcd, level, haste=0):
+    main, sub, div = LEVEL_MSD[level]
+    fgcd = gcd * (1000 - (-SPD_MOD * (sub - spd_stat) // div)) // 1000
+    return fgcd * (100 - haste) // 1000
+
+# f(TNC) for damage, scaled by 1000
+def calc_tenacitymod_dps_int(tnc_stat, level):
+    main, sub, div = LEVEL_MSD[level]
+    return 1000 + TNC_MOD * (tnc_stat - sub) // div
+
+# f(TNC) for damage taken, scaled by 1000
+def calc_tenacitymod_mit_int(tnc_stat, level):
+    main, sub, div = LEVEL_MSD[level]
+    return 1000 - 100 * (tnc_stat - sub) // div
+
+# f(DEF) damage multiplier, scaled by 100
+def calc_defmod_int(def_stat, level):
+    main, sub, div = LEVEL_MSD[level]
+    return 100 - 15 * def_stat // div
+
+# f(AUTO), scaled by 100. Like calc_aamod, uses the job's physical
+# attack stat whatever stat_used is.
+def calc_aamod_int(wd_stat, weapon_delay, job, stat_used, level):
+    main, sub, div = LEVEL_MSD[level]
+    attr = JOB_COLUMNS[get_ap_stat(job)][JOB_IDS[job]]
+    return (main * attr // 1000 + wd_stat) * weapon_delay // 300
+
+# f(WD), for the attribute stat_used
+def calc_wepdamagemod_int(wd_stat, job, stat_used, level):
+    main, sub, div = LEVEL_MSD[level]
+    attr = JOB_COLUMNS[stat_used][JOB_IDS[job]]
+    return main * attr // 1000 + wd_stat
+
+# f(AP) and f(MAP), scaled by 100, with the same (partly unconfirmed)
+# coefficients as calc_atkpowermod
+def calc_atkpowermod_int(ap_stat, job, level):
+    main, sub, div = LEVEL_MSD[level]
+    if is_tank(job):
+        if level > 80:
+            mod = 115 + (level - 80) * 41 // 10
+        elif level > 70:
+            mod = 115
+        else:
+            mod = 75
+    else:
+        if level > 80:
+            mod = 165 + (level - 80) * 3
+        elif level > 70:
+            mod = 125 + (level - 70) * 4
+        elif level > 50:
+            mod = 75 + (level - 50) * 5 // 2
+        else:
+            mod = 75
+    return mod * (ap_stat - main) // main + 100
+
+# Integer versions of _calc_critmod_for_type and _calc_dhmod_for_type
+def _calc_critmod_for_type_int(crittype, critmod, critrate, effects):
+    if crittype is CritType.Crit:
+        return 1000 * critmod
+    elif crittype is CritType.ForcedCrit:
+        return critmod * (1000 + (critmod - 1000) * effects.crit_chance // 1000)
+    elif crittype is CritType.Average:
+        return 1000000 + (critmod - 1000) * (critrate + effects.crit_chance)
+    else:
+        return 1000000
+
+def _calc_dhmod_for_type_int(dhtype, dhrate, effects):
+    if dhtype is DHType.DirectHit:
+        return 1250000
+    elif dhtype is DHType.ForcedDirectHit:
+        return 1250 * (1000 + 250 * effects.dh_chance // 1000)
+    elif dhtype is DHType.Average:
+        return 1000000 + 250 * (dhrate + effects.dh_chance)
+    else:
+        return 1000000
+
+# Integer version of _np_floor_scale
+def _np_int_scale(np, values, num, den):
+    return values * num // den
+
+class IntHitKernel(HitKernel):
+    """ HitKernel with the *_int modifiers and integer-only arithmetic. """
+    _critmod_for_type = staticmethod(_calc_critmod_for_type_int)
+    _dhmod_for_type = staticmethod(_calc_dhmod_for_type_int)
+
+    def _set_stat_modifiers(self, buffedstats, level, info, weaponinfo, mainstat):
+        ap_stat = buffedstats.get_stat_by_name(mainstat)
+        self.fatk = calc_atkpowermod_int(ap_stat, self.job, level)
+        self.fwd = calc_wepdamagemod_int(weaponinfo.damage, self.job, mainstat, level)
+        self.fdet = calc_detmod_int(buffedstats.DET, level)
+        main, sub, div = LEVEL_MSD[buffedstats.level]
+        self.fdet_forced_dh = self.fdet + DET_MOD * (buffedstats.DH - sub) // div
+        if info.role is Role.TANK:
+            self.ftnc = calc_tenacitymod_dps_int(buffedstats.TNC, level)
+        else:
+            self.ftnc = 1000
+        self.fspd_dot = calc_spdmod_int(getattr(buffedstats, info.dot_speed_stat), level)
+        self.fspd_aa = calc_spdmod_int(buffedstats.SKS, level)
+        self.aa_mod = calc_aamod_int(weaponinfo.damage, weaponinfo.delay, self.job,
+                                     mainstat, level)
+        return (calc_critmod_int(buffedstats.CRT, level),
+                calc_critrate_int(buffedstats.CRT, level),
+                calc_dhrate_int(buffedstats.DH, level))
+
+    _np_scale = staticmethod(_np_int_scale)
+
+    def action_base_damage(self, potency, forced_dh=False):
+        key = (potency, forced_dh)
+        damage = self._action_base.get(key)
+        if damage is None:
+            fdet = self.fdet_forced_dh if forced_dh else self.fdet
+            damage = potency * self.fatk // 100 * fdet // 1000
+            damage = damage * self.ftnc // 1000
+            damage = damage * self.fwd // 100
+            damage = damage * self.traitmod // 100
+            self._action_base[key] = damage
+        return damage
+
+    def dot_base_damage(self, potency, forced_dh=False):
+        key = (potency, forced_dh)
+        damage = self._dot_base.get(key)
+        if damage is None:
+            fdet = self.fdet_forced_dh if forced_dh else self.fdet
+            if self.is_magic:
+                damage = potency * self.fwd // 100
+                damage = damage * self.fatk // 100
+                damage = damage * self.fspd_dot // 1000
+                damage = damage * fdet // 1000
+                damage = damage * self.ftnc // 1000
+                damage = damage * self.traitmod // 100
+            else:
+                damage = potency * self.fatk // 100
+                damage = damage * fdet // 1000
+                damage = damage * self.ftnc // 1000
+                damage = damage * self.fspd_dot // 1000
+                damage = damage * self.fwd // 100
+                damage = damage * self.traitmod // 100
+            damage += int(potency < 100)
+            self._dot_base[key] = damage
+        return damage
+
+    def aa_base_damage(self, forced_dh=False):
+        damage = self._aa_base.get(forced_dh)
+        if damage is None:
+            potency = self.aa_potency
+            fdet = self.fdet_forced_dh if forced_dh else self.fdet
+            damage = potency * self.fatk // 100
+            damage = damage * fdet // 1000
+            damage = damage * self.ftnc // 1000
+            damage = damage * self.fspd_aa // 1000
+            damage = damage * self.aa_mod // 100
+            damage = damage * self.traitmod // 100
+            damage += int(potency < 100)
+            self._aa_base[forced_dh] = damage
+        return damage
+
+    def apply_damage_buffs(self, damage):
+        for multiplier in self.damage_multipliers:
+            damage = damage * (1000 + multiplier) // 1000
+        return damage
+
+    def damage(self, potency, crit=CritType.Normal, dh=DHType.Normal, randvar=None):
+        damage = self.action_base_damage(potency, dh is DHType.ForcedDirectHit)
+        if randvar is None:
+            randvar = fixed_random_variation()
+        damage = damage * self.critmods[crit] // 1000000
+        damage = damage * self.dhmods[dh] // 1000000
+        damage = damage * randvar // 10000
+        return self.apply_damage_buffs(damage)
+
+    def dot_damage(self, potency, crit=CritType.Normal, dh=DHType.Normal, randvar=None):
+        damage = self.dot_base_damage(potency, dh is DHType.ForcedDirectHit)
+        if randvar is None:
+            randvar = fixed_random_variation()
+        damage = damage * randvar // 10000
+        damage = damage * self.critmods[crit] // 1000000
+        damage = damage * self.dhmods[dh] // 1000000
+        return self.apply_damage_buffs(damage)
+
+    def aa_damage(self, crit=CritType.Normal, dh=DHType.Normal, randvar=None):
+        damage = self.aa_base_damage(dh is DHType.ForcedDirectHit)
+        if randvar is None:
+            randvar = fixed_random_variation()
+        damage = damage * self.critmods[crit] // 1000000
+        damage = damage * self.dhmods[dh] // 1000000
+        damage = damage * randvar // 10000
+        return self.apply_damage_buffs(damage)
+
+def calc_action_damage_int(potency: int,
+                           job: str,
+                           weaponinfo: WeaponInfo,
+                           playerstats: PlayerStats,
+                           buffs: list,
+                           crittype: CritType = CritType.Normal,
+                           dhtype: DHType = DHType.Normal,
+                           randvar=None):
+    """ calc_action_damage with the integer modifiers. """
+    kernel = IntHitKernel(job, weaponinfo, playerstats, buffs)
+    return kernel.damage(potency, crittype, dhtype, randvar)
+
+def calc_dot_tick_damage_int(potency: int,
+                             job: str,
+                             weaponinfo: WeaponInfo,
+                             playerstats: PlayerStats,
+                             buffs: list,
+                             crittype: CritType = CritType.Normal,
+                             dhtype: DHType = DHType.Normal,
+                             randvar=None):
+    """ calc_dot_tick_damage with the integer modifiers. """
+    kernel = IntHitKernel(job, weaponinfo, playerstats, buffs)
+    return kernel.dot_damage(potency, crittype, dhtype, randvar)
+
+def calc_aa_damage_int(job: str,
+                       weaponinfo: WeaponInfo,
+                       playerstats: PlayerStats,
+                       buffs: list,
+                       crittype: CritType = CritType.Normal,
+                       dhtype: DHType = DHType.Normal,
+                       randvar=None):
+    """ Auto-attack damage with the integer modifiers, with f(SPD) and
+        f(AUTO) at their proper scale (see above). """
+    kernel = IntHitKernel(job, weaponinfo, playerstats, buffs)
+    return kernel.aa_damage(crittype, dhtype, randvar)
+
+#################################################################
+# EXACT DAMAGE DISTRIBUTIONS                                    #
+#################################################################
+# A single hit only has 4 crit/DH outcomes and 1001 random variations,
+# each of them equally likely, so its damage distribution can be
+# enumerated exactly instead of sampled.
+
+class HitKind(Enum):
+    DIRECT = 1  # calc_action_damage
+    DOT = 2     # calc_dot_tick_damage
+    AUTO = 3    # calc_aa_damage
+
+def _kernel_hit(kernel, kind, potency, crittype, dhtype, randvar):
+    if kind is HitKind.DOT:
+        return kernel.dot_damage(potency, crittype, dhtype, randvar)
+    elif kind is HitKind.AUTO:
+        return kernel.aa_damage(crittype, dhtype, randvar)
+    else:
+        return kernel.damage(potency, crittype, dhtype, randvar)
+
+class DamageDistribution:
+    """ Probability mass function over integer damage values.
+        values are sorted ascending, probs are the matching probabilities. """
+    def __init__(self, values, probs):
+        self.values = tuple(values)
+        self.probs = tuple(probs)
+
+    @classmethod
+    def from_pmf(cls, pmf: dict):
+        values = sorted(pmf)
+        return cls(values, [pmf[v] for v in values])
+
+    @property
+    def pmf(self):
+        return dict(zip(self.values, self.probs))
+
+    def min(self):
+        return self.values[0]
+
+    def max(self):
+        return self.values[-1]
+
+    def mean(self):
+        return sum(v * p for v, p in zip(self.values, self.probs))
+
+    def variance(self):
+        mean = self.mean()
+        return sum((v - mean)**2 * p for v, p in zip(self.values, self.probs))
+
+    def std(self):
+        return self.variance()**0.5
+
+    def cdf(self, x):
+        """ P(damage <= x) """
+        total = 0.0
+        for v, p in zip(self.values, self.probs):
+            if v > x:
+                break
+            total += p
+        return min(total, 1.0)
+
+    def quantile(self, q):
+        """ Smallest damage value d with P(damage <= d) >= q """
+        total = 0.0
+        for v, p in zip(self.values, self.probs):
+            total += p
+            if total >= q:
+                return v
+        return self.values[-1]
+
+    def quantiles(self, qs):
+        return [self.quantile(q) for q in qs]
+
+# Crit and DH chance of a kernel as probabilities, clipped to [0, 1]
+def _kernel_hit_chances(kernel):
+    pcrit = min(max(kernel.critchance / 1000, 0.0), 1.0)
+    pdh = min(max(kernel.dhchance / 1000, 0.0), 1.0)
+    return pcrit, pdh
+
+def calc_kernel_damage_distribution(kernel: HitKernel,
+                                    potency: int,
+                                    kind: HitKind = HitKind.DIRECT):
+    """ Exact damage distribution of one hit of the given kind. """
+    pcrit, pdh = _kernel_hit_chances(kernel)
+    outcomes = ((CritType.Normal, DHType.Normal, (1 - pcrit) * (1 - pdh)),
+                (CritType.Crit, DHType.Normal, pcrit * (1 - pdh)),
+                (CritType.Normal, DHType.DirectHit, (1 - pcrit) * pdh),
+                (CritType.Crit, DHType.DirectHit, pcrit * pdh))
+    pmf = {}
+    for crittype, dhtype, p in outcomes:
+        if p <= 0:
+            continue
+        p_each = p / 1001
+        for randvar in range(9500, 10501):
+            damage = _kernel_hit(kernel, kind, potency, crittype, dhtype, randvar)
+            pmf[damage] = pmf.get(damage, 0.0) + p_each
+    return DamageDistribution.from_pmf(pmf)
+
+def calc_damage_distribution(potency: int,
+                             job: str,
+                             weaponinfo: WeaponInfo,
+                             playerstats: PlayerStats,
+                             buffs: list,
+                             kind: HitKind = HitKind.DIRECT):
+    """ Exact damage distribution of one hit, i.e. the distribution that
+        generate_sample_hits samples from. """
+    kernel = HitKernel(job, weaponinfo, playerstats, buffs)
+    return calc_kernel_damage_distribution(kernel, potency, kind)
+
+#################################################################
+# ROTATION DAMAGE DISTRIBUTIONS                                 #
+#################################################################
+# The total damage of many independent hits is the convolution of the
+# single-hit distributions. Each hit's PMF is put on a common grid of
+# bin_width damage per bin and the convolution is done with FFTs.
+# Identical hits (same potency, kind and buffs) are only transformed once
+# and raised to the power of how often they occur.
+# Binning moves each hit by at most bin_width / 2, so every value of the
+# total is off by at most error_bound = n_hits * bin_width / 2.
+# The mean and variance are summed exactly from the single hits.
+
+def _kernel_outcome_arrays(np, kernel, potency, kind):
+    """ All 4 * 1001 outcomes of one hit as (damages, probabilities). """
+    pcrit, pdh = _kernel_hit_chances(kernel)
+    randvars = np.arange(9500, 10501)
+    crits = np.repeat(np.array([False, True, False, True]), 1001)
+    dhs = np.repeat(np.array([False, False, True, True]), 1001)
+    randvars = np.tile(randvars, 4)
+    if kind is HitKind.DOT:
+        damages = kernel.dot_damage_batch(potency, crits, dhs, randvars)
+    elif kind is HitKind.AUTO:
+        damages = kernel.aa_damage_batch(crits, dhs, randvars)
+    else:
+        damages = kernel.damage_batch(potency, crits, dhs, randvars)
+    p = np.array([(1 - pcrit) * (1 - pdh), pcrit * (1 - pdh),
+                  (1 - pcrit) * pdh, pcrit * pdh]) / 1001
+    return damages, np.repeat(p, 1001)
+
+class BinnedDamageDistribution:
+    """ Distribution of a damage total on a grid.
+        Bin i stands for the damage offset + i * bin_width. """
+    def __init__(self, offset, bin_width, probs, mean, variance, error_bound):
+        self.offset = offset
+        self.bin_width = bin_width
+        self.probs = probs
+        self.exact_mean = mean
+        self.exact_variance = variance
+        self.error_bound = error_bound
+
+    def values(self):
+        import numpy as np
+        return self.offset + self.bin_width * np.arange(len(self.probs))
+
+    def mean(self):
+        return self.exact_mean
+
+    def variance(self):
+        return self.exact_variance
+
+    def std(self):
+        return self.exact_variance**0.5
+
+    def cdf(self, x):
+        """ P(damage <= x) """
+        import numpy as np
+        i = floor((x - self.offset) / self.bin_width)
+        if i < 0:
+            return 0.0
+        return min(float(np.sum(self.probs[:i + 1])), 1.0)
+
+    def quantiles(self, qs):
+        """ Smallest grid value d with P(damage <= d) >= q, for each q """
+        import numpy as np
+        cdf = np.cumsum(self.probs)
+        idx = np.searchsorted(cdf, np.asarray(qs, dtype=float) - 1e-12)
+        idx = np.minimum(idx, len(self.probs) - 1)
+        return self.offset + self.bin_width * idx
+
+    def quantile(self, q):
+        return int(self.quantiles([q])[0])
+
+    def percentiles(self, ps):
+        import numpy as np
+        return self.quantiles(np.asarray(ps, dtype=float) / 100)
+
+def calc_rotation_damage_distribution(hits: list,
+                                      job: str,
+                                      weaponinfo: WeaponInfo,
+                                      playerstats: PlayerStats,
+                                      max_bins: int = 2**18):
+    """ Distribution of the total damage of a list of independent hits.
+        Each hit is a (potency, kind, buffs) tuple, where kind is a
+        HitKind (the potency of autos is ignored). The bin width is picked
+        so the grid has at most max_bins bins. """
+    import numpy as np
+    # Group identical hits and build one kernel per buff combination
+    counts = {}
+    kernels = {}
+    for potency, kind, buffs in hits:
+        buffkey = tuple(buffs)
+        if kind is HitKind.AUTO:
+            potency = None
+        key = (potency, kind, buffkey)
+        counts[key] = counts.get(key, 0) + 1
+        if buffkey not in kernels:
+            kernels[buffkey] = HitKernel(job, weaponinfo, playerstats, list(buffs))
+    # Exact single-hit outcomes per group
+    groups = []
+    offset = 0
+    span = 0
+    mean = 0.0
+    variance = 0.0
+    for (potency, kind, buffkey), count in counts.items():
+        damages, probs = _kernel_outcome_arrays(np, kernels[buffkey], potency, kind)
+        lo = int(damages.min())
+        hit_mean = float(np.dot(damages, probs))
+        mean += count * hit_mean
+        variance += count * float(np.dot((damages - hit_mean)**2, probs))
+        offset += count * lo
+        span += count * (int(damages.max()) - lo)
+        groups.append((damages - lo, probs, count))
+    n_hits = sum(counts.values())
+    bin_width = max(1, ceil(span / max_bins))
+    binned_groups = []
+    for rel_damages, probs, count in groups:
+        idx = np.rint(rel_damages / bin_width).astype(np.int64)
+        binned_groups.append((np.bincount(idx, weights=probs, minlength=1), count))
+    # The highest bin of the total is the sum of the highest bins of the
+    # hits, so the total fits and the FFT grid can't wrap around
+    n_bins = sum(count * (len(binned) - 1) for binned, count in binned_groups) + 1
+    nfft = 1 << max(n_bins - 1, 1).bit_length()
+    spectrum = np.ones(nfft // 2 + 1, dtype=complex)
+    for binned, count in binned_groups:
+        spectrum *= np.fft.rfft(binned, nfft)**count
+    total = np.fft.irfft(spectrum, nfft)[:n_bins]
+    total = np.clip(total, 0.0, None)
+    mass = float(total.sum())
+    if abs(mass - 1) > 1e-6:
+        raise RuntimeError("Rotation distribution has a total probability "
+                              "of {}, not 1".format(mass))
+    error_bound = 0 if bin_width == 1 else n_hits * bin_width / 2
+    return BinnedDamageDistribution(offset, bin_width, total, mean, variance,
+                                    error_bound)
+
+#################################################################
+# STAT TIERS                                                    #
+#################################################################
+# The substat modifiers are all of the form floor(K * (stat - base) / div)
+# plus a constant, so they only change at discrete stat values ("tiers").
+# Tier t starts at the smallest stat with floor(K * (stat - base) / div) = t,
+# which is base + ceil(t * div / K). Everything below is integer maths on
+# that, so every query is O(1) and works on NumPy arrays too.
+
+# Substat -> (K, base column of the level table)
+STAT_TIER_COEFFICIENTS = {
+    "CRT": (CRT_RATE_MOD, 1),  # calc_critrate and calc_critmod (same K)
+    "DH": (DH_MOD, 1),
+    "DET": (DET_MOD, 0),
+    "SKS": (SPD_MOD, 1),
+    "SPS": (SPD_MOD, 1),
+    "TNC": (TNC_MOD, 1),
+    "PIE": (PIE_MOD, 0),
+    }
+
+class StatTiers:
+    """ Tier index of one substat at one level.
+        Use get_stat_tiers(stat_name, level) to get a cached instance. """
+    def __init__(self, stat_name, level):
+        k, base_index = STAT_TIER_COEFFICIENTS[stat_name]
+        main, sub, div = LEVEL_MSD[level]
+        self.stat_name = stat_name
+        self.level = level
+        self.k = k
+        self.base = (main, sub)[base_index]
+        self.div = div
+
+    def tier(self, stat):
+        """ floor(K * (stat - base) / div), i.e. the modifier before its
+            constant offset. Works for ints and NumPy int arrays. """
+        return self.k * (stat - self.base) // self.div
+
+    def tier_start(self, tier):
+        """ Lowest stat value in the given tier. """
+        return self.base - (-tier * self.div // self.k)
+
+    def to_next_tier(self, stat):
+        """ Stat points needed to reach the next tier. """
+        return self.tier_start(self.tier(stat) + 1) - stat
+
+    def overflow(self, stat):
+        """ Stat points above the start of the current tier, i.e. the
+            points that currently do nothing. """
+        return stat - self.tier_start(self.tier(stat))
+
+    def breakpoints(self, lo, hi):
+        """ All tier starts in [lo, hi] as a list. """
+        first = self.tier(lo)
+        if self.tier_start(first) < lo:
+            first += 1
+        starts = []
+        tier = first
+        start = self.tier_start(tier)
+        while start <= hi:
+            # At low levels K > div, so a tier can be empty and share its
+            # start with the next one
+            if not starts or start != starts[-1]:
+                starts.append(start)
+            tier += 1
+            start = self.tier_start(tier)
+        return starts
+
+    def query(self, stat):
+        """ (tier, points to the next tier, overflow) of a stat value. """
+        tier = self.tier(stat)
+        start = self.tier_start(tier)
+        return tier, self.tier_start(tier + 1) - stat, stat - start
+
+    def query_array(self, stats):
+        """ query() for an array of stat values. Returns three int64 arrays. """
+        import numpy as np
+        stats = np.asarray(stats, dtype=np.int64)
+        tier = self.tier(stats)
+        return (tier, self.tier_start(tier + 1) - stats,
+                stats - self.tier_start(tier))
+
+_STAT_TIERS = {}
+
+def get_stat_tiers(stat_name, level):
+    """ Cached StatTiers for (stat_name, level). """
+    key = (stat_name, level)
+    tiers = _STAT_TIERS.get(key)
+    if tiers is None:
+        tiers = _STAT_TIERS[key] = StatTiers(stat_name, level)
+    return tiers
+
+#################################################################
+# GCD TIERS                                                     #
+#################################################################
+# calc_gcdmod only depends on the speed stat through its SKS/SPS tier
+# t = floor(130 * (speed - sub) / div), since ceil(130 * (sub - speed) / div)
+# is just -t. So the whole speed -> GCD mapping of a level, base GCD and
+# haste is a short table of (GCD, lowest speed that reaches it).
+
+# GCD in centiseconds for a speed tier (or an array of them)
+def _gcd_for_tier(tier, gcd, haste):
+    fgcd = gcd * (1000 - tier) // 1000
+    return fgcd * (100 - haste) // 1000
+
+class GCDTiers:
+    """ Speed -> GCD table for one level, base GCD (in ms) and haste.
+        Use get_gcd_tiers to get a cached instance. """
+    def __init__(self, level, gcd=2500, haste=0, max_speed=None):
+        self.level = level
+        self.base_gcd = gcd
+        self.haste = haste
+        self.tiers = get_stat_tiers("SKS", level)
+        if max_speed is None:
+            max_speed = self.tiers.base + 4 * self.tiers.div
+        # GCDs in centiseconds (descending) and the lowest speed for each
+        gcds = []
+        speeds = []
+        for tier in range(0, self.tiers.tier(max_speed) + 1):
+            start = self.tiers.tier_start(tier)
+            if start == self.tiers.tier_start(tier + 1):
+                # Empty tier, no speed value lands in it
+                continue
+            value = _gcd_for_tier(tier, gcd, haste)
+            if not gcds or value < gcds[-1]:
+                gcds.append(value)
+                speeds.append(start)
+        self.gcds = tuple(gcds)
+        self.thresholds = tuple(speeds)
+        # Ascending copy for bisect
+        self._gcds_ascending = tuple(reversed(gcds))
+
+    def gcd_centiseconds(self, spd_stat):
+        return _gcd_for_tier(self.tiers.tier(spd_stat), self.base_gcd, self.haste)
+
+    def gcd(self, spd_stat):
+        """ Same as calc_gcdmod(spd_stat, gcd, level, haste). """
+        return self.gcd_centiseconds(spd_stat) / 100
+
+    def gcd_array(self, spd_stats):
+        """ GCDs in seconds for an array of speed values. """
+        import numpy as np
+        spd_stats = np.asarray(spd_stats, dtype=np.int64)
+        return _gcd_for_tier(self.tiers.tier(spd_stats), self.base_gcd, self.haste) / 100
+
+    def min_speed(self, target_gcd):
+        """ Lowest speed stat with a GCD of at most target_gcd seconds,
+            or None if it isn't reachable within the table. """
+        target = round(target_gcd * 100)
+        # Number of table GCDs <= target
+        i = bisect_right(self._gcds_ascending, target)
+        if i == 0:
+            return None
+        return self.thresholds[len(self.gcds) - i]
+
+    def table(self):
+        """ [(GCD in seconds, lowest speed stat), ...], slowest GCD first. """
+        return [(g / 100, s) for g, s in zip(self.gcds, self.thresholds)]
+
+_GCD_TIERS = {}
+
+def get_gcd_tiers(level, gcd=2500, haste=0):
+    """ Cached GCDTiers for (level, gcd, haste). """
+    key = (level, gcd, haste)
+    tiers = _GCD_TIERS.get(key)
+    if tiers is None:
+        tiers = _GCD_TIERS[key] = GCDTiers(level, gcd, haste)
+    return tiers
+
 #################################################################
 # EXAMPLES AND TESTS                                            #
 #################################################################
 
+# Buffed crit and DH chances as probabilities, i.e. (pcrit, pdh)
+def calc_hit_chances(playerstats, buffs):
+    effects = get_buff_effects(playerstats, buffs)
+    buffedstats = effects.stats
+    dhchance = floor(1000 * calc_dhrate(buffedstats.DH, playerstats.level))
+    dhchance += effects.dh_chance
+    critchance = floor(1000 * calc_critrate(buffedstats.CRT, playerstats.level))
+    critchance += effects.crit_chance
+    return critchance / 1000, dhchance / 1000
+
 # Generate a sample of damage numbers for a given setup
 # Determines whether each hit is a crit and/or dh individually
 def generate_sample_hits(n: int,
@@ -683,13 +2717,8 @@ def generate_sample_hits(n: int,
                          playerstats: PlayerStats,
                          buffs: list):
     hits = []
-    buffedstats = apply_stat_buffs(playerstats, buffs)
-    dhchance = floor(1000 * calc_dhrate(buffedstats.DH, playerstats.level))
-    dhchance = apply_dh_buffs(dhchance, buffs)
-    pdh = dhchance / 1000
-    critchance = floor(1000 * calc_critrate(buffedstats.CRT, playerstats.level))
-    critchance = apply_critchance_buffs(critchance, buffs)
-    pcrit = critchance / 1000
+    pcrit, pdh = calc_hit_chances(playerstats, buffs)
+    kernel = HitKernel(job, weaponinfo, playerstats, buffs)
     for i in range(n):
         if random() < pdh:
             isdh = DHType.DirectHit
@@ -699,15 +2728,188 @@ def generate_sample_hits(n: int,
             iscrit = CritType.Crit
         else:
             iscrit = CritType.Normal
-        hits.append(calc_action_damage(potency,
-                                       job,
-                                       weaponinfo,
-                                       playerstats,
-                                       buffs,
-                                       crittype=iscrit,
-                                       dhtype=isdh))
+        hits.append(kernel.damage(potency, iscrit, isdh))
+    return hits
+
+# Same as generate_sample_hits, but evaluated in one NumPy batch.
+# Returns an int64 array instead of a list.
+def generate_sample_hits_batch(n: int,
+                               potency: int,
+                               job: str,
+                               weaponinfo: WeaponInfo,
+                               playerstats: PlayerStats,
+                               buffs: list,
+                               rng=None):
+    import numpy as np
+    if rng is None:
+        rng = np.random.default_rng()
+    pcrit, pdh = calc_hit_chances(playerstats, buffs)
+    dhs = rng.random(n) < pdh
+    crits = rng.random(n) < pcrit
+    return calc_action_damage_batch(potency, job, weaponinfo, playerstats, buffs,
+                                    crits=crits, dhs=dhs, rng=rng)
+
+# Total damage of the given set of attacks, n times
+def multi_hit_damage_sample(n: int,
+                            hit_potencies: list,
+                            job: str,
+                            weaponinfo: WeaponInfo,
+                            playerstats: PlayerStats,
+                            buffs: list):
+    """ Generate a list of damage values for the given set of attacks. """
+    hits = []
+    pcrit, pdh = calc_hit_chances(playerstats, buffs)
+    kernel = HitKernel(job, weaponinfo, playerstats, buffs)
+    for i in range(n):
+        hit = 0
+        for potency in hit_potencies:
+            if random() < pdh:
+                isdh = DHType.DirectHit
+            else:
+                isdh = DHType.Normal
+            if random() < pcrit:
+                iscrit = CritType.Crit
+            else:
+                iscrit = CritType.Normal
+            hit += kernel.damage(potency, iscrit, isdh)
+        hits.append(hit)
     return hits
 
+# Property check of the integer pipeline against the float one, over n
+# random jobs, levels, stats, buffs and hits. Raises AssertionError
+# (explicitly, so it also works under python -O) naming the first
+# property that fails, and returns counts of what was compared:
+# - every *_int modifier is the exact floor of its rational formula, and
+#   the float version scaled back (e.g. floor(1000 * calc_critmod(...)))
+#   is either equal or one below it (the float round-trip error)
+# - when an IntHitKernel ends up with the same modifiers as the
+#   HitKernel, every hit is identical to calc_action_damage and
+#   calc_dot_tick_damage
+# - the IntHitKernel batch methods match its scalar methods
+def check_integer_pipeline(n=2000, seed=0):
+    import numpy as np
+    from fractions import Fraction
+    rng = Random(seed)
+    report = {"modifiers": 0, "modifier_round_trip": 0, "kernels": 0,
+              "kernels_same_modifiers": 0, "hits": 0}
+    jobs = list(JOB_IDS)
+    max_level = get_max_level()
+    def exact(k, stat, base, div, add=0):
+        return floor(Fraction(k * (stat - base), div)) + add
+    def check(ok, message, *args):
+        if not ok:
+            raise AssertionError(message.format(*args))
+    for _ in range(n):
+        level = rng.randint(1, max_level)
+        main, sub, div = LEVEL_MSD[level]
+        stat = rng.randint(min(main, sub), min(main, sub) + 4 * div)
+        job = rng.choice(jobs)
+        attr = rng.choice(("STR", "DEX", "INT", "MND"))
+        wd = rng.randint(1, 150)
+        pairs = [
+            ("calc_critrate", calc_critrate_int(stat, level),
+             exact(CRT_RATE_MOD, stat, sub, div, 50),
+             floor(1000 * calc_critrate(stat, level))),
+            ("calc_critmod", calc_critmod_int(stat, level),
+             exact(CRT_DMG_MOD, stat, sub, div, 1400),
+             floor(1000 * calc_critmod(stat, level))),
+            ("calc_dhrate", calc_dhrate_int(stat, level), exact(DH_MOD, stat, sub, div),
+             floor(1000 * calc_dhrate(stat, level))),
+            ("calc_detmod", calc_detmod_int(stat, level),
+             exact(DET_MOD, stat, main, div, 1000),
+             int(calc_detmod(stat, level) * 1000)),
+            ("calc_spdmod", calc_spdmod_int(stat, level),
+             exact(SPD_MOD, stat, sub, div, 1000),
+             floor(1000 * calc_spdmod(stat, level))),
+            ("calc_tenacitymod_dps", calc_tenacitymod_dps_int(stat, level),
+             exact(TNC_MOD, stat, sub, div, 1000),
+             floor(1000 * calc_tenacitymod_dps(stat, level))),
+            ("calc_gcdmod", calc_gcdmod_int(stat, 2500, level), None,
+             round(calc_gcdmod(stat, 2500, level) * 100)),
+            ("calc_atkpowermod", calc_atkpowermod_int(stat, job, level), None,
+             calc_atkpowermod(stat, job, level)),
+            ("calc_wepdamagemod", calc_wepdamagemod_int(wd, job, attr, level),
+             exact(JOB_COLUMNS[attr][JOB_IDS[job]], main, 0, 1000, wd),
+             calc_wepdamagemod(wd, job, attr, level)),
+        ]
+        for name, value, exact_value, from_float in pairs:
+            check(exact_value is None or value == exact_value,
+                  "{}_int({}, level {}) is {}, the exact value is {}",
+                  name, stat, level, value, exact_value)
+            check(from_float in (value, value - 1),
+                  "{}({}, level {}) is {} (scaled), {}_int gives {}",
+                  name, stat, level, from_float, name, value)
+            report["modifiers"] += 1
+            report["modifier_round_trip"] += from_float != value
+        # Damage
+        stats = PlayerStats(level)
+        for name in STAT_NAMES:
+            base = getattr(stats, name)
+            setattr(stats, name, rng.randint(base, base + 3 * div))
+        weaponinfo = WeaponInfo(rng.randint(1, 150), rng.randint(1, 150), rng.randint(150, 350))
+        buffs = rng.sample([PartyBuffs.Devilment, PartyBuffs.ChainStrategem,
+                            PartyBuffs.Divination, PartyBuffs.NoMercy,
+                            PartyBuffs.BattleVoice], rng.randint(0, 3))
+        float_kernel = HitKernel(job, weaponinfo, stats, buffs)
+        int_kernel = IntHitKernel(job, weaponinfo, stats, buffs)
+        report["kernels"] += 1
+        same = all(getattr(float_kernel, name) == getattr(int_kernel, name)
+                   for name in ("fatk", "fwd", "fdet", "fdet_forced_dh", "ftnc",
+                                "fspd_dot", "fspd_aa", "aa_mod", "critmods", "dhmods",
+                                "critchance", "dhchance"))
+        potencies = [rng.randint(1, 1500) for _ in range(4)]
+        outcomes = [(rng.choice(list(CritType)), rng.choice(list(DHType)),
+                     rng.randint(9500, 10500)) for _ in range(4)]
+        if same:
+            report["kernels_same_modifiers"] += 1
+            for potency, (crit, dh, randvar) in zip(potencies, outcomes):
+                hit = (job, level, potency, crit, dh, randvar)
+                check(int_kernel.damage(potency, crit, dh, randvar)
+                      == calc_action_damage(potency, job, weaponinfo, stats, buffs,
+                                            crit, dh, randvar),
+                      "IntHitKernel.damage differs from calc_action_damage for {}", hit)
+                check(int_kernel.dot_damage(potency, crit, dh, randvar)
+                      == calc_dot_tick_damage(potency, job, weaponinfo, stats, buffs,
+                                              crit, dh, randvar),
+                      "IntHitKernel.dot_damage differs from calc_dot_tick_damage for {}", hit)
+                check(int_kernel.aa_damage(crit, dh, randvar)
+                      == calc_aa_damage(job, weaponinfo, stats, buffs, crit, dh, randvar),
+                      "IntHitKernel.aa_damage differs from calc_aa_damage for {}", hit)
+                report["hits"] += 3
+        # An auto is about a hit of the same potency, with f(AUTO) (roughly
+        # f(WD) times the weapon delay over 3s) in place of f(WD), times f(SPD)
+        scale = Fraction(calc_aamod_int(weaponinfo.damage, weaponinfo.delay, job,
+                                        get_ap_stat(job), level)
+                         * calc_spdmod_int(stats.SKS, level), 1000)
+        for kernel in (float_kernel, int_kernel):
+            auto = kernel.aa_damage(CritType.Normal, DHType.Normal, 10000)
+            hit = kernel.damage(kernel.aa_potency, CritType.Normal, DHType.Normal, 10000)
+            expected = hit * scale / kernel.fwd
+            check(expected / 2 - 1 <= auto <= 2 * expected + 1,
+                  "{}.aa_damage is {} for {} at level {}, a hit of its potency is {}",
+                  type(kernel).__name__, auto, job, level, hit)
+        # Batch against scalar, with the crit/DH types each batch supports
+        crits = np.array([rng.random() < 0.5 for _ in potencies])
+        dhs = np.array([rng.random() < 0.5 for _ in potencies])
+        randvars = np.array([o[2] for o in outcomes])
+        crittype = rng.choice([CritType.Crit, CritType.ForcedCrit])
+        dhtype = rng.choice([DHType.DirectHit, DHType.ForcedDirectHit])
+        batches = (int_kernel.damage_batch(potencies, crits, dhs, randvars, crittype, dhtype),
+                   int_kernel.dot_damage_batch(potencies, crits, dhs, randvars, crittype, dhtype),
+                   int_kernel.aa_damage_batch(crits, dhs, randvars, crittype, dhtype))
+        for i, potency in enumerate(potencies):
+            crit = crittype if crits[i] else CritType.Normal
+            dh = dhtype if dhs[i] else DHType.Normal
+            randvar = int(randvars[i])
+            hit = (job, level, potency, crit, dh, randvar)
+            check(batches[0][i] == int_kernel.damage(potency, crit, dh, randvar),
+                  "IntHitKernel.damage_batch differs from damage for {}", hit)
+            check(batches[1][i] == int_kernel.dot_damage(potency, crit, dh, randvar),
+                  "IntHitKernel.dot_damage_batch differs from dot_damage for {}", hit)
+            check(batches[2][i] == int_kernel.aa_damage(crit, dh, randvar),
+                  "IntHitKernel.aa_damage_batch differs from aa_damage for {}", hit)
+    return report
+
 # Compendium of often-used buffs
 class PartyBuffs:
     def __new__(cls):
@@ -715,7 +2917,8 @@ class PartyBuffs:
             cls.instance = super(PartyBuffs, cls).__new__(cls)
         return cls.instance
     SearingLight = Buff(damagebuff=30)
-    Embolden = Buff(damagebuff=50) # TODO: make this only applied to the source RDM's magic damage
+    # Only the source RDM's: use ffxiv_party.RaidBuff(targets=SELF)
+    Embolden = DamageTypeBuff((DamageType.MAGICAL,), damagebuff=50)
     ChainStrategem = Buff(critbuff=100)
     AstCorrectCard = Buff(damagebuff=60)
     AstWrongCard = Buff(damagebuff=30)
@@ -836,44 +3039,6 @@ if __name__ == "__main__":
                                      playerstats: PlayerStats,
                                      buffs: list):
         """ Create a histogram using matplotlib of a damage sample """
-        hits = generate_sample_hits(100000, potency, job, weaponinfo, playerstats, buffs)
+        hits = generate_sample_hits_batch(100000, potency, job, weaponinfo, playerstats, buffs)
         counts, bins = np.histogram(hits, bins=40)
         return counts, bins
-
-    def multi_hit_damage_sample(n: int,
-                                hit_potencies: list,
-                                job: str,
-                                weaponinfo: WeaponInfo,
-                                playerstats: PlayerStats,
-                                buffs: list):
-        """ Generate a list of damage values for the given set of attacks. """
-        hits = []
-        buffedstats = apply_stat_buffs(playerstats, buffs)
-        dhchance = floor(1000 * calc_dhrate(buffedstats.DH, playerstats.level))
-        dhchance = apply_dh_buffs(dhchance, buffs)
-        pdh = dhchance / 1000
-        critchance = floor(1000 * calc_critrate(buffedstats.CRT, playerstats.level))
-        critchance = apply_critchance_buffs(critchance, buffs)
-        pcrit = critchance / 1000
-        for i in range(n):
-            hit = 0
-            for potency in hit_potencies:
-                if random() < pdh:
-                    isdh = DHType.DirectHit
-                else:
-                    isdh = DHType.Normal
-                if random() < pcrit:
-                    iscrit = CritType.Crit
-                else:
-                    iscrit = CritType.Normal
-                hit += (calc_action_damage(potency,
-                                               job,
-                                               weaponinfo,
-                                               playerstats,
-                                               buffs,
-                                               crittype=iscrit,
-                                               dhtype=isdh))
-            hits.append(hit)
-        return hits
-
-
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+Party fight simulation on top of ffxiv_sim.
+
+Up to eight PartyMembers each run their own rotation, and RaidBuffs are
+used by one member (the source) on a fixed schedule and reach the
+members picked by their targets. Every member's timeline only depends on
+the buff windows it receives, so the members are simulated independently
+(optionally on a process pool), each with its own cached kernels.
+
+Buff contributions are attributed per hit, after the damage is rolled:
+- Damage buffs: the hit without them would have done D / (1 + m1)(1 + m2)...
+  and the difference is split between the buffs in proportion to
+  log(1 + m) of each.
+- Crit and DH chance buffs: a crit (or DH) gains D' (1 - 1 / f(crit)), with
+  D' the damage without damage buffs, and each buff gets its share of the
+  crit (DH) chance of that hit. Guaranteed crits and DHs don't give crit
+  or DH chance buffs any credit, and stat buffs count as the receiver's.
+
+From that, per member:
+- rDPS: own damage, minus what others' buffs added to it, plus what the
+  member's buffs added to others' damage.
+- aDPS: like rDPS, but the contribution of single-target buffs (e.g.
+  cards) stays with the receiver instead of going to the source.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+import math
+
+import numpy as np
+
+from ffxiv_math import Buff, CritType, DHType, PlayerStats, WeaponInfo
+from ffxiv_sim import FightSimulator, raid_buff_windows
+
+# Buff targets
+PARTY = "party"
+SELF = "self"
+OTHERS = "others"
+
+@dataclass
+class PartyMember:
+    name: str
+    job: str
+    weaponinfo: WeaponInfo
+    playerstats: PlayerStats
+    rotation: object            # TimedRotation or PriorityRotation
+    base_gcd: int = 2500
+    haste: int = 0
+    auto_attacks: bool = True
+
+@dataclass
+class RaidBuff:
+    buff: Buff
+    source: str                 # Name of the member that uses it
+    duration: int               # In ms
+    interval: int = 120000      # In ms
+    first: int = 0              # Time of the first use, in ms
+    # PARTY, SELF, OTHERS, a collection of member names, or a function
+    # of a PartyMember that returns whether it receives the buff
+    targets: object = PARTY
+    name: str = ""
+
+    def receivers(self, members):
+        """ Names of the members that receive the buff. """
+        targets = self.targets
+        if targets == PARTY:
+            return [m.name for m in members]
+        elif targets == SELF:
+            return [self.source]
+        elif targets == OTHERS:
+            return [m.name for m in members if m.name != self.source]
+        elif callable(targets):
+            return [m.name for m in members if targets(m)]
+        else:
+            return [m.name for m in members if m.name in targets]
+
+    def is_single_target(self, members):
+        """ A buff that only one other member receives, like a card. """
+        receivers = self.receivers(members)
+        return len(receivers) == 1 and receivers[0] != self.source
+
+class PartyResult:
+    """ Damage and buff attribution of n simulated party fights.
+        All arrays have one row per fight. contributions[:, i, s] is the
+        damage that buffs of member s added to member i's hits, and
+        single_target[:, i, s] the part of it from single-target buffs. """
+    def __init__(self, names, fight_length, damage, contributions, single_target):
+        self.names = list(names)
+        self.fight_length = fight_length
+        self.damage = damage
+        self.contributions = contributions
+        self.single_target = single_target
+
+    def _per_second(self, damage):
+        return damage / (self.fight_length / 1000)
+
+    def _adjusted(self, contributions):
+        # Buffs on oneself are simply part of one's own damage
+        external = contributions.copy()
+        idx = np.arange(len(self.names))
+        external[:, idx, idx] = 0
+        received = external.sum(axis=2)
+        given = external.sum(axis=1)
+        return self.damage - received + given
+
+    def dps(self):
+        """ Actual DPS of every member, shape (n, members). """
+        return self._per_second(self.damage)
+
+    def rdps(self):
+        return self._per_second(self._adjusted(self.contributions))
+
+    def adps(self):
+        return self._per_second(self._adjusted(self.contributions - self.single_target))
+
+    def party_dps(self):
+        return self.dps().sum(axis=1)
+
+    def summary(self):
+        """ {name: (mean DPS, mean rDPS, mean aDPS)} """
+        dps = self.dps().mean(axis=0)
+        rdps = self.rdps().mean(axis=0)
+        adps = self.adps().mean(axis=0)
+        return {name: (float(dps[i]), float(rdps[i]), float(adps[i]))
+                for i, name in enumerate(self.names)}
+
+# Attribution of the rolled hits of one timeline to the buff sources.
+# The window sources are (member index, single-target).
+def _attribute(timeline, damage, crits, dhs, n_sources):
+    n = damage.shape[0]
+    contributions = np.zeros((n, n_sources))
+    single_target = np.zeros((n, n_sources))
+    for (kernel_id, kind, forced_crit, forced_dh), idx in timeline.groups().items():
+        sources = timeline.kernel_sources[kernel_id]
+        if all(s is None for s in sources):
+            continue
+        kernel = timeline.kernels[kernel_id]
+        buffs = timeline.kernel_buffs[kernel_id]
+        hits = damage[:, idx].astype(float)
+        # Damage buffs
+        logs = [math.log1p(b.damage_multiplier / 1000) for b in buffs]
+        total_log = sum(logs)
+        unbuffed = hits / math.exp(total_log)
+        gain = hits - unbuffed
+        # Crit and DH chance buffs
+        use_crit = not forced_crit and kernel.critchance > 0
+        use_dh = not forced_dh and kernel.dhchance > 0
+        if use_crit:
+            critmult = kernel.critmods[CritType.Crit] / 1000000
+            crit_gain = np.where(crits[:, idx], unbuffed * (1 - 1 / critmult), 0)
+        if use_dh:
+            dhmult = kernel.dhmods[DHType.DirectHit] / 1000000
+            dh_gain = np.where(dhs[:, idx], unbuffed * (1 - 1 / dhmult), 0)
+        for buff, source, log in zip(buffs, sources, logs):
+            if source is None:
+                continue
+            share = np.zeros_like(hits)
+            if log:
+                share += gain * (log / total_log)
+            if use_crit and buff.crit_chance_increase:
+                share += crit_gain * min(1, buff.crit_chance_increase / kernel.critchance)
+            if use_dh and buff.dh_chance_increase:
+                share += dh_gain * min(1, buff.dh_chance_increase / kernel.dhchance)
+            member, single = source
+            contributions[:, member] += share.sum(axis=1)
+            if single:
+                single_target[:, member] += share.sum(axis=1)
+    return contributions, single_target
+
+def _member_task(member, windows, fight_length, n, seed, n_sources, batch):
+    """ Runs in a worker: simulate one member's fights, batch at a time. """
+    sim = FightSimulator(member.job, member.weaponinfo, member.playerstats,
+                         member.base_gcd, member.haste, member.auto_attacks)
+    timeline = sim.timeline(member.rotation, windows, fight_length)
+    rng = np.random.default_rng(seed)
+    totals = np.empty(n, dtype=np.int64)
+    contributions = np.empty((n, n_sources))
+    single_target = np.empty((n, n_sources))
+    for start in range(0, n, batch):
+        end = min(n, start + batch)
+        damage, crits, dhs = timeline.roll_outcomes(end - start, rng)
+        totals[start:end] = damage.sum(axis=1)
+        contributions[start:end], single_target[start:end] = _attribute(
+            timeline, damage, crits, dhs, n_sources)
+    return totals, contributions, single_target
+
+def simulate_party(members,
+                   raid_buffs=(),
+                   fight_length: int = 600000,
+                   n: int = 1,
+                   seed=None,
+                   workers: int = 1,
+                   batch: int = 1000):
+    """ Simulate n fights of the party and attribute the raid buffs.
+        Every member gets its own random stream from the seed, so the
+        result doesn't depend on the number of workers. """
+    if len(members) > 8:
+        raise ValueError("A party has at most 8 members")
+    names = [m.name for m in members]
+    if len(set(names)) != len(names):
+        raise ValueError("Party member names must be unique")
+    index = {name: i for i, name in enumerate(names)}
+    # Buff windows each member receives
+    windows = {name: [] for name in names}
+    for raid_buff in raid_buffs:
+        if raid_buff.source not in index:
+            raise ValueError("Unknown buff source {}".format(raid_buff.source))
+        source = (index[raid_buff.source], raid_buff.is_single_target(members))
+        for window in raid_buff_windows(raid_buff.buff, raid_buff.duration,
+                                        raid_buff.interval, raid_buff.first,
+                                        fight_length, raid_buff.name):
+            window.source = source
+            for name in raid_buff.receivers(members):
+                windows[name].append(window)
+    seeds = np.random.SeedSequence(seed).spawn(len(members))
+    args = [(m, windows[m.name], fight_length, n, s, len(members), batch)
+            for m, s in zip(members, seeds)]
+    if workers <= 1:
+        results = [_member_task(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_member_task, *zip(*args)))
+    damage = np.stack([r[0] for r in results], axis=1)
+    contributions = np.stack([r[1] for r in results], axis=1)
+    single_target = np.stack([r[2] for r in results], axis=1)
+    return PartyResult(names, fight_length, damage, contributions, single_target)
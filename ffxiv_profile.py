@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in instrumentation of the damage engine.
+
+    with Profiler() as prof:
+        run_simulation()
+    print(prof.report())
+    prof.write_folded("profile.folded")   # for flamegraph.pl / speedscope
+
+    @Profiler()
+    def run_simulation(): ...
+
+While a Profiler is enabled, the instrumented functions (the calc_* and
+apply_* families, buff lookups, table lookups, stat copies, the RNG and
+the HitKernel methods by default) are replaced by timing wrappers: in
+the ffxiv_math module, on the classes, and in every loaded ffxiv_*
+module that imported them by name. Disabling puts the originals back,
+so with no Profiler enabled there is no overhead at all. Call sites that
+keep their own reference to a function (a bound method stored in a
+variable, a functools.partial) bypass the wrappers.
+
+For every instrumented function the profiler counts the calls, the
+total time (including the instrumented functions it calls) and the own
+time (excluding them). Own time is also kept per call stack of
+instrumented functions, which is what the folded stack dump contains.
+Cache hits and misses are the difference of the cache counters between
+enabling and the snapshot.
+
+Only one Profiler can be enabled at a time, and it expects to be used
+from one thread. The modifier cache of ffxiv_math replaces module
+functions too: while a Profiler is enabled, enabling or disabling it
+raises RuntimeError, so the Profiler always puts back what it found.
+"""
+
+from collections import defaultdict
+from dataclasses import dataclass
+import functools
+import sys
+from time import perf_counter
+
+import ffxiv_math as fm
+
+# Module-level functions of ffxiv_math instrumented by default, on top of
+# everything named calc_* or apply_*
+DEFAULT_FUNCTIONS = ("get_buff_effects", "freeze_buffs", "get_level_mods",
+                     "get_job_attr", "get_job_info", "_job_info",
+                     "get_stat_tiers", "get_gcd_tiers",
+                     "fixed_random_variation", "random", "randint",
+                     "generate_sample_hits", "generate_sample_hits_batch",
+                     "multi_hit_damage_sample")
+DEFAULT_PREFIXES = ("calc_", "apply_")
+# Classes whose own methods (not the special ones) are instrumented
+DEFAULT_CLASSES = ("HitKernel", "IntHitKernel", "HealKernel")
+DEFAULT_METHODS = (("PlayerStats", "copy"),)
+
+# Caches reported by snapshot(): name -> function returning an object
+# with hits and misses (like functools' cache_info())
+CACHES = {
+    "buff_effects": fm.buff_cache_info,
+    "modifiers": fm.modifier_cache_info,
+}
+
+_active = None
+
+def default_targets():
+    """ [(owner, attribute name, label)] of everything instrumented by
+        default. The owner is the ffxiv_math module or one of its classes. """
+    targets = []
+    names = set(DEFAULT_FUNCTIONS)
+    for name, value in vars(fm).items():
+        if name.startswith(DEFAULT_PREFIXES) and callable(value) and not isinstance(value, type):
+            names.add(name)
+    for name in sorted(names):
+        value = getattr(fm, name)
+        if name in ("random", "randint"):
+            label = "random." + name
+        else:
+            label = name
+        targets.append((fm, name, label))
+    for class_name in DEFAULT_CLASSES:
+        cls = getattr(fm, class_name)
+        for name, value in vars(cls).items():
+            if callable(value) and not name.startswith("__"):
+                targets.append((cls, name, "{}.{}".format(class_name, name)))
+    for class_name, name in DEFAULT_METHODS:
+        targets.append((getattr(fm, class_name), name, "{}.{}".format(class_name, name)))
+    return targets
+
+@dataclass
+class FunctionStats:
+    calls: int = 0
+    total: float = 0.0              # Seconds, including instrumented callees
+    own: float = 0.0                # Seconds, excluding instrumented callees
+
+@dataclass
+class CacheStats:
+    hits: int
+    misses: int
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+class Profiler:
+    """ Call counts and times of the instrumented functions while enabled.
+        Works as a context manager and as a decorator. Stats accumulate
+        over every time it is enabled, until reset(). """
+    def __init__(self, targets=None):
+        self.targets = default_targets() if targets is None else list(targets)
+        self.functions = defaultdict(FunctionStats)
+        self.stacks = defaultdict(float)    # Own seconds per call stack
+        self._path = ()
+        self._children = [0.0]
+        self._patched = []
+        self._cache_start = {}
+        self._cache_total = {}
+
+    @property
+    def enabled(self):
+        return _active is self
+
+    def _wrap(self, func, label):
+        profiler = self
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            parent = profiler._path
+            profiler._path = parent + (label,)
+            children = profiler._children
+            children.append(0.0)
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - start
+                profiler._path = parent
+                own = elapsed - children.pop()
+                children[-1] += elapsed
+                stats = profiler.functions[label]
+                stats.calls += 1
+                stats.own += own
+                # Only the outermost call of a recursion counts in total
+                if label not in parent:
+                    stats.total += elapsed
+                profiler.stacks[parent + (label,)] += own
+        wrapper.__wrapped_by_profiler__ = True
+        return wrapper
+
+    def enable(self):
+        global _active
+        if _active is self:
+            return self
+        if _active is not None:
+            raise RuntimeError("Another Profiler is already enabled")
+        # Every loaded ffxiv_* module that imported something by name
+        modules = [m for name, m in list(sys.modules.items())
+                   if name.startswith("ffxiv_") and m is not None and m is not fm]
+        for owner, name, label in self.targets:
+            raw = vars(owner)[name]
+            if isinstance(raw, (staticmethod, classmethod)):
+                wrapped = type(raw)(self._wrap(raw.__func__, label))
+            else:
+                wrapped = self._wrap(raw, label)
+            setattr(owner, name, wrapped)
+            self._patched.append((owner, name, raw))
+            if owner is fm:
+                for module in modules:
+                    if vars(module).get(name) is raw:
+                        setattr(module, name, wrapped)
+                        self._patched.append((module, name, raw))
+        self._cache_start = {name: info() for name, info in CACHES.items()}
+        _active = self
+        return self
+
+    def disable(self):
+        global _active
+        if _active is not self:
+            return
+        for owner, name, raw in reversed(self._patched):
+            setattr(owner, name, raw)
+        self._patched = []
+        self._cache_total = self._cache_stats()
+        self._cache_start = {}
+        _active = None
+
+    def _cache_stats(self):
+        caches = dict(self._cache_total)
+        for name, start in self._cache_start.items():
+            info = CACHES[name]()
+            # A reload clears the caches, which restarts their counters
+            hits = info.hits - start.hits if info.hits >= start.hits else info.hits
+            misses = info.misses - start.misses if info.misses >= start.misses else info.misses
+            previous = caches.get(name, CacheStats(0, 0))
+            caches[name] = CacheStats(previous.hits + hits, previous.misses + misses)
+        return caches
+
+    def reset(self):
+        self.functions.clear()
+        self.stacks.clear()
+        self._cache_total = {}
+        if self.enabled:
+            self._cache_start = {name: info() for name, info in CACHES.items()}
+
+    def __enter__(self):
+        return self.enable()
+
+    def __exit__(self, *exc):
+        self.disable()
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def profiled(*args, **kwargs):
+            with self:
+                return func(*args, **kwargs)
+        return profiled
+
+    def snapshot(self):
+        """ {"functions": {label: FunctionStats}, "caches": {name: CacheStats}},
+            sorted by own time. A copy, it doesn't change afterwards. """
+        functions = sorted(self.functions.items(), key=lambda item: -item[1].own)
+        return {
+            "functions": {label: FunctionStats(s.calls, s.total, s.own)
+                          for label, s in functions},
+            "caches": self._cache_stats() if self.enabled else dict(self._cache_total),
+        }
+
+    def report(self, limit=30):
+        """ Text table of the functions with the most own time, and the caches. """
+        snapshot = self.snapshot()
+        lines = ["{:<40} {:>10} {:>10} {:>10} {:>9}".format(
+            "function", "calls", "total ms", "own ms", "own us/call")]
+        for label, s in list(snapshot["functions"].items())[:limit]:
+            lines.append("{:<40} {:>10} {:>10.2f} {:>10.2f} {:>9.3f}".format(
+                label, s.calls, 1000 * s.total, 1000 * s.own, 1e6 * s.own / s.calls))
+        if snapshot["caches"]:
+            lines.append("")
+            lines.append("{:<40} {:>10} {:>10} {:>10}".format("cache", "hits", "misses", "hit rate"))
+            for name, c in snapshot["caches"].items():
+                lines.append("{:<40} {:>10} {:>10} {:>10.1%}".format(
+                    name, c.hits, c.misses, c.hit_rate))
+        return "\n".join(lines)
+
+    def folded_stacks(self):
+        """ One "outer;inner;function microseconds" line per call stack, the
+            input format of flamegraph.pl, speedscope and inferno. """
+        lines = []
+        for path, seconds in sorted(self.stacks.items()):
+            micros = int(round(1e6 * seconds))
+            if micros > 0:
+                lines.append("{} {}".format(";".join(path), micros))
+        return "\n".join(lines)
+
+    def write_folded(self, path):
+        with open(path, "w") as f:
+            f.write(self.folded_stacks() + "\n")
+
+def active_profiler():
+    """ The enabled Profiler, or None. """
+    return _active
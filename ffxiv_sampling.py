@@ -0,0 +1,553 @@
+# -*- coding: utf-8 -*-
+"""
+Monte Carlo sampling of hits, spread over a process pool.
+
+The hits are split into fixed-size tasks, and every task gets its own
+random stream from np.random.SeedSequence(seed).spawn(). Since the tasks
+(and their streams) only depend on n, chunk_size and seed, a run gives
+the same result whatever the number of workers.
+
+Workers never send hits back. A hit can only take one of the few
+thousand damage values between the lowest and the highest possible
+damage, so each task returns one count per damage value, which the
+parent adds up. Memory stays bounded no matter how many hits are drawn.
+
+iter_sample_hits draws hits in fixed-size chunks instead of building one
+big list. The accumulators below (Moments, FixedHistogram, AutoHistogram,
+QuantileSketch, SampleCounts) all take chunks with add() and combine
+shards with merge(). They use a fixed amount of memory, and merging
+shards gives exactly the same state as adding all chunks to one of them.
+
+compare_variants evaluates several setups (stats, buffs, weapons) on
+common random numbers: every variant sees the same uniform crit and DH
+draws and the same random variation (the randvar of calc_action_damage)
+for every hit, so the paired differences are free of most of the noise
+independent samples would have.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from functools import partial
+import math
+import os
+from statistics import NormalDist
+
+import numpy as np
+
+from ffxiv_math import (DamageDistribution, HitKernel, HitKind, PlayerStats,
+                        WeaponInfo)
+
+def kernel_damage_range(kernel: HitKernel, potency: int, kind: HitKind):
+    """ (lowest, highest) damage a hit of the kernel can do. """
+    lo = _kernel_hits(kernel, potency, kind,
+                      np.array([False]), np.array([False]), np.array([9500]))
+    hi = _kernel_hits(kernel, potency, kind,
+                      np.array([True]), np.array([True]), np.array([10500]))
+    return int(lo[0]), int(hi[0])
+
+def _kernel_hits(kernel, potency, kind, crits, dhs, randvars):
+    if kind is HitKind.DOT:
+        return kernel.dot_damage_batch(potency, crits, dhs, randvars)
+    elif kind is HitKind.AUTO:
+        return kernel.aa_damage_batch(crits, dhs, randvars)
+    else:
+        return kernel.damage_batch(potency, crits, dhs, randvars)
+
+def draw_kernel_hits(kernel: HitKernel, potency: int, kind: HitKind, n: int, rng):
+    """ n random hits of the kernel, rolling crit, DH and the random
+        variation like generate_sample_hits does. """
+    pcrit = kernel.critchance / 1000
+    pdh = kernel.dhchance / 1000
+    dhs = rng.random(n) < pdh
+    crits = rng.random(n) < pcrit
+    randvars = rng.integers(9500, 10501, size=n)
+    return _kernel_hits(kernel, potency, kind, crits, dhs, randvars)
+
+def iter_sample_hits(n: int,
+                     potency: int,
+                     job: str,
+                     weaponinfo: WeaponInfo,
+                     playerstats: PlayerStats,
+                     buffs: list,
+                     kind: HitKind = HitKind.DIRECT,
+                     chunk_size: int = 100000,
+                     rng=None):
+    """ Like generate_sample_hits, but yields the n hits as int64 arrays
+        of at most chunk_size hits. """
+    if rng is None:
+        rng = np.random.default_rng()
+    kernel = HitKernel(job, weaponinfo, playerstats, buffs)
+    yield from _iter_kernel_hits(kernel, potency, kind, n, rng, chunk_size)
+
+def accumulate(chunks, *accumulators):
+    """ Add every chunk to every accumulator. Returns the accumulators. """
+    for chunk in chunks:
+        for acc in accumulators:
+            acc.add(chunk)
+    return accumulators
+
+class Moments:
+    """ Count, mean, variance, min and max of integer samples.
+        Instead of Welford's running mean, this keeps the exact integer
+        sums of the values and of their squares. For integer damage that
+        has no rounding error at all, and merging shards is exact and
+        doesn't depend on the order. """
+    _INT64_MAX = (1 << 63) - 1
+
+    def __init__(self):
+        self.n = 0
+        self.total = 0
+        self.total_sq = 0
+        self.lo = None
+        self.hi = None
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.int64).ravel()
+        if not len(values):
+            return
+        lo, hi = int(values.min()), int(values.max())
+        self.n += len(values)
+        # int64 sums over blocks short enough that they can't overflow,
+        # or Python ints once a single square doesn't fit into an int64
+        largest = max(abs(lo), abs(hi), 1)
+        block = self._INT64_MAX // (largest * largest)
+        if block:
+            for i in range(0, len(values), block):
+                chunk = values[i:i + block]
+                self.total += int(chunk.sum())
+                self.total_sq += int(np.dot(chunk, chunk))
+        else:
+            values = values.tolist()
+            self.total += sum(values)
+            self.total_sq += sum(v * v for v in values)
+        self.lo = lo if self.lo is None else min(self.lo, lo)
+        self.hi = hi if self.hi is None else max(self.hi, hi)
+
+    def merge(self, other):
+        self.n += other.n
+        self.total += other.total
+        self.total_sq += other.total_sq
+        if other.lo is not None:
+            self.lo = other.lo if self.lo is None else min(self.lo, other.lo)
+        if other.hi is not None:
+            self.hi = other.hi if self.hi is None else max(self.hi, other.hi)
+
+    def mean(self):
+        return self.total / self.n
+
+    def variance(self):
+        """ Population variance. """
+        return (self.n * self.total_sq - self.total**2) / self.n**2
+
+    def std(self):
+        return self.variance()**0.5
+
+    def min(self):
+        return self.lo
+
+    def max(self):
+        return self.hi
+
+class FixedHistogram:
+    """ Histogram with fixed bins: bins equal-width bins over [lo, hi).
+        Values outside the range are counted in underflow/overflow. """
+    def __init__(self, lo, hi, bins=40):
+        self.lo = lo
+        self.hi = hi
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.underflow = 0
+        self.overflow = 0
+
+    def edges(self):
+        return np.linspace(self.lo, self.hi, len(self.counts) + 1)
+
+    def add(self, values):
+        values = np.asarray(values).ravel()
+        bins = len(self.counts)
+        idx = np.floor((values - self.lo) * bins / (self.hi - self.lo)).astype(np.int64)
+        self.underflow += int(np.count_nonzero(idx < 0))
+        self.overflow += int(np.count_nonzero(idx >= bins))
+        idx = idx[(idx >= 0) & (idx < bins)]
+        self.counts += np.bincount(idx, minlength=bins)
+
+    def merge(self, other):
+        if (self.lo, self.hi, len(self.counts)) != (other.lo, other.hi, len(other.counts)):
+            raise ValueError("Can only merge histograms with the same bins")
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+
+class AutoHistogram:
+    """ Histogram of integer values that grows its range as needed.
+        Bin i covers [(offset + i) * width, (offset + i + 1) * width).
+        Bins are aligned to multiples of width, and the width doubles
+        (combining pairs of bins) whenever the values seen so far would
+        need more than max_bins bins. The width is always the smallest
+        one that fits the values, so merging shards gives exactly the
+        same histogram as adding all the chunks to one accumulator. """
+    def __init__(self, width=1, max_bins=4096):
+        self.width = width
+        self.max_bins = max_bins
+        self.lo = None
+        self.hi = None
+        self.offset = 0
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def _bins_needed(self, lo, hi, width):
+        return hi // width - lo // width + 1
+
+    def _grow(self, lo, hi, width=None):
+        """ Take in the value range lo..hi, widening and extending the bins. """
+        if self.lo is not None:
+            lo, hi = min(lo, self.lo), max(hi, self.hi)
+        width = max(self.width, width or 0)
+        while self._bins_needed(lo, hi, width) > self.max_bins:
+            width *= 2
+        counts = np.zeros(self._bins_needed(lo, hi, width), dtype=np.int64)
+        if len(self.counts):
+            old = self.offset + np.arange(len(self.counts))
+            np.add.at(counts, old * self.width // width - lo // width, self.counts)
+        self.lo, self.hi = lo, hi
+        self.width = width
+        self.offset = lo // width
+        self.counts = counts
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.int64).ravel()
+        if not len(values):
+            return
+        self._grow(int(values.min()), int(values.max()))
+        self.counts += np.bincount(values // self.width - self.offset,
+                                   minlength=len(self.counts))
+
+    def merge(self, other):
+        if other.lo is None:
+            return
+        self._grow(other.lo, other.hi, other.width)
+        bins = other.offset + np.arange(len(other.counts))
+        np.add.at(self.counts, bins * other.width // self.width - self.offset, other.counts)
+
+    def edges(self):
+        return (self.offset + np.arange(len(self.counts) + 1)) * self.width
+
+    def quantiles(self, qs):
+        """ Lower edge of the bin each quantile falls in. """
+        cdf = np.cumsum(self.counts) / self.counts.sum()
+        idx = np.searchsorted(cdf, np.asarray(qs, dtype=float) - 1e-12)
+        return (self.offset + np.minimum(idx, len(self.counts) - 1)) * self.width
+
+class QuantileSketch:
+    """ Approximate quantiles with a fixed relative error.
+        Positive values go into logarithmic buckets: bucket k holds the
+        values in (gamma**(k-1), gamma**k], with gamma = (1+a)/(1-a) for
+        a relative accuracy a. Each bucket is reported as the value with
+        at most relative error a to all of its values. Buckets are only
+        counted, so merging shards is exact. (This is the DDSketch idea;
+        damage is never negative, so there is just a separate zero count.) """
+    def __init__(self, relative_accuracy=0.001):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.zeros = 0
+        self.buckets = {}
+
+    def add(self, values):
+        values = np.asarray(values).ravel()
+        positive = values[values > 0]
+        self.zeros += len(values) - len(positive)
+        keys = np.ceil(np.log(positive) / self._log_gamma).astype(np.int64)
+        uniq, counts = np.unique(keys, return_counts=True)
+        for k, c in zip(uniq.tolist(), counts.tolist()):
+            self.buckets[k] = self.buckets.get(k, 0) + c
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("Can only merge sketches with the same accuracy")
+        self.zeros += other.zeros
+        for k, c in other.buckets.items():
+            self.buckets[k] = self.buckets.get(k, 0) + c
+
+    @property
+    def n(self):
+        return self.zeros + sum(self.buckets.values())
+
+    def quantile(self, q):
+        rank = q * (self.n - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for k in sorted(self.buckets):
+            seen += self.buckets[k]
+            if rank < seen:
+                return 2 * self.gamma**k / (self.gamma + 1)
+        return 2 * self.gamma**max(self.buckets) / (self.gamma + 1)
+
+    def quantiles(self, qs):
+        return [self.quantile(q) for q in qs]
+
+class SampleCounts:
+    """ Number of sampled hits per damage value.
+        counts[i] is the number of hits that did offset + i damage. """
+    def __init__(self, offset, size):
+        self.offset = offset
+        self.counts = np.zeros(size, dtype=np.int64)
+
+    @property
+    def n(self):
+        return int(self.counts.sum())
+
+    def add(self, hits):
+        self.counts += np.bincount(hits - self.offset, minlength=len(self.counts))
+
+    def merge(self, other):
+        self.counts += other.counts
+
+    def values(self):
+        return self.offset + np.arange(len(self.counts))
+
+    def mean(self):
+        return float(np.dot(self.values(), self.counts) / self.n)
+
+    def variance(self):
+        mean = self.mean()
+        return float(np.dot((self.values() - mean)**2, self.counts) / self.n)
+
+    def min(self):
+        return int(self.offset + np.flatnonzero(self.counts)[0])
+
+    def max(self):
+        return int(self.offset + np.flatnonzero(self.counts)[-1])
+
+    def quantiles(self, qs):
+        cdf = np.cumsum(self.counts) / self.n
+        idx = np.searchsorted(cdf, np.asarray(qs, dtype=float) - 1e-12)
+        return self.offset + np.minimum(idx, len(self.counts) - 1)
+
+    def histogram(self, bins=40):
+        """ Same as np.histogram over the sampled hits. """
+        return np.histogram(self.values(), bins=bins,
+                            range=(self.min(), self.max()), weights=self.counts)
+
+    def to_distribution(self):
+        """ The empirical distribution as a DamageDistribution. """
+        nonzero = np.flatnonzero(self.counts)
+        return DamageDistribution((self.offset + nonzero).tolist(),
+                                  (self.counts[nonzero] / self.n).tolist())
+
+def _iter_kernel_hits(kernel, potency, kind, n, rng, chunk_size):
+    while n > 0:
+        m = min(n, chunk_size)
+        yield draw_kernel_hits(kernel, potency, kind, m, rng)
+        n -= m
+
+def _sample_task(kernel, potency, kind, n, seed, make_accumulator, batch_size):
+    """ Runs in a worker: draw n hits into a new accumulator. """
+    rng = np.random.default_rng(seed)
+    acc = make_accumulator()
+    accumulate(_iter_kernel_hits(kernel, potency, kind, n, rng, batch_size), acc)
+    return acc
+
+def run_parallel_samples(n: int,
+                         potency: int,
+                         job: str,
+                         weaponinfo: WeaponInfo,
+                         playerstats: PlayerStats,
+                         buffs: list,
+                         kind: HitKind = HitKind.DIRECT,
+                         seed=None,
+                         workers: int = None,
+                         chunk_size: int = 1000000,
+                         batch_size: int = 100000,
+                         accumulator=None):
+    """ Sample n hits on a process pool and return their SampleCounts.
+        Each chunk_size hits are one task with its own random stream.
+        Workers draw batch_size hits at a time. workers=1 runs everything
+        in this process.
+        accumulator can be any callable that makes an empty accumulator
+        (e.g. Moments or functools.partial(AutoHistogram, max_bins=256));
+        it has to be picklable to run on the pool. Every task fills its
+        own, and since merging does not depend on the order the result
+        is the same for any number of workers. """
+    kernel = HitKernel(job, weaponinfo, playerstats, buffs)
+    if accumulator is None:
+        lo, hi = kernel_damage_range(kernel, potency, kind)
+        accumulator = partial(SampleCounts, lo, hi - lo + 1)
+    sizes = [chunk_size] * (n // chunk_size)
+    if n % chunk_size:
+        sizes.append(n % chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = [(kernel, potency, kind, m, s, accumulator, batch_size)
+            for m, s in zip(sizes, seeds)]
+    total = accumulator()
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(args) <= 1:
+        for a in args:
+            total.merge(_sample_task(*a))
+    else:
+        # Only keep a few tasks per worker in flight, so finished
+        # accumulators never pile up in the parent
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+            for a in args:
+                if len(pending) >= 2 * workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        total.merge(future.result())
+                pending.add(executor.submit(_sample_task, *a))
+            for future in pending:
+                total.merge(future.result())
+    return total
+
+#################################################################
+# COMMON RANDOM NUMBERS                                         #
+#################################################################
+# A hit crits when its uniform crit draw is below the crit chance, so
+# with the same draws a variant with more crit chance crits on a superset
+# of the hits of one with less. The same goes for DH, and the random
+# variation is shared as is.
+
+@dataclass
+class Variant:
+    """ One setup to compare. buffs can be any list of Buffs. """
+    job: str
+    weaponinfo: WeaponInfo
+    playerstats: PlayerStats
+    buffs: tuple = ()
+    name: str = ""
+
+    def kernel(self):
+        return HitKernel(self.job, self.weaponinfo, self.playerstats, list(self.buffs))
+
+@dataclass
+class CommonDraws:
+    """ Random numbers for n samples of the same hits, shape (n, hits). """
+    crit: np.ndarray                # Uniform in [0, 1)
+    dh: np.ndarray                  # Uniform in [0, 1)
+    randvars: np.ndarray            # Random variation, 9500 to 10500
+
+def draw_common(n: int, n_hits: int, rng):
+    """ CommonDraws for n samples of n_hits hits each. """
+    dh = rng.random((n, n_hits))
+    crit = rng.random((n, n_hits))
+    randvars = rng.integers(9500, 10501, size=(n, n_hits))
+    return CommonDraws(crit, dh, randvars)
+
+def _hit_list(hits):
+    """ [(potency, kind)] from potencies and/or (potency, kind) pairs. """
+    result = []
+    for hit in hits:
+        if isinstance(hit, tuple):
+            result.append(hit)
+        else:
+            result.append((hit, HitKind.DIRECT))
+    return result
+
+def kernel_common_damage(kernel: HitKernel, hits, draws: CommonDraws):
+    """ Total damage of each of the n samples of hits with the given
+        draws, as an int64 array. Column j of the draws is hit j. """
+    hits = _hit_list(hits)
+    crits = draws.crit < kernel.critchance / 1000
+    dhs = draws.dh < kernel.dhchance / 1000
+    total = np.zeros(draws.randvars.shape[0], dtype=np.int64)
+    for j, (potency, kind) in enumerate(hits):
+        total += _kernel_hits(kernel, potency, kind,
+                              crits[:, j], dhs[:, j], draws.randvars[:, j])
+    return total
+
+@dataclass
+class PairedDifference:
+    """ Mean of variant - baseline over the paired samples, with a normal
+        confidence interval. """
+    name: str
+    n: int
+    mean: float
+    std_error: float
+    low: float
+    high: float
+    relative: float                 # mean / mean of the baseline
+
+    @property
+    def significant(self):
+        """ Whether the interval excludes zero. """
+        return self.low > 0 or self.high < 0
+
+@dataclass
+class ComparisonResult:
+    baseline: str
+    n: int
+    confidence: float
+    stopped_early: bool
+    means: dict                     # name -> mean damage per sample
+    differences: dict               # name -> PairedDifference, not the baseline
+
+def _paired_difference(name, moments, baseline_mean, z):
+    n = moments.n
+    mean = moments.mean()
+    if n > 1:
+        std_error = math.sqrt(max(0.0, moments.variance()) / (n - 1))
+    else:
+        std_error = math.inf
+    return PairedDifference(name, n, mean, std_error, mean - z * std_error,
+                            mean + z * std_error,
+                            mean / baseline_mean if baseline_mean else math.nan)
+
+def compare_variants(variants,
+                     hits,
+                     baseline: int = 0,
+                     confidence: float = 0.95,
+                     batch_size: int = 10000,
+                     min_samples: int = 10000,
+                     max_samples: int = 1000000,
+                     early_stop: bool = True,
+                     seed=None):
+    """ Compare variants on common random numbers. A sample is one of
+        each hit (a potency, or a (potency, HitKind) pair); every batch
+        draws batch_size samples and evaluates all variants on them.
+        Stops at max_samples, or with early_stop once there are
+        min_samples and every interval against the baseline variant
+        excludes zero. Since the intervals are looked at after every
+        batch, the chance of a false difference is somewhat higher than
+        1 - confidence; use a higher confidence when that matters.
+        variants are Variants or HitKernels; names default to the index. """
+    kernels = []
+    names = []
+    for i, variant in enumerate(variants):
+        if isinstance(variant, Variant):
+            kernels.append(variant.kernel())
+            names.append(variant.name or str(i))
+        else:
+            kernels.append(variant)
+            names.append(str(i))
+    if len(set(names)) != len(names):
+        raise ValueError("Variant names must be unique")
+    if not 0 <= baseline < len(kernels):
+        raise ValueError("baseline must be the index of one of the variants")
+    hits = _hit_list(hits)
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    rng = np.random.default_rng(seed)
+    totals = [Moments() for _ in kernels]
+    diffs = [Moments() for _ in kernels]
+    n = 0
+    stopped_early = False
+    while n < max_samples:
+        m = min(batch_size, max_samples - n)
+        draws = draw_common(m, len(hits), rng)
+        damage = [kernel_common_damage(kernel, hits, draws) for kernel in kernels]
+        for i in range(len(kernels)):
+            totals[i].add(damage[i])
+            if i != baseline:
+                diffs[i].add(damage[i] - damage[baseline])
+        n += m
+        if early_stop and n >= min_samples and n < max_samples:
+            baseline_mean = totals[baseline].mean()
+            if all(_paired_difference(names[i], diffs[i], baseline_mean, z).significant
+                   for i in range(len(kernels)) if i != baseline):
+                stopped_early = True
+                break
+    baseline_mean = totals[baseline].mean()
+    return ComparisonResult(
+        names[baseline], n, confidence, stopped_early,
+        {name: acc.mean() for name, acc in zip(names, totals)},
+        {names[i]: _paired_difference(names[i], diffs[i], baseline_mean, z)
+         for i in range(len(kernels)) if i != baseline})
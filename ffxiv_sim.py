@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+"""
+Event-driven fight simulator built on top of ffxiv_math.
+
+A fight is simulated in two steps:
+- FightSimulator.timeline() runs the rotation on a priority queue of
+  events (GCDs, oGCDs, DoT ticks, auto-attacks and buffs starting and
+  ending) and records every hit with its time, potency and the HitKernel
+  of the buffs active at that moment. DoTs snapshot the buffs when they
+  are applied, so their ticks keep the kernel of the application.
+- Timeline.roll() then rolls crit, DH and the random variation of every
+  hit with the kernels' batch methods, for as many fights as wanted.
+
+Nothing in the rotation depends on the damage rolls, so one timeline
+serves every variation of the fight, and a 10 minute fight only has to
+be scheduled once per stat set. Kernels are cached per buff combination,
+so a timeline only builds one kernel for each combination that occurs.
+
+Times are integer milliseconds. DoTs tick on a 3s server tick, and
+buff windows cover [start, start + duration). Buffs that only affect
+some damage types (e.g. Embolden) are left out of the kernels of the
+other hits: autos are physical, and actions are magical for casters and
+healers and physical for everyone else unless they say otherwise.
+"""
+
+from dataclasses import dataclass
+import heapq
+
+import numpy as np
+
+from ffxiv_math import (ActionCategory, Buff, CritType, DamageType, DHType,
+                        HitKernel, HitKind, PlayerStats, WeaponInfo,
+                        calc_gcdmod, is_caster, is_healer)
+
+# Time between two DoT ticks, in ms
+DOT_TICK = 3000
+
+# Order of events that happen at the same time: buffs end before they
+# start, and both before any hit of that moment
+_BUFF_OFF = 0
+_BUFF_ON = 1
+_ACTION = 2
+_GCD = 3
+_DOT_TICK = 4
+_AUTO = 5
+
+# Damage type of autos and of the physical jobs' actions. Nothing here
+# depends on which physical type it is
+PHYSICAL = DamageType.SLASHING
+
+@dataclass
+class Action:
+    name: str
+    potency: int = 0
+    gcd: bool = True            # False for oGCDs, which are woven
+    recast: int = 0             # Cooldown in ms, 0 for none
+    dot_potency: int = 0        # Potency of each tick of the DoT it applies
+    dot_duration: int = 0       # In ms
+    buff: Buff = None           # Buff it grants its user
+    buff_duration: int = 0      # In ms
+    forced_crit: bool = False
+    forced_dh: bool = False
+    damage_type: DamageType = None  # Of the hit and its DoT, None for the job's
+
+@dataclass
+class BuffWindow:
+    buff: Buff
+    start: int                  # In ms
+    duration: int               # In ms
+    name: str = ""
+    source: object = None       # Who provides it, for attribution
+
+def raid_buff_windows(buff: Buff,
+                      duration: int,
+                      interval: int = 120000,
+                      first: int = 0,
+                      fight_length: int = 600000,
+                      name: str = ""):
+    """ BuffWindows of a buff used every interval ms starting at first. """
+    return [BuffWindow(buff, start, duration, name)
+            for start in range(first, fight_length, interval)]
+
+class TimedRotation:
+    """ Uses each action at a fixed time: [(time in ms, Action), ...].
+        The times are used as given, without checking the GCD. """
+    uses_gcd = False
+
+    def __init__(self, entries):
+        self.entries = sorted(entries, key=lambda e: e[0])
+
+class PriorityRotation:
+    """ GCD-driven priority list.
+        On every GCD the first usable action of gcds is used: actions with
+        a recast must be off cooldown, and DoTs are only reapplied once
+        less than dot_refresh ms are left on them. The last GCD is the
+        filler and is always usable. After every GCD up to weaves oGCDs
+        that are off cooldown are woven, weave_delay ms apart. """
+    uses_gcd = True
+
+    def __init__(self, gcds, ogcds=(), weaves=2, weave_delay=700, dot_refresh=3000):
+        self.gcds = list(gcds)
+        self.ogcds = list(ogcds)
+        self.weaves = weaves
+        self.weave_delay = weave_delay
+        self.dot_refresh = dot_refresh
+
+    def choose_gcd(self, state):
+        for action in self.gcds[:-1]:
+            if not state.is_ready(action):
+                continue
+            if action.dot_potency and state.dot_remaining(action.name) >= self.dot_refresh:
+                continue
+            return action
+        return self.gcds[-1]
+
+    def choose_ogcds(self, state, time, next_gcd):
+        """ [(time, Action), ...] to weave between time and next_gcd. """
+        woven = []
+        t = time
+        for action in self.ogcds:
+            if len(woven) >= self.weaves:
+                break
+            t_weave = t + self.weave_delay
+            if t_weave >= next_gcd:
+                break
+            if state.is_ready(action, t_weave):
+                woven.append((t_weave, action))
+                # Reserve the cooldown so it isn't picked twice
+                state.cooldowns[action.name] = t_weave + action.recast
+                t = t_weave
+        return woven
+
+class FightState:
+    """ What the rotation can see during a fight. """
+    def __init__(self):
+        self.time = 0
+        self.cooldowns = {}     # Action name -> time it is ready again
+        self.dots = {}          # DoT name -> (application id, end time)
+
+    def is_ready(self, action, time=None):
+        if time is None:
+            time = self.time
+        return self.cooldowns.get(action.name, 0) <= time
+
+    def dot_remaining(self, name):
+        dot = self.dots.get(name)
+        if dot is None:
+            return 0
+        return max(0, dot[1] - self.time)
+
+class Timeline:
+    """ Every hit of a fight, in time order, as parallel lists.
+        kernels[kernel_ids[i]] is the snapshot hit i is computed with,
+        kernel_buffs[kernel_ids[i]] its buffs and kernel_sources[...] the
+        BuffWindow source of each (None for buffs players grant themselves). """
+    def __init__(self, fight_length):
+        self.fight_length = fight_length
+        self.kernels = []
+        self.kernel_buffs = []
+        self.kernel_sources = []
+        self.times = []
+        self.kinds = []
+        self.potencies = []
+        self.kernel_ids = []
+        self.forced_crits = []
+        self.forced_dhs = []
+        self.sources = []
+        self._groups = None
+
+    def __len__(self):
+        return len(self.times)
+
+    def _add(self, time, kind, potency, kernel_id, source,
+             forced_crit=False, forced_dh=False):
+        self.times.append(time)
+        self.kinds.append(kind)
+        self.potencies.append(potency)
+        self.kernel_ids.append(kernel_id)
+        self.forced_crits.append(forced_crit)
+        self.forced_dhs.append(forced_dh)
+        self.sources.append(source)
+        self._groups = None
+
+    def groups(self):
+        """ {(kernel id, kind, forced crit, forced DH): hit index array} """
+        if self._groups is None:
+            groups = {}
+            for i, key in enumerate(zip(self.kernel_ids, self.kinds,
+                                        self.forced_crits, self.forced_dhs)):
+                groups.setdefault(key, []).append(i)
+            self._groups = {k: np.array(v, dtype=np.int64) for k, v in groups.items()}
+        return self._groups
+
+    def roll_hits(self, n=1, rng=None):
+        """ Damage of every hit in n independent fights, shape (n, hits). """
+        return self.roll_outcomes(n, rng)[0]
+
+    def roll_outcomes(self, n=1, rng=None):
+        """ (damage, crits, dhs) of every hit in n independent fights,
+            each of shape (n, hits). Forced crits and DHs count as crits
+            and DHs. """
+        if rng is None:
+            rng = np.random.default_rng()
+        potencies = np.array(self.potencies, dtype=np.int64)
+        damage = np.zeros((n, len(self)), dtype=np.int64)
+        all_crits = np.zeros((n, len(self)), dtype=bool)
+        all_dhs = np.zeros((n, len(self)), dtype=bool)
+        for (kernel_id, kind, forced_crit, forced_dh), idx in self.groups().items():
+            kernel = self.kernels[kernel_id]
+            shape = (n, len(idx))
+            if forced_crit:
+                crits, crittype = True, CritType.ForcedCrit
+            else:
+                crits, crittype = rng.random(shape) < kernel.critchance / 1000, CritType.Crit
+            if forced_dh:
+                dhs, dhtype = True, DHType.ForcedDirectHit
+            else:
+                dhs, dhtype = rng.random(shape) < kernel.dhchance / 1000, DHType.DirectHit
+            randvars = rng.integers(9500, 10501, size=shape)
+            if kind is HitKind.DOT:
+                hits = kernel.dot_damage_batch(potencies[idx], crits, dhs, randvars,
+                                               crittype, dhtype)
+            elif kind is HitKind.AUTO:
+                hits = kernel.aa_damage_batch(crits, dhs, randvars, crittype, dhtype,
+                                              size=shape)
+            else:
+                hits = kernel.damage_batch(potencies[idx], crits, dhs, randvars,
+                                           crittype, dhtype)
+            damage[:, idx] = hits
+            all_crits[:, idx] = crits
+            all_dhs[:, idx] = dhs
+        return damage, all_crits, all_dhs
+
+    def roll(self, n=1, rng=None, batch=1000):
+        """ Total damage of n independent fights, batch fights at a time. """
+        if rng is None:
+            rng = np.random.default_rng()
+        totals = np.empty(n, dtype=np.int64)
+        for start in range(0, n, batch):
+            m = min(batch, n - start)
+            totals[start:start + m] = self.roll_hits(m, rng).sum(axis=1)
+        return totals
+
+    def roll_dps(self, n=1, rng=None, batch=1000):
+        return self.roll(n, rng, batch) / (self.fight_length / 1000)
+
+    def damage_by_source(self, hits):
+        """ {source: total damage} of one row of roll_hits. """
+        totals = {}
+        for source, damage in zip(self.sources, hits.tolist()):
+            totals[source] = totals.get(source, 0) + damage
+        return totals
+
+class FightSimulator:
+    """ Simulates fights for one job, weapon and stat set.
+        The GCD comes from calc_gcdmod, autos use weaponinfo.delay. """
+    def __init__(self,
+                 job: str,
+                 weaponinfo: WeaponInfo,
+                 playerstats: PlayerStats,
+                 base_gcd: int = 2500,
+                 haste: int = 0,
+                 auto_attacks: bool = True):
+        self.job = job
+        self.weaponinfo = weaponinfo
+        self.playerstats = playerstats
+        if is_healer(job) or is_caster(job):
+            speed = playerstats.speed(ActionCategory.SPELL)
+            self.damage_type = DamageType.MAGICAL
+        else:
+            speed = playerstats.speed(ActionCategory.WEAPONSKILL)
+            self.damage_type = PHYSICAL
+        self.gcd = round(calc_gcdmod(speed, base_gcd, playerstats.level, haste) * 1000)
+        # Weapon delay is in centiseconds
+        self.auto_delay = weaponinfo.delay * 10
+        self.auto_attacks = auto_attacks
+        self._kernels = {}
+
+    def kernel(self, buffs):
+        """ Cached HitKernel for a tuple of buffs. """
+        kernel = self._kernels.get(buffs)
+        if kernel is None:
+            kernel = self._kernels[buffs] = HitKernel(self.job, self.weaponinfo,
+                                                       self.playerstats, list(buffs))
+        return kernel
+
+    def timeline(self,
+                 rotation,
+                 buff_windows=(),
+                 fight_length: int = 600000,
+                 dot_tick_phase: int = 0):
+        """ Run the rotation for fight_length ms and return its Timeline.
+            dot_tick_phase is the time of the first server tick (mod 3s). """
+        timeline = Timeline(fight_length)
+        kernel_ids = {}
+        state = FightState()
+        # Active buffs: order key -> (application, Buff, source). Party
+        # buffs are ordered by their window, self buffs come after them by
+        # action name. A buff only ends if it wasn't reapplied since.
+        active = {}
+        events = []
+        seq = 0
+
+        def push(time, order, payload):
+            nonlocal seq
+            if time < fight_length:
+                heapq.heappush(events, (time, order, seq, payload))
+                seq += 1
+
+        def current_kernel_id(damage_type):
+            entries = tuple(active[k][1:] for k in sorted(active)
+                            if active[k][1].applies_to(damage_type))
+            kid = kernel_ids.get(entries)
+            if kid is None:
+                kid = kernel_ids[entries] = len(timeline.kernels)
+                buffs = tuple(e[0] for e in entries)
+                timeline.kernels.append(self.kernel(buffs))
+                timeline.kernel_buffs.append(buffs)
+                timeline.kernel_sources.append(tuple(e[1] for e in entries))
+            return kid
+
+        def use(time, action):
+            state.cooldowns[action.name] = time + action.recast
+            damage_type = action.damage_type
+            if damage_type is None:
+                damage_type = self.damage_type
+            kid = current_kernel_id(damage_type)
+            if action.potency:
+                timeline._add(time, HitKind.DIRECT, action.potency, kid, action.name,
+                              action.forced_crit, action.forced_dh)
+            if action.dot_potency:
+                # Snapshot the buffs now, and drop the ticks of an older
+                # application of the same DoT
+                app_id = seq
+                end = time + action.dot_duration
+                state.dots[action.name] = (app_id, end)
+                first_tick = time + (dot_tick_phase - time) % DOT_TICK
+                if first_tick == time:
+                    first_tick += DOT_TICK
+                for tick in range(first_tick, end + 1, DOT_TICK):
+                    push(tick, _DOT_TICK, (action, app_id, kid))
+            if action.buff is not None:
+                key = (1, action.name)
+                active[key] = (seq, action.buff, None)
+                push(time + action.buff_duration, _BUFF_OFF, (key, seq))
+            if not autos_started and self.auto_attacks:
+                start_autos(time)
+
+        autos_started = False
+
+        def start_autos(time):
+            nonlocal autos_started
+            autos_started = True
+            push(time, _AUTO, None)
+
+        for i, window in enumerate(buff_windows):
+            key = (0, i)
+            push(window.start, _BUFF_ON, (key, window.buff, window.source))
+            push(window.start + window.duration, _BUFF_OFF, (key, None))
+        if rotation.uses_gcd:
+            push(0, _GCD, None)
+        else:
+            for time, action in rotation.entries:
+                push(time, _ACTION, action)
+
+        while events:
+            time, order, _, payload = heapq.heappop(events)
+            state.time = time
+            if order == _BUFF_OFF:
+                key, app_id = payload
+                if key in active and active[key][0] == app_id:
+                    del active[key]
+            elif order == _BUFF_ON:
+                key, buff, source = payload
+                active[key] = (None, buff, source)
+            elif order == _ACTION:
+                use(time, payload)
+            elif order == _GCD:
+                action = rotation.choose_gcd(state)
+                use(time, action)
+                next_gcd = time + self.gcd
+                for t, ogcd in rotation.choose_ogcds(state, time, next_gcd):
+                    push(t, _ACTION, ogcd)
+                push(next_gcd, _GCD, None)
+            elif order == _DOT_TICK:
+                action, app_id, kid = payload
+                if state.dots.get(action.name, (None,))[0] == app_id:
+                    timeline._add(time, HitKind.DOT, action.dot_potency, kid,
+                                  action.name + " (DoT)")
+            else:
+                timeline._add(time, HitKind.AUTO, 0, current_kernel_id(PHYSICAL),
+                              "Auto-attack")
+                push(time + self.auto_delay, _AUTO, None)
+        return timeline
+
+    def simulate(self,
+                 rotation,
+                 buff_windows=(),
+                 fight_length: int = 600000,
+                 n: int = 1,
+                 rng=None):
+        """ DPS of n random fights. """
+        return self.timeline(rotation, buff_windows, fight_length).roll_dps(n, rng)
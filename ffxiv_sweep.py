@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Damage over a grid of levels, jobs, stat profiles and potencies.
+
+A StatProfile describes a player's stats relative to the level table
+(e.g. "main stat 8.6 times the level's MAIN, CRT 1.05 DIV above SUB"),
+so the same profile makes sense at every level, which is what level-
+synced content needs. sweep_damage evaluates calc_action_damage for the
+whole grid at once: the level modifiers come from the LEVEL_COLUMNS of
+the level table and the job modifiers from get_job_arrays(), and every
+floor happens in the same order (and with the same float round trips)
+as in calc_action_damage, so each row is exactly what it would return
+without buffs and with a random variation of 10000.
+
+The result is a NumPy structured array with one row per grid cell;
+sweep_columns turns it into a dict of columns, which e.g.
+pandas.DataFrame takes as is.
+"""
+
+from dataclasses import dataclass
+from math import floor
+
+import numpy as np
+
+# The level and job tables are module globals that load_game_data()
+# replaces, so they are read through the module when needed
+import ffxiv_math as fm
+from ffxiv_math import (CRT_DMG_MOD, CRT_RATE_MOD, DET_MOD, DH_MOD, STAT_NAMES,
+                        TNC_MOD, PlayerStats, Role, WeaponInfo, calc_atkpowermod,
+                        get_job_arrays, get_job_id, get_max_level)
+
+MAIN_STATS = ("STR", "DEX", "INT", "MND")
+
+@dataclass(frozen=True)
+class StatProfile:
+    """ Stats as a function of the level's (MAIN, SUB, DIV):
+        - the main stats (STR, DEX, INT, MND) are floor(main * MAIN)
+        - each substat in substats is its base (MAIN for DET and PIE,
+          SUB for the others) plus floor(x * DIV); the rest are at base
+        - the weapon damage is floor(weapon * MAIN) """
+    name: str
+    main: float = 1.0
+    substats: tuple = ()        # ((stat name, x), ...)
+    weapon: float = 0.0
+
+    def _columns(self, main, sub, div, floor_func):
+        columns = {name: main if name in ("VIT", "DET", "PIE") else sub
+                   for name in STAT_NAMES}
+        for name in MAIN_STATS:
+            columns[name] = floor_func(self.main * main)
+        for name, x in self.substats:
+            columns[name] = columns[name] + floor_func(x * div)
+        columns["WD"] = floor_func(self.weapon * main)
+        return columns
+
+    def stats(self, level):
+        """ (PlayerStats, WeaponInfo) of the profile at one level. """
+        main, sub, div = (fm.LEVEL_COLUMNS[c][level] for c in ("MAIN", "SUB", "DIV"))
+        columns = self._columns(main, sub, div, floor)
+        stats = PlayerStats(level, *(columns[name] for name in STAT_NAMES))
+        return stats, WeaponInfo(damage=columns["WD"])
+
+    def stat_arrays(self, levels):
+        """ {stat name: int64 array}, one value per level, plus "WD". """
+        main, sub, div = (_level_column(c, levels) for c in ("MAIN", "SUB", "DIV"))
+        columns = self._columns(main, sub, div,
+                                lambda x: np.floor(x).astype(np.int64))
+        return {name: np.broadcast_to(np.asarray(v, dtype=np.int64), levels.shape)
+                for name, v in columns.items()}
+
+BASE_PROFILE = StatProfile("base")
+# Roughly what best-in-slot gear gives at max level, scaled to any level
+GEARED_PROFILE = StatProfile("geared", main=8.6,
+                             substats=(("CRT", 1.05), ("DET", 0.88), ("DH", 0.4),
+                                       ("SKS", 0.1), ("SPS", 0.1), ("TNC", 0.2)),
+                             weapon=0.34)
+DEFAULT_PROFILES = (BASE_PROFILE, GEARED_PROFILE)
+
+SWEEP_DTYPE = np.dtype([
+    ("level", np.int64), ("job", "U3"), ("job_id", np.int64),
+    ("profile", "U16"), ("potency", np.int64),
+    ("main_stat", np.int64), ("weapon_damage", np.int64),
+    ("fatk", np.int64), ("fdet", np.int64), ("ftnc", np.int64),
+    ("fwd", np.int64), ("traitmod", np.int64),
+    ("critrate", np.int64), ("critmod", np.int64), ("dhrate", np.int64),
+    ("damage", np.int64),           # CritType.Normal, DHType.Normal
+    ("crit_damage", np.int64),      # CritType.Crit
+    ("dh_damage", np.int64),        # DHType.DirectHit
+    ("critdh_damage", np.int64),    # Both
+    ("expected", np.int64),         # CritType.Average, DHType.Average
+])
+
+# A column of the level table for the given levels, as an int64 array
+def _level_column(name, levels):
+    column = fm.LEVEL_COLUMNS[name]
+    return np.array([column[level] for level in levels], dtype=np.int64)
+
+# floor(a / b) with a true division, as in calc_action_damage
+def _floordiv(a, b):
+    return np.floor(a / b).astype(np.int64)
+
+def _chain(base, critmod, dhmod):
+    # The random chance part of calc_action_damage, randvar = 10000
+    damage = _floordiv(base * critmod, 1000000)
+    damage = _floordiv(damage * dhmod, 1000000)
+    return _floordiv(damage * 10000, 10000)
+
+def sweep_damage(potencies=(100,),
+                 jobs=None,
+                 profiles=DEFAULT_PROFILES,
+                 levels=None):
+    """ calc_action_damage (no buffs, random variation 10000) for every
+        level x job x profile x potency, as a SWEEP_DTYPE structured
+        array in that order (the potency varies fastest). jobs defaults
+        to every job of the job table, levels to the whole level table. """
+    if jobs is None:
+        jobs = list(fm.JOB_IDS)
+    if levels is None:
+        levels = range(1, get_max_level() + 1)
+    levels = np.asarray(list(levels), dtype=np.int64)
+    potencies = np.asarray(list(potencies), dtype=np.int64)
+    job_ids = np.array([get_job_id(job) for job in jobs], dtype=np.int64)
+    arrays = get_job_arrays()
+    L, J, P, K = len(levels), len(jobs), len(profiles), len(potencies)
+    # Every array below broadcasts to (L, J, P, K)
+    lv = levels[:, None, None, None]
+    main = _level_column("MAIN", levels)[:, None, None, None]
+    sub = _level_column("SUB", levels)[:, None, None, None]
+    div = _level_column("DIV", levels)[:, None, None, None]
+    jid = job_ids[None, :, None, None]
+    is_tank = arrays["role"][jid] == Role.TANK
+    traitmod = arrays["trait_mod"][jid]
+    # The attack power coefficient has level (and role) dependent
+    # branches; calc_atkpowermod is linear above its floor, so it gives
+    # the coefficient at 2 * MAIN
+    atk_coef = np.array([[calc_atkpowermod(2 * int(m), job, int(level)) - 100
+                          for job in jobs]
+                         for level, m in zip(levels, main.ravel())], dtype=np.int64)
+    atk_coef = atk_coef[:, :, None, None]
+    # Stats per level and profile
+    stats = {}
+    for p, profile in enumerate(profiles):
+        for name, values in profile.stat_arrays(levels).items():
+            stats.setdefault(name, np.empty((L, 1, P, 1), dtype=np.int64))
+            stats[name][:, 0, p, 0] = values
+    # The job's attack stat and its attribute modifier
+    attack_index = arrays["attack_stat"][job_ids]
+    main_names = [STAT_NAMES[i] for i in attack_index]
+    ap_stat = np.stack([stats[name][:, 0] for name in main_names], axis=1)
+    attr = np.array([arrays[name][j] for name, j in zip(main_names, job_ids)],
+                    dtype=np.int64)[None, :, None, None]
+    wd = stats["WD"]
+    # Modifiers, with the same float round trips as the scalar functions
+    fatk = _floordiv(atk_coef * (ap_stat - main), main) + 100
+    fdet = ((np.floor(DET_MOD * (stats["DET"] - main) / div) + 1000) / 1000 * 1000).astype(np.int64)
+    ftnc_tank = np.floor(1000 * ((1000 + np.floor(TNC_MOD * (stats["TNC"] - sub) / div)) / 1000)).astype(np.int64)
+    ftnc = np.where(is_tank, ftnc_tank, 1000)
+    fwd = np.floor(main * attr / 1000 + wd).astype(np.int64)
+    critmod = np.floor(1000 * ((1400 + np.floor(CRT_DMG_MOD * (stats["CRT"] - sub) / div)) / 1000)).astype(np.int64)
+    critrate = np.floor(1000 * ((np.floor(CRT_RATE_MOD * (stats["CRT"] - sub) / div) + 50) / 1000)).astype(np.int64)
+    dhrate = np.floor(1000 * (np.floor(DH_MOD * (stats["DH"] - sub) / div) / 1000)).astype(np.int64)
+    # Pre-random components
+    pot = potencies[None, None, None, :]
+    base = _floordiv(_floordiv(pot * fatk, 100) * fdet, 1000)
+    base = _floordiv(base * ftnc, 1000)
+    base = _floordiv(base * fwd, 100)
+    base = _floordiv(base * traitmod, 100)
+    crit = 1000 * critmod
+    avg_crit = 1000000 + (critmod - 1000) * critrate
+    avg_dh = 1000000 + 250 * dhrate
+    shape = (L, J, P, K)
+    result = np.empty(shape, dtype=SWEEP_DTYPE)
+    result["level"] = lv
+    result["job"] = np.array(jobs)[None, :, None, None]
+    result["job_id"] = jid
+    result["profile"] = np.array([p.name for p in profiles])[None, None, :, None]
+    result["potency"] = pot
+    result["main_stat"] = ap_stat
+    result["weapon_damage"] = wd
+    result["fatk"] = fatk
+    result["fdet"] = fdet
+    result["ftnc"] = ftnc
+    result["fwd"] = fwd
+    result["traitmod"] = traitmod
+    result["critrate"] = critrate
+    result["critmod"] = critmod
+    result["dhrate"] = dhrate
+    result["damage"] = _chain(base, 1000000, 1000000)
+    result["crit_damage"] = _chain(base, crit, 1000000)
+    result["dh_damage"] = _chain(base, 1000000, 1250000)
+    result["critdh_damage"] = _chain(base, crit, 1250000)
+    result["expected"] = _chain(base, avg_crit, avg_dh)
+    return result.reshape(-1)
+
+def sweep_columns(result):
+    """ {field name: 1-d array} of a sweep_damage result. """
+    return {name: result[name] for name in result.dtype.names}